@@ -5,9 +5,11 @@ import csv
 import os
 import time
 from collections import deque
+from frame_rle import RunLengthEncoder, REPEAT_COLUMN
+from log_schema import LOG_COLUMNS
 
 class Bot:
-    def __init__(self, enable_logging=True, log_frequency=1, buffer_size=50):
+    def __init__(self, enable_logging=True, log_frequency=1, buffer_size=50, rle=False):
         # Original bot code
         self.fire_code = ["<", "!<", "v+<", "!v+!<", "v", "!v", "v+>", "!v+!>", ">+Y", "!>+!Y"]
         self.exe_code = 0
@@ -21,8 +23,12 @@ class Bot:
         self.log_frequency = log_frequency
         self.buffer_size = buffer_size
         
+        # Change-only recording: frames identical apart from frame/timestamp become one row with a repeat count
+        self.rle = rle
+        self.rle_encoder = None
+        
         # Data collection setup
-        self.csv_file = "GameData.csv"
+        self.csv_file = "GameDataRLE.csv" if rle else "GameData.csv"
         self.create_csv_if_not_exists()
         self.frame_counter = 0
         self.session_id = int(time.time())  # Unique session ID based on timestamp
@@ -45,32 +51,15 @@ class Bot:
         # Reduce print statements
         self.verbose = False
         
-        print(f"Bot initialized with logging {'enabled' if enable_logging else 'disabled'}, frequency: every {log_frequency} frame(s), buffer size: {buffer_size}")
+        print(f"Bot initialized with logging {'enabled' if enable_logging else 'disabled'}, frequency: every {log_frequency} frame(s), buffer size: {buffer_size}{', change-only recording' if rle else ''}")
 
     def create_csv_if_not_exists(self):
         """Create the CSV file with headers if it doesn't exist"""
-        headers = [
-            'session_id', 'match_id', 'frame', 'timestamp',
-            'player_id', 'opponent_id', 
-            'player_health', 'opponent_health',
-            'player_x', 'player_y', 
-            'opponent_x', 'opponent_y',
-            'distance', 
-            # Group these fields consecutively as requested
-            'timer', 'has_round_started', 'is_round_over', 'winner',
-            'player_jumping', 'player_crouching',
-            'player_in_move', 'player_move_id',
-            'opponent_jumping', 'opponent_crouching',
-            'opponent_in_move', 'opponent_move_id',
-            # Player actions
-            'action_left', 'action_right', 'action_up', 'action_down',
-            'action_A', 'action_B', 'action_X', 'action_Y', 
-            'action_L', 'action_R', 'action_select', 'action_start',
-            # Opponent actions (new)
-            'opponent_left', 'opponent_right', 'opponent_up', 'opponent_down',
-            'opponent_A', 'opponent_B', 'opponent_X', 'opponent_Y',
-            'opponent_L', 'opponent_R', 'opponent_select', 'opponent_start'
-        ]
+        headers = LOG_COLUMNS
+        
+        if self.rle:
+            self.rle_encoder = RunLengthEncoder(headers)
+            headers = headers + [REPEAT_COLUMN]
         
         file_exists = os.path.isfile(self.csv_file)
         
@@ -341,12 +330,12 @@ class Bot:
                 
                 if keep_last > 0 and len(self.match_frames) > keep_last:
                     # Write all except the last 'keep_last' frames
-                    writer.writerows(self.match_frames[:-keep_last])
+                    writer.writerows(self.encode_frames(self.match_frames[:-keep_last]))
                     # Keep only the last 'keep_last' frames in memory
                     self.match_frames = self.match_frames[-keep_last:]
                 else:
                     # Write all frames
-                    writer.writerows(self.match_frames)
+                    writer.writerows(self.encode_frames(self.match_frames))
                     # Clear the frames list
                     self.match_frames = []
                 
@@ -359,14 +348,33 @@ class Bot:
         if keep_last == 0:
             self.match_ended = False
 
+    def encode_frames(self, frames, final=False):
+        """Return the rows to write for these frames: unchanged when recording densely, otherwise finished runs"""
+        if not self.rle:
+            return frames
+        
+        rows = []
+        for frame in frames:
+            finished = self.rle_encoder.push(frame)
+            if finished is not None:
+                rows.append(finished)
+        
+        # On a final flush also close the run that is still being counted
+        if final:
+            finished = self.rle_encoder.flush()
+            if finished is not None:
+                rows.append(finished)
+        return rows
+
     def flush_data(self):
         """Flush any remaining data to the CSV file"""
-        if self.match_frames:
+        # In change-only mode a run can still be open even when no frames are buffered
+        if self.match_frames or (self.rle and self.rle_encoder.has_pending):
             print(f"Flushing {len(self.match_frames)} remaining frames to CSV...")
             try:
                 with open(self.csv_file, 'a', newline='') as f:
                     writer = csv.writer(f)
-                    writer.writerows(self.match_frames)
+                    writer.writerows(self.encode_frames(self.match_frames, final=True))
                 self.match_frames = []
                 print("Data flushed successfully")
             except Exception as e:
@@ -1,40 +1,18 @@
-import socket
-import json
 import sys
 import keyboard
-from game_state import GameState
 from bot import Bot
 from buttons import Buttons
 import time
 import signal
-
-def connect(port):
-    # For making a connection with the game
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(("127.0.0.1", port))
-    server_socket.listen(5)
-    (client_socket, _) = server_socket.accept()
-    print("Connected to game!")
-    return client_socket
-
-def send(client_socket, command):
-    # This function will send your updated command to Bizhawk so that game reacts according to your command.
-    command_dict = command.object_to_dict()
-    pay_load = json.dumps(command_dict).encode()
-    client_socket.sendall(pay_load)
-
-def receive(client_socket):
-    # Receive the game state and return game state
-    pay_load = client_socket.recv(4096)
-    input_dict = json.loads(pay_load.decode())
-    game_state = GameState(input_dict)
-    return game_state
+from argv_options import pop_option
+from session_capture import pop_capture_arg
+from transport import open_transport
 
 class HumanController:
-    def __init__(self, player_id, enable_logging=True, log_frequency=1, buffer_size=50):
+    def __init__(self, player_id, enable_logging=True, log_frequency=1, buffer_size=50, rle=False):
         self.player_id = player_id
         self.human_buttons = Buttons()
-        self.bot = Bot(enable_logging=enable_logging, log_frequency=log_frequency, buffer_size=buffer_size)
+        self.bot = Bot(enable_logging=enable_logging, log_frequency=log_frequency, buffer_size=buffer_size, rle=rle)
         self.setup_keyboard_listeners()
         print(f"Human control mode activated for Player {player_id}")
         print("Controls: Arrow keys for movement, Z=A, X=B, A=X, S=Y, Q=L, W=R")
@@ -93,6 +71,11 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
+    # Optional raw capture of the socket traffic, replayable with session_capture.py
+    capture_path = pop_capture_arg(sys.argv)
+    # Connection to the game, see transport.py: tcp (default), shm or replay:<capture file>
+    transport_spec = pop_option(sys.argv, '--transport') or 'tcp'
+    
     mode = 1  # Default: Bot vs Bot
     player_id = sys.argv[1]
     
@@ -101,6 +84,9 @@ def main():
     log_frequency = 1  # Always log every frame
     buffer_size = 50  # Default buffer size
     
+    # Check for change-only (run-length) recording
+    rle = 'rle' in sys.argv[2:]
+    
     # Check for human control mode
     if len(sys.argv) > 2 and sys.argv[2] == 'human':
         mode = 3  # Human control mode
@@ -114,20 +100,17 @@ def main():
         print(f"Performance mode: Logging every frame with optimized disk writes")
     
     # Connect to the game
-    if player_id == '1':
-        client_socket = connect(9999)
-    elif player_id == '2':
-        client_socket = connect(10000)
-    else:
+    if player_id not in ('1', '2'):
         print("Invalid player ID. Use 1 or 2.")
         return
+    transport = open_transport(player_id, transport_spec, capture_path)
     
     # Initialize bot and human controller if needed
     global bot, human_controller
-    bot = Bot(enable_logging=enable_logging, log_frequency=log_frequency, buffer_size=buffer_size)
+    bot = Bot(enable_logging=enable_logging, log_frequency=log_frequency, buffer_size=buffer_size, rle=rle)
     human_controller = None
     if mode == 3:
-        human_controller = HumanController(player_id, enable_logging=enable_logging, log_frequency=log_frequency, buffer_size=buffer_size)
+        human_controller = HumanController(player_id, enable_logging=enable_logging, log_frequency=log_frequency, buffer_size=buffer_size, rle=rle)
     
     try:
         current_game_state = None
@@ -139,7 +122,7 @@ def main():
         
         while (current_game_state is None) or (not current_game_state.is_round_over):
             # Receive game state
-            current_game_state = receive(client_socket)
+            current_game_state = transport.receive()
             
             # Get command based on mode
             if mode == 3:  # Human control
@@ -148,7 +131,7 @@ def main():
                 bot_command = bot.fight(current_game_state, player_id)
             
             # Send command to game
-            send(client_socket, bot_command)
+            transport.send(bot_command)
             
             # FPS calculation
             frame_count += 1
@@ -187,8 +170,9 @@ def main():
         else:
             bot.flush_data()
             
-        client_socket.close()
+        transport.close()
         print("Connection closed")
+        transport.report()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
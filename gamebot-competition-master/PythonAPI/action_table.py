@@ -0,0 +1,317 @@
+import argparse
+import bisect
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from evaluate import load_thresholds, split_rows, thresholds_file
+from log_schema import FEATURES, TARGETS, read_log
+
+DEFAULT_TABLE_FILE = 'action_table.bin'
+DEFAULT_BUCKET = 8
+DEFAULT_MAX_ENTRIES = 1 << 24
+# Coordinates are bucketed; distance is recomputed from the bucketed coordinates; move ids are
+# looked up in the vocabulary of ids seen in the data; every other feature is kept exactly
+BUCKETED = ('player_x', 'player_y', 'opponent_x', 'opponent_y')
+DERIVED = 'distance'
+VOCABULARY = ('player_move_id', 'opponent_move_id')
+KEY_FEATURES = [name for name in FEATURES if name != DERIVED]
+MAGIC = b'SFAT'
+# Keys and masks start on this boundary after the header
+ALIGNMENT = 64
+
+
+def fit_spec(X_raw, bucket=DEFAULT_BUCKET):
+    """
+    Discretization of every key feature, from the ranges and move ids seen in recorded frames.
+
+    Args:
+        X_raw: (rows, features) raw feature matrix ordered as FEATURES
+        bucket: Width of the coordinate buckets in pixels
+
+    Returns:
+        List of per-feature dicts (name, kind, origin, step, size, values) in KEY_FEATURES order
+    """
+    spec = []
+    for name in KEY_FEATURES:
+        column = X_raw[:, FEATURES.index(name)]
+        if name in VOCABULARY:
+            values = np.unique(column).astype(np.int64).tolist()
+            spec.append({'name': name, 'kind': 'vocabulary', 'values': values, 'size': len(values)})
+        else:
+            step = bucket if name in BUCKETED else 1
+            origin = int(math.floor(column.min() / step) * step)
+            size = int((column.max() - origin) // step) + 1
+            spec.append({'name': name, 'kind': 'bucket' if step > 1 else 'exact', 'origin': origin,
+                         'step': step, 'size': size})
+    if math.prod(feature['size'] for feature in spec) >= 2**63:
+        raise ValueError("Discretized state space does not fit a 64-bit key; use wider buckets")
+    return spec
+
+
+def _strides(spec):
+    strides, stride = [], 1
+    for feature in spec:
+        strides.append(stride)
+        stride *= feature['size']
+    return strides
+
+
+def encode(spec, X_raw):
+    """
+    State keys of raw feature rows.
+
+    Returns:
+        (uint64 keys, bool mask of rows that fall inside the table's discretized space)
+    """
+    X_raw = np.asarray(X_raw, dtype=np.float64)
+    keys = np.zeros(len(X_raw), dtype=np.uint64)
+    inside = np.ones(len(X_raw), dtype=bool)
+    for feature, stride in zip(spec, _strides(spec)):
+        column = X_raw[:, FEATURES.index(feature['name'])]
+        if feature['kind'] == 'vocabulary':
+            values = np.array(feature['values'], dtype=np.float64)
+            codes = np.searchsorted(values, column).clip(0, len(values) - 1)
+            inside &= values[codes] == column
+        else:
+            codes = np.floor((column - feature['origin']) / feature['step']).astype(np.int64)
+            inside &= (codes >= 0) & (codes < feature['size'])
+            codes = codes.clip(0, feature['size'] - 1)
+        keys += codes.astype(np.uint64) * np.uint64(stride)
+    return keys, inside
+
+
+def decode(spec, keys):
+    """Representative raw feature rows of state keys: bucket centres, exact values, distance recomputed."""
+    keys = np.asarray(keys, dtype=np.uint64)
+    X_raw = np.zeros((len(keys), len(FEATURES)), dtype=np.float64)
+    for feature, stride in zip(spec, _strides(spec)):
+        codes = (keys // np.uint64(stride)) % np.uint64(feature['size'])
+        column = FEATURES.index(feature['name'])
+        if feature['kind'] == 'vocabulary':
+            X_raw[:, column] = np.array(feature['values'], dtype=np.float64)[codes.astype(np.int64)]
+        else:
+            offset = 0.5 if feature['kind'] == 'bucket' else 0.0
+            X_raw[:, column] = feature['origin'] + (codes.astype(np.float64) + offset) * feature['step']
+    # Same distance NeuralBot computes from the positions
+    X_raw[:, FEATURES.index(DERIVED)] = np.hypot(
+        X_raw[:, FEATURES.index('player_x')] - X_raw[:, FEATURES.index('opponent_x')],
+        X_raw[:, FEATURES.index('player_y')] - X_raw[:, FEATURES.index('opponent_y')])
+    return X_raw
+
+
+def button_masks(buttons):
+    """Pack (rows, 8) 0/1 button states into one byte per row, bit i for TARGETS[i]."""
+    return (np.asarray(buttons, dtype=np.uint8) << np.arange(len(TARGETS), dtype=np.uint8)).sum(axis=1,
+                                                                                                dtype=np.uint8)
+
+
+def unpack_mask(mask):
+    """Button states (one 0/1 per target) of a packed mask."""
+    return [(int(mask) >> i) & 1 for i in range(len(TARGETS))]
+
+
+def write_table(path, spec, keys, masks, meta):
+    """
+    Write the table: magic, header length, JSON header, then sorted uint64 keys and uint8 masks.
+
+    Both arrays start on an ALIGNMENT boundary so they can be memory mapped in place.
+    """
+    order = np.argsort(keys, kind='stable')
+    header = json.dumps({'spec': spec, 'entries': len(keys), 'meta': meta}).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGNMENT)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(np.ascontiguousarray(keys[order], dtype='<u8').tobytes())
+        f.write(np.ascontiguousarray(masks[order], dtype=np.uint8).tobytes())
+
+
+class ActionTable:
+    """
+    Memory-mapped map from discretized state key to packed button mask.
+
+    lookup() answers one frame with a binary search of the sorted keys; frames outside the
+    table's space or missing from it return None so the caller can fall back to the network.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Table written by write_table (action_table.py build)
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an action table")
+            header_length = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(header_length))
+        self.path = path
+        self.spec = header['spec']
+        self.meta = header['meta']
+        self.entries = header['entries']
+        if [feature['name'] for feature in self.spec] != KEY_FEATURES:
+            raise ValueError(f"{path} was built for other features")
+        offset = len(MAGIC) + 4 + header_length
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Plain ndarray views of the mapping: cheaper to index one element at a time than np.memmap
+        self.keys = np.frombuffer(self._mmap, dtype='<u8', count=self.entries, offset=offset)
+        self.masks = np.frombuffer(self._mmap, dtype=np.uint8, count=self.entries, offset=offset + 8 * self.entries)
+        # Plain Python per-feature encoding for single frames
+        self._columns = [FEATURES.index(feature['name']) for feature in self.spec]
+        self._strides = _strides(self.spec)
+        self._vocabularies = [{value: code for code, value in enumerate(feature['values'])}
+                              if feature['kind'] == 'vocabulary' else None for feature in self.spec]
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, x):
+        """State key of one raw feature vector, or None if it is outside the table's space."""
+        key = 0
+        for feature, column, stride, vocabulary in zip(self.spec, self._columns, self._strides,
+                                                       self._vocabularies):
+            if vocabulary is not None:
+                code = vocabulary.get(int(x[column]))
+                if code is None:
+                    return None
+            else:
+                code = int((x[column] - feature['origin']) // feature['step'])
+                if not 0 <= code < feature['size']:
+                    return None
+            key += code * stride
+        return key
+
+    def lookup(self, x):
+        """Packed button mask for one raw feature vector, or None on a miss."""
+        key = self.key(x)
+        if key is not None:
+            # bisect costs ~15 element reads; np.searchsorted's per-call overhead is larger for one key
+            i = bisect.bisect_left(self.keys, key)
+            if i < self.entries and int(self.keys[i]) == key:
+                self.hits += 1
+                return int(self.masks[i])
+        self.misses += 1
+        return None
+
+    def lookup_batch(self, X_raw):
+        """Packed masks of many rows and a bool array of which ones were found."""
+        keys, inside = encode(self.spec, X_raw)
+        index = np.searchsorted(self.keys, keys).clip(0, max(self.entries - 1, 0))
+        found = inside & (self.keys[index] == keys)
+        return np.where(found, self.masks[index], 0).astype(np.uint8), found
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Action table ({self.path}): {self.hits} hit(s), {self.misses} miss(es) ({rate:.1%} hit rate)")
+
+
+def build(data_path, model_path, scaler_path, thresholds_path, output, bucket=DEFAULT_BUCKET,
+          max_entries=DEFAULT_MAX_ENTRIES, batch_size=65536):
+    """
+    Compile the table from recorded frames and report its size, build time and hit rate.
+
+    The discretized space is enumerated whole when it has at most `max_entries` states;
+    otherwise the states of train_model.py's training split are used. Each state's mask is the
+    network's thresholded output at the state's representative features, computed in large
+    batches. Hit rate and agreement with the network are measured on the test split.
+    """
+    import joblib
+    import tensorflow as tf
+
+    from frame_rle import frame_weights
+
+    start = time.perf_counter()
+    df = read_log(data_path, required=FEATURES + TARGETS)
+    X_raw = df[FEATURES].to_numpy(dtype=np.float64)
+    w = frame_weights(df)
+    train_rows, _, test_rows = split_rows(len(X_raw))
+
+    spec = fit_spec(X_raw[train_rows], bucket)
+    space = math.prod(feature['size'] for feature in spec)
+    if space <= max_entries:
+        keys = np.arange(space, dtype=np.uint64)
+        source = 'enumerated'
+    else:
+        keys = np.unique(encode(spec, X_raw[train_rows])[0])
+        source = 'recorded'
+    print(f"Discretized space: {space:,} states ({bucket}px buckets); {len(keys):,} {source} states in the table")
+
+    model = tf.keras.models.load_model(model_path)
+    scaler = joblib.load(scaler_path)
+    thresholds_path = thresholds_path or thresholds_file(model_path)
+    if os.path.exists(thresholds_path):
+        thresholds = load_thresholds(thresholds_path, model_path)
+    else:
+        from nn_bot import DEFAULT_ACTIVATION_THRESHOLDS
+        thresholds = DEFAULT_ACTIVATION_THRESHOLDS
+        print(f"{thresholds_path} not found, using NeuralBot's default thresholds")
+    cutoffs = np.array([thresholds[target] for target in TARGETS])
+
+    def network_masks(rows):
+        masks = np.empty(len(rows), dtype=np.uint8)
+        for begin in range(0, len(rows), batch_size):
+            batch = scaler.transform(rows[begin:begin + batch_size]).astype(np.float32)
+            masks[begin:begin + batch_size] = button_masks(model(batch, training=False).numpy() > cutoffs)
+        return masks
+
+    masks = np.empty(len(keys), dtype=np.uint8)
+    for begin in range(0, len(keys), batch_size):
+        masks[begin:begin + batch_size] = network_masks(decode(spec, keys[begin:begin + batch_size]))
+    meta = {'model': os.path.basename(model_path), 'bucket': bucket, 'source': source, 'thresholds': thresholds}
+    write_table(output, spec, keys, masks, meta)
+    build_time = time.perf_counter() - start
+
+    table = ActionTable(output)
+    test_X, test_w = X_raw[test_rows], w[test_rows]
+    table_masks, found = table.lookup_batch(test_X)
+    exact = network_masks(test_X)
+    hit_rate = np.average(found, weights=test_w)
+    agreement = np.average(table_masks[found] == exact[found], weights=test_w[found]) if found.any() else 0.0
+
+    frames = [list(row) for row in test_X[:2000]]
+    begin = time.perf_counter()
+    for row in frames:
+        table.lookup(row)
+    lookup_us = (time.perf_counter() - begin) * 1e6 / len(frames)
+    print(f"Table written to {output}: {len(keys):,} entries, {os.path.getsize(output) / 2**20:.2f} MiB, "
+          f"built in {build_time:.1f}s")
+    print(f"Held-out frames: {hit_rate:.2%} hit rate, {agreement:.2%} of hits match the network's buttons; "
+          f"{lookup_us:.1f} us per lookup")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precomputed state -> buttons table for NeuralBot')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Compile the table from recorded frames')
+    build_parser.add_argument('--data', type=str, default='GameDataProcessed.csv', help='Processed CSV of recorded frames')
+    build_parser.add_argument('--model', type=str, default='ShadowFightBotMLP.keras',
+                              help='Model the table answers for (default: the one train_model.py writes)')
+    build_parser.add_argument('--scaler', type=str, default='scaler.joblib')
+    build_parser.add_argument('--thresholds', type=str, default=None,
+                              help='Per-button thresholds of the model (default: <model>.thresholds.json)')
+    build_parser.add_argument('--bucket', type=int, default=DEFAULT_BUCKET,
+                              help=f'Coordinate bucket width in pixels (default: {DEFAULT_BUCKET})')
+    build_parser.add_argument('--max-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                              help='Enumerate the whole space up to this many states, else use the recorded ones')
+    build_parser.add_argument('--output', type=str, default=DEFAULT_TABLE_FILE)
+
+    info_parser = subparsers.add_parser('info', help='Describe a table')
+    info_parser.add_argument('table', nargs='?', default=DEFAULT_TABLE_FILE)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.data, args.model, args.scaler, args.thresholds, args.output, args.bucket, args.max_entries)
+    else:
+        info = ActionTable(args.table)
+        print(f"{args.table}: {info.entries:,} entries, {os.path.getsize(args.table) / 2**20:.2f} MiB, {info.meta}")
+        for feature in info.spec:
+            detail = (f"{feature['size']} ids" if feature['kind'] == 'vocabulary'
+                      else f"{feature['size']} x {feature['step']} from {feature['origin']}")
+            print(f"  {feature['name']:<20} {feature['kind']:<10} {detail}")
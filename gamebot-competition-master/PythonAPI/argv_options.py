@@ -0,0 +1,19 @@
+import sys
+
+
+def pop_option(argv, option):
+    """
+    Remove an `<option> <value>` pair from the command line arguments and return the value.
+
+    The controllers parse their positional arguments by index, so options are taken out
+    before they look at sys.argv. Returns None if the option is not present.
+    """
+    if option not in argv:
+        return None
+    index = argv.index(option)
+    if index + 1 >= len(argv):
+        print(f"Error: {option} needs a value")
+        sys.exit(1)
+    value = argv[index + 1]
+    del argv[index:index + 2]
+    return value
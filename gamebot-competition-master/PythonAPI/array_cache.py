@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import joblib
+import numpy as np
+
+DEFAULT_ARRAY_CACHE_DIR = '.array_cache'
+# Bump whenever the prepared arrays of train_model.py change; entries of other versions are never hit
+ARRAYS_VERSION = 1
+ARRAY_FILES = ('X', 'y', 'w', 'train_rows', 'val_rows', 'test_rows', 'train_index', 'sample_weights')
+META_FILE = 'meta.json'
+SCALER_FILE = 'scaler.joblib'
+
+
+def file_source(path, use_hash=False):
+    """Identity of an input file: its size and mtime, or the SHA-1 of its bytes."""
+    if use_hash:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return {'sha1': digest.hexdigest()}
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ArrayCache:
+    """
+    Content-addressed store of the arrays train_model.py prepares before its first epoch.
+
+    An entry is a directory of .npy files (scaled features, targets, frame weights, the row
+    numbers of the train/validation/test splits, the oversampling index and the sample weights),
+    the fitted scaler and a JSON sidecar. Keys combine the inputs (as PreprocessCache keys them)
+    with every parameter the preparation depends on, so any change to one of them is a miss.
+    Hits are memory mapped, not read.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_ARRAY_CACHE_DIR, use_hash=False):
+        """
+        Args:
+            cache_dir: Directory holding the cached entries
+            use_hash: Key files by the SHA-1 of their content instead of their size and mtime
+        """
+        self.cache_dir = cache_dir
+        self.use_hash = use_hash
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, files, params):
+        """
+        Cache key for the prepared arrays.
+
+        Args:
+            files: Input files the rows come from
+            params: JSON-friendly preparation parameters (selection, splits, sampling settings)
+        """
+        description = {
+            'sources': [file_source(path, self.use_hash) for path in files],
+            'params': params,
+            'version': ARRAYS_VERSION,
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def lookup(self, key):
+        """
+        Memory map a cached entry.
+
+        Returns:
+            (dict of read-only arrays, scaler, meta) or None on a miss
+        """
+        entry = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in ARRAY_FILES}
+        return arrays, joblib.load(os.path.join(entry, SCALER_FILE)), meta
+
+    def store(self, key, arrays, scaler, meta):
+        """Write an entry; it is built in a temporary directory and renamed, so it is never seen half written."""
+        entry = os.path.join(self.cache_dir, key)
+        tmp_entry = entry + '.tmp'
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+        for name in ARRAY_FILES:
+            np.save(os.path.join(tmp_entry, name + '.npy'), arrays[name])
+        joblib.dump(scaler, os.path.join(tmp_entry, SCALER_FILE))
+        meta = {**meta, 'bytes': sum(arrays[name].nbytes for name in ARRAY_FILES), 'created': time.time()}
+        with open(os.path.join(tmp_entry, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=1)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+
+
+def clear_array_cache(cache_dir=DEFAULT_ARRAY_CACHE_DIR):
+    """Delete every cached entry. Returns the number of entries removed."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            removed += 1
+    return removed
@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+DEFAULT_CHECKPOINT_DIR = 'checkpoints'
+STATE_FILE = 'state.json'
+
+
+def scaler_state(scaler):
+    """JSON-friendly statistics of a fitted StandardScaler."""
+    return {
+        'mean': scaler.mean_.tolist(),
+        'var': scaler.var_.tolist(),
+        'scale': scaler.scale_.tolist(),
+        'n_samples_seen': int(np.max(scaler.n_samples_seen_)),
+    }
+
+
+class TrainingCheckpoint(tf.keras.callbacks.Callback):
+    """
+    Save everything needed to continue a run after every epoch.
+
+    The model weights and optimizer state go to a TF checkpoint; the scaler statistics, the data
+    the run was started on and the data cursor (the next epoch, which also fixes the batch order
+    of OversampledBatches) go to a JSON sidecar written after it.
+    """
+
+    def __init__(self, checkpoint_dir, scaler, data_info, max_to_keep=3):
+        """
+        Args:
+            checkpoint_dir: Directory of the checkpoints
+            scaler: Fitted StandardScaler the inputs are scaled with
+            data_info: JSON-friendly description of the training data (source, rows); resuming
+                       on different data is refused, so the refitted scaler matches the saved one
+            max_to_keep: Number of epoch checkpoints kept
+        """
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.scaler = scaler
+        self.data_info = data_info
+        self.max_to_keep = max_to_keep
+        self._manager = None
+
+    def _checkpoint_manager(self):
+        if self._manager is None:
+            checkpoint = tf.train.Checkpoint(model=self.model, optimizer=self.model.optimizer)
+            self._manager = tf.train.CheckpointManager(checkpoint, self.checkpoint_dir, max_to_keep=self.max_to_keep)
+        return self._manager
+
+    def restore(self, model):
+        """
+        Load the latest checkpoint into the model and its optimizer.
+
+        Returns:
+            The epoch to continue from (0 if there is no checkpoint)
+        """
+        self.set_model(model)
+        state_path = os.path.join(self.checkpoint_dir, STATE_FILE)
+        manager = self._checkpoint_manager()
+        if manager.latest_checkpoint is None or not os.path.exists(state_path):
+            print(f"No checkpoint in {self.checkpoint_dir}, starting from scratch")
+            return 0
+
+        with open(state_path) as f:
+            state = json.load(f)
+        if state['data'] != self.data_info:
+            raise ValueError(f"Checkpoint in {self.checkpoint_dir} was trained on {state['data']}, "
+                             f"not {self.data_info}")
+        # Optimizer slots are created lazily, so build them before restoring into them
+        model.optimizer.build(model.trainable_variables)
+        manager.checkpoint.restore(manager.latest_checkpoint).assert_existing_objects_matched()
+        print(f"Resumed from {manager.latest_checkpoint} at epoch {state['epoch']}")
+        return state['epoch']
+
+    def on_epoch_end(self, epoch, logs=None):
+        path = self._checkpoint_manager().save(checkpoint_number=epoch + 1)
+        state = {
+            'epoch': epoch + 1,
+            'checkpoint': os.path.basename(path),
+            'scaler': scaler_state(self.scaler),
+            'data': self.data_info,
+            'logs': {name: float(value) for name, value in (logs or {}).items()},
+        }
+        tmp_path = os.path.join(self.checkpoint_dir, STATE_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.checkpoint_dir, STATE_FILE))
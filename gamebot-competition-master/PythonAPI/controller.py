@@ -1,6 +1,3 @@
-import socket
-import json
-from game_state import GameState
 #from bot import fight
 import sys
 from bot import Bot
@@ -9,29 +6,11 @@ import os
 import time
 import math
 import random
-
-def connect(port):
-    #For making a connection with the game
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(("127.0.0.1", port))
-    server_socket.listen(5)
-    (client_socket, _) = server_socket.accept()
-    print ("Connected to game!")
-    return client_socket
-
-def send(client_socket, command):
-    #This function will send your updated command to Bizhawk so that game reacts according to your command.
-    command_dict = command.object_to_dict()
-    pay_load = json.dumps(command_dict).encode()
-    client_socket.sendall(pay_load)
-
-def receive(client_socket):
-    #receive the game state and return game state
-    pay_load = client_socket.recv(4096)
-    input_dict = json.loads(pay_load.decode())
-    game_state = GameState(input_dict)
-
-    return game_state
+from frame_rle import RunLengthWriter, REPEAT_COLUMN
+from log_schema import LOG_COLUMNS
+from argv_options import pop_option
+from session_capture import pop_capture_arg
+from transport import TRANSPORT_HELP, open_transport
 
 def collect_game_data(game_state, bot_command, data_collector, session_id, match_id, frame_counter, player_id):
     """Collect game state and button press data for training a neural network model."""
@@ -109,7 +88,7 @@ def collect_game_data(game_state, bot_command, data_collector, session_id, match
     
     # Map data to the required columns, matching the format in the example
     game_data = {
-        'session_id': int(time.time()),  # Use current timestamp as session_id
+        'session_id': session_id,  # Timestamp taken when the session started
         'match_id': 0,  # Set to 0 as in the example
         'frame': frame_counter,
         'timestamp': int(time.time()),
@@ -197,9 +176,17 @@ def check_opponent_buttons(game_state, player_id):
     return
 
 def main():
+    # Optional raw capture of the socket traffic, replayable with session_capture.py
+    capture_path = pop_capture_arg(sys.argv)
+    # Connection to the game, see transport.py
+    transport_spec = pop_option(sys.argv, '--transport') or 'tcp'
+    
     if len(sys.argv) < 2:
-        print("Usage: python controller.py <player_id>")
+        print("Usage: python controller.py <player_id> [rle] [--capture <file>] [--transport <kind>]")
         print("  player_id: 1 for Player 1 (Left Side), 2 for Player 2 (Right Side)")
+        print("  rle: only record frames whose state or buttons changed, with a repeat count")
+        print("  --capture: record the raw socket traffic for replay with session_capture.py")
+        print(f"  --transport: {TRANSPORT_HELP}")
         sys.exit(1)
         
     player_id = sys.argv[1]
@@ -207,15 +194,17 @@ def main():
     # Validate player_id
     if player_id not in ['1', '2']:
         print("Error: Player ID must be '1' (Left Side) or '2' (Right Side)")
-        print("Usage: python controller.py <player_id>")
+        print("Usage: python controller.py <player_id> [rle]")
         sys.exit(1)
     
+    # Change-only recording: a keyframe per run of identical frames plus its repeat count
+    rle_mode = len(sys.argv) > 2 and sys.argv[2] == 'rle'
+    
     if player_id == '1':
         print("Initializing data collection for Player 1 (Left Side)")
-        client_socket = connect(9999)
     else:  # player_id == '2'
         print("Initializing data collection for Player 2 (Right Side)")
-        client_socket = connect(10000)
+    transport = open_transport(player_id, transport_spec, capture_path)
     
     current_game_state = None
     
@@ -226,30 +215,26 @@ def main():
     
     # Create data collection file
     timestamp = time.strftime("%Y%m%d-%H%M%S")
-    data_file_path = f"game_data_{player_id}_{timestamp}.csv"
+    if rle_mode:
+        data_file_path = f"game_data_{player_id}_{timestamp}_rle.csv"
+    else:
+        data_file_path = f"game_data_{player_id}_{timestamp}.csv"
     
     # Create CSV writer with all required columns
     with open(data_file_path, 'w', newline='') as csvfile:
-        fieldnames = [
-            'session_id', 'match_id', 'frame', 'timestamp', 'player_id', 'opponent_id',
-            'player_health', 'opponent_health', 'player_x', 'player_y', 'opponent_x', 
-            'opponent_y', 'distance', 'timer', 'has_round_started', 'is_round_over', 
-            'winner', 'player_jumping', 'player_crouching', 'player_in_move', 
-            'player_move_id', 'opponent_jumping', 'opponent_crouching', 'opponent_in_move', 
-            'opponent_move_id', 'action_left', 'action_right', 'action_up', 'action_down', 
-            'action_A', 'action_B', 'action_X', 'action_Y', 'action_L', 'action_R', 
-            'action_select', 'action_start', 'opponent_left', 'opponent_right', 
-            'opponent_up', 'opponent_down', 'opponent_A', 'opponent_B', 'opponent_X', 
-            'opponent_Y', 'opponent_L', 'opponent_R', 'opponent_select', 'opponent_start'
-        ]
-        data_collector = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        fieldnames = LOG_COLUMNS
+        if rle_mode:
+            data_collector = RunLengthWriter(
+                csv.DictWriter(csvfile, fieldnames=fieldnames + [REPEAT_COLUMN]), fieldnames)
+        else:
+            data_collector = csv.DictWriter(csvfile, fieldnames=fieldnames)
         data_collector.writeheader()
         
         bot = Bot()
         print(f"Data collection started. Saving to {data_file_path}")
         
         # First, receive a game state to check opponent data
-        test_game_state = receive(client_socket)
+        test_game_state = transport.receive()
         check_opponent_buttons(test_game_state, player_id)
         
         try:
@@ -272,10 +257,10 @@ def main():
                 )
                 
                 # Send command to the game
-                send(client_socket, bot_command)
+                transport.send(bot_command)
                 
                 # Get the next game state
-                current_game_state = receive(client_socket)
+                current_game_state = transport.receive()
                 
             print(f"Round complete. Data collection finished.")
             
@@ -286,6 +271,13 @@ def main():
             import traceback
             traceback.print_exc()
         finally:
+            if rle_mode:
+                # Write out the run that was still being counted
+                data_collector.flush()
+            transport.close()
+            transport.report()
+            if capture_path:
+                print(f"Socket capture saved to {capture_path}")
             print(f"Data saved to {data_file_path}")
             print(f"Total frames collected: {frame_counter - 1}")  # Subtract 1 as we start from frame 1
 
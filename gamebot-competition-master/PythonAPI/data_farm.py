@@ -0,0 +1,192 @@
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from frame_rle import RunLengthWriter
+from log_schema import LOG_COLUMNS, REPEAT_COLUMN
+from simulator import FightSimulator, fight, make_bot
+
+DEFAULT_FARM_DIR = 'farm_data'
+DEFAULT_SHARD_ROWS = 200_000
+MANIFEST_FILE = 'farm.json'
+# Session ids reserved for every shard: one session per recorded side of a round
+SESSION_BLOCK = 100_000
+
+
+class _RowBuffer:
+    """csv writer stand-in that keeps the rows of one round in memory."""
+
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+def load_manifest(farm_dir):
+    path = os.path.join(farm_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'shards': [], 'next_session_id': 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(farm_dir, manifest):
+    path = os.path.join(farm_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def generate_shard(path, target_rows, seed, first_session, sides=('1', '2'), rle=False, max_frames=None):
+    """
+    Play rule Bot against rule Bot in the simulator until `target_rows` frames are recorded (run in a worker).
+
+    Every recorded side of a round is its own session, written as controller.py records it
+    (collect_game_data) with the next session id of the shard's block; the rows of one
+    session are contiguous, so session_catalog.py indexes them as one segment each. Whole
+    rounds are kept, so a shard ends with at most one round more than asked for. The shard is
+    written under a temporary name and renamed when complete.
+
+    Args:
+        path: Shard CSV to write
+        target_rows: Frames to record (rows of the dense format)
+        seed: Seed of the simulator and of the bots' NumPy randomness
+        first_session: First session id of the shard's block of SESSION_BLOCK ids
+        sides: Players whose side is recorded ('1', '2' or both)
+        rle: Write change-only rows with a repeat count, as controller.py's rle mode
+        max_frames: Cut rounds after this many frames
+
+    Returns:
+        Dict describing the shard
+    """
+    from controller import collect_game_data
+
+    np.random.seed(seed)
+    simulator = FightSimulator(seed=seed)
+    fieldnames = LOG_COLUMNS + [REPEAT_COLUMN] if rle else LOG_COLUMNS
+    session_id = first_session
+    frames = rows = rounds = 0
+    start = time.perf_counter()
+    with open(path + '.tmp', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        while frames < target_rows and session_id + len(sides) <= first_session + SESSION_BLOCK:
+            buffers = {side: _RowBuffer() for side in sides}
+            collectors = {side: RunLengthWriter(buffers[side], LOG_COLUMNS) if rle else buffers[side]
+                          for side in sides}
+            sessions = {side: session_id + i for i, side in enumerate(sides)}
+            counters = {side: 1 for side in sides}
+
+            def record(game_state, command1, command2):
+                for side in sides:
+                    command = command1 if side == '1' else command2
+                    counters[side] = collect_game_data(game_state, command, collectors[side], sessions[side], 0,
+                                                       counters[side], side)
+
+            # The rule bot keeps its input sequence between frames, so every round starts with fresh bots
+            fight(make_bot('rule'), make_bot('rule'), simulator, max_frames, on_frame=record)
+            for side in sides:
+                if rle:
+                    collectors[side].flush()
+                writer.writerows(buffers[side].rows)
+                rows += len(buffers[side].rows)
+                frames += counters[side] - 1
+            session_id += len(sides)
+            rounds += 1
+    os.replace(path + '.tmp', path)
+    return {
+        'file': os.path.basename(path), 'seed': seed, 'rounds': rounds, 'frames': frames, 'rows': rows,
+        'sessions': [first_session, session_id - 1], 'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def farm(farm_dir=DEFAULT_FARM_DIR, target_rows=1_000_000, shard_rows=DEFAULT_SHARD_ROWS, workers=None, seed=0,
+         sides=('1', '2'), rle=False, max_frames=None):
+    """
+    Generate self-play training logs on all cores, one shard per task.
+
+    Shards are numbered after those already listed in the farm directory's manifest, and every
+    shard gets its own seed (seed + shard number) and its own block of session ids, starting
+    above every id handed out before and above the current time in milliseconds (far from the
+    second-resolution ids of controller.py recordings), so ids never repeat across runs.
+
+    Args:
+        farm_dir: Output directory; the manifest (farm.json) lists every shard written to it
+        target_rows: Frames to generate in total
+        shard_rows: Frames per shard
+        workers: Worker processes (default: number of CPU cores)
+        seed: Base seed
+        sides: Players whose side is recorded
+        rle: Write change-only rows with a repeat count
+        max_frames: Cut rounds after this many frames
+
+    Returns:
+        The updated manifest
+    """
+    os.makedirs(farm_dir, exist_ok=True)
+    manifest = load_manifest(farm_dir)
+    first_shard = len(manifest['shards'])
+    shards = math.ceil(target_rows / shard_rows)
+    first_session = max(manifest['next_session_id'], int(time.time() * 1000))
+    workers = min(workers or os.cpu_count() or 1, shards)
+    tasks = []
+    for i in range(shards):
+        number = first_shard + i
+        rows = min(shard_rows, target_rows - i * shard_rows)
+        path = os.path.join(farm_dir, f'game_data_farm_{number:05d}{"_rle" if rle else ""}.csv')
+        tasks.append((path, rows, seed + number, first_session + i * SESSION_BLOCK, tuple(sides), rle, max_frames))
+    print(f"Generating {target_rows} frames in {shards} shard(s) of up to {shard_rows} on {workers} worker(s)")
+
+    start = time.perf_counter()
+    written = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(generate_shard, *task) for task in tasks]
+        for finished, future in enumerate(as_completed(futures), 1):
+            shard = future.result()
+            written.append(shard)
+            print(f"[{finished}/{shards}] {shard['file']}: {shard['rounds']} rounds, {shard['frames']} frames, "
+                  f"{shard['rows']} rows, sessions {shard['sessions'][0]}-{shard['sessions'][1]}, "
+                  f"{shard['frames'] / shard['seconds']:.0f} frames/s")
+    elapsed = time.perf_counter() - start
+
+    manifest['shards'].extend(sorted(written, key=lambda shard: shard['file']))
+    manifest['next_session_id'] = first_session + shards * SESSION_BLOCK
+    save_manifest(farm_dir, manifest)
+
+    frames = sum(shard['frames'] for shard in written)
+    rows = sum(shard['rows'] for shard in written)
+    ranges = sorted(tuple(shard['sessions']) for shard in manifest['shards'])
+    overlapping = sum(1 for a, b in zip(ranges, ranges[1:]) if b[0] <= a[1])
+    print(f"\n{frames} frames ({rows} rows) in {elapsed:.1f}s with {workers} worker(s): "
+          f"{frames / elapsed:.0f} rows/s")
+    print(f"{len(manifest['shards'])} shard(s) in {farm_dir}, "
+          f"{sum(shard['sessions'][1] - shard['sessions'][0] + 1 for shard in manifest['shards'])} session ids, "
+          f"{'no' if not overlapping else overlapping} overlapping id range(s)")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate rule Bot self-play training logs in the simulator')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Frames to generate (default: 1000000)')
+    parser.add_argument('--output', type=str, default=DEFAULT_FARM_DIR,
+                        help=f'Output directory, added to if it exists (default: {DEFAULT_FARM_DIR})')
+    parser.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS,
+                        help=f'Frames per shard file (default: {DEFAULT_SHARD_ROWS})')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Base seed; shard i uses seed + i (default: 0)')
+    parser.add_argument('--sides', choices=['1', '2', 'both'], default='both',
+                        help='Player side(s) recorded from every round (default: both)')
+    parser.add_argument('--rle', action='store_true', help='Record change-only rows with a repeat count')
+    parser.add_argument('--max-frames', type=int, default=None, help='Cut rounds after this many frames')
+    args = parser.parse_args()
+
+    farm(args.output, args.rows, args.shard_rows, args.workers, args.seed,
+         ('1', '2') if args.sides == 'both' else (args.sides,), args.rle, args.max_frames)
@@ -0,0 +1,318 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import tensorflow as tf
+from sklearn.preprocessing import StandardScaler
+
+from log_schema import FEATURES, REPEAT_COLUMN, TARGETS, read_log, validate_columns
+from preprocess_data import read_header
+from sampling import (OVERSAMPLE_FACTORS, WEIGHT_MULTIPLIERS, class_counts, class_weight_table,
+                      class_weights_from_counts, gather_sample_weights, row_multiplicity)
+
+# Binary shard record: the features, the targets and the frame weight, all float32
+RECORD_FIELDS = len(FEATURES) + len(TARGETS) + 1
+RECORD_BYTES = RECORD_FIELDS * 4
+BINARY_SUFFIX = '.bin'
+
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_SHUFFLE_BUFFER = 100_000
+# Lines decoded per tf.io.decode_csv call
+PARSE_BATCH = 1024
+
+
+def list_shards(pattern):
+    """Sorted shard paths matching a glob pattern (processed CSV or binary shards, not mixed)."""
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"No shards match {pattern}")
+    kinds = {path.endswith(BINARY_SUFFIX) for path in paths}
+    if len(kinds) > 1:
+        raise ValueError(f"{pattern} mixes CSV and binary shards")
+    return paths
+
+
+def _is_binary(paths):
+    return paths[0].endswith(BINARY_SUFFIX)
+
+
+def iter_shard_chunks(paths, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Yield (X, y, frame weights) NumPy chunks from CSV or binary shards, in shard order.
+
+    Only one chunk is in memory at a time; binary shards are memory mapped.
+    """
+    for path in paths:
+        if path.endswith(BINARY_SUFFIX):
+            records = np.memmap(path, dtype=np.float32, mode='r').reshape(-1, RECORD_FIELDS)
+            for start in range(0, len(records), chunksize):
+                block = np.asarray(records[start:start + chunksize])
+                yield (block[:, :len(FEATURES)], block[:, len(FEATURES):-1].astype(np.int8),
+                       block[:, -1].astype(np.float64))
+        else:
+            for chunk in read_log(path, chunksize=chunksize, required=FEATURES + TARGETS):
+                w = (chunk[REPEAT_COLUMN].fillna(1).to_numpy(dtype=np.float64) if REPEAT_COLUMN in chunk.columns
+                     else np.ones(len(chunk)))
+                yield chunk[FEATURES].to_numpy(dtype=np.float32), chunk[TARGETS].to_numpy(), w
+
+
+def write_binary_shards(input_pattern, output_dir, rows_per_shard=1_000_000, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Convert processed CSV files into fixed-size binary shards for the pipeline.
+
+    Returns:
+        List of shard paths written
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shard_paths = []
+    out = None
+    rows_in_shard = 0
+    for X, y, w in iter_shard_chunks(list_shards(input_pattern), chunksize):
+        block = np.hstack([X, y, w[:, None]]).astype(np.float32)
+        while len(block):
+            if out is None:
+                shard_paths.append(os.path.join(output_dir, f'shard_{len(shard_paths):05d}{BINARY_SUFFIX}'))
+                out = open(shard_paths[-1], 'wb')
+                rows_in_shard = 0
+            take = min(len(block), rows_per_shard - rows_in_shard)
+            out.write(block[:take].tobytes())
+            rows_in_shard += take
+            block = block[take:]
+            if rows_in_shard == rows_per_shard:
+                out.close()
+                out = None
+    if out is not None:
+        out.close()
+    return shard_paths
+
+
+class StreamingScaler:
+    """
+    Feature mean and variance accumulated chunk by chunk (Welford / Chan et al. parallel update).
+
+    Also counts button classes, weighted by the oversampling multiplicity of each row, so the
+    class weights can be derived in the same pass.
+    """
+
+    def __init__(self, n_features=len(FEATURES), n_targets=len(TARGETS)):
+        self.n = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.class_counts = np.zeros((n_targets, 2), dtype=np.int64)
+
+    def partial_fit(self, X, y=None):
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) == 0:
+            return self
+        n_b = len(X)
+        mean_b = X.mean(axis=0)
+        m2_b = ((X - mean_b) ** 2).sum(axis=0)
+        delta = mean_b - self.mean
+        total = self.n + n_b
+        self.mean = self.mean + delta * n_b / total
+        self.m2 = self.m2 + m2_b + delta ** 2 * self.n * n_b / total
+        self.n = total
+        if y is not None:
+            self.class_counts += class_counts(y, row_multiplicity(y))
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / self.n if self.n else self.m2
+
+    def to_standard_scaler(self):
+        """A fitted sklearn StandardScaler with these statistics, as saved to scaler.joblib."""
+        scaler = StandardScaler()
+        scaler.mean_ = self.mean.copy()
+        scaler.var_ = self.var.copy()
+        scale = np.sqrt(scaler.var_)
+        scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0  # constant features, as sklearn does
+        scaler.scale_ = scale
+        scaler.n_samples_seen_ = self.n
+        scaler.n_features_in_ = len(self.mean)
+        return scaler
+
+
+def fit_streaming(paths, chunksize=DEFAULT_CHUNKSIZE):
+    """One pass over the shards. Returns (StandardScaler, class weight table)."""
+    stats = StreamingScaler()
+    for X, y, _ in iter_shard_chunks(paths, chunksize):
+        stats.partial_fit(X, y)
+    table = class_weight_table(class_weights_from_counts(stats.class_counts, TARGETS, WEIGHT_MULTIPLIERS))
+    return stats.to_standard_scaler(), table
+
+
+def _oversample_multipliers():
+    multipliers = np.zeros(len(TARGETS), dtype=np.float32)
+    for target, factor in OVERSAMPLE_FACTORS.items():
+        multipliers[TARGETS.index(target)] = factor - 1
+    return multipliers
+
+
+def make_dataset(paths, scaler, weight_table=None, batch_size=32, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER,
+                 seed=None, parallel_files=4):
+    """
+    tf.data pipeline yielding (scaled X, y, sample weight) batches straight from the shards.
+
+    Shards are read in parallel (interleave) and decoded in parallel batches of lines, then
+    scaled with the fitted scaler. The sample weight is the frame weight times the row's class
+    weight (max over its buttons, as in train_model.py); with a weight table the row's
+    oversampling multiplicity is folded into the weight as well, since rows cannot be repeated
+    without holding them in memory.
+
+    Args:
+        paths: Shard paths from list_shards
+        scaler: Fitted StandardScaler
+        weight_table: (buttons, 2) class weight table, or None for frame weights only
+        batch_size: Rows per batch
+        shuffle_buffer: Rows held in the shuffle buffer; 0 keeps the shard order
+        seed: Shuffle seed
+        parallel_files: Shards read concurrently (1 when not shuffling, to keep the file order)
+    """
+    n_features = len(FEATURES)
+    mean = tf.constant(scaler.mean_, dtype=tf.float32)
+    scale = tf.constant(scaler.scale_, dtype=tf.float32)
+
+    if _is_binary(paths):
+        def open_shard(path):
+            return tf.data.FixedLengthRecordDataset(path, RECORD_BYTES).batch(PARSE_BATCH)
+
+        def decode(records):
+            return tf.reshape(tf.io.decode_raw(records, tf.float32), [-1, RECORD_FIELDS])
+    else:
+        header = read_header(paths[0])
+        for path in paths[1:]:
+            if read_header(path) != header:
+                raise ValueError(f"{path} has a different header than {paths[0]}")
+        validate_columns(header, FEATURES + TARGETS, paths[0])
+        columns = [header.index(name) for name in FEATURES + TARGETS]
+        repeat_column = header.index(REPEAT_COLUMN) if REPEAT_COLUMN in header else None
+        # Every field is required, except an empty repeat count which means one frame
+        defaults = [tf.constant([1.0] if i == repeat_column else [], dtype=tf.float32) for i in range(len(header))]
+
+        def open_shard(path):
+            return tf.data.TextLineDataset(path).skip(1).batch(PARSE_BATCH)
+
+        def decode(lines):
+            fields = tf.io.decode_csv(lines, record_defaults=defaults)
+            weight = fields[repeat_column] if repeat_column is not None else tf.ones_like(fields[0])
+            return tf.stack([fields[i] for i in columns] + [weight], axis=1)
+
+    table = tf.constant(weight_table if weight_table is not None else np.ones((len(TARGETS), 2)), dtype=tf.float32)
+    oversample = tf.constant(_oversample_multipliers() if weight_table is not None
+                             else np.zeros(len(TARGETS)), dtype=tf.float32)
+    button_index = tf.range(len(TARGETS))
+
+    def prepare(block):
+        X = (block[:, :n_features] - mean) / scale
+        y = block[:, n_features:-1]
+        labels = tf.cast(y, tf.int32)
+        class_weight = tf.reduce_max(tf.gather_nd(
+            table, tf.stack([tf.broadcast_to(button_index, tf.shape(labels)), labels], axis=-1)), axis=1)
+        weight = block[:, -1] * tf.maximum(class_weight, 1.0) * (1.0 + tf.linalg.matvec(y, oversample))
+        return X, y, weight
+
+    parallel = parallel_files if shuffle_buffer else 1
+    ds = tf.data.Dataset.from_tensor_slices(paths)
+    ds = ds.interleave(open_shard, cycle_length=parallel, num_parallel_calls=parallel,
+                       deterministic=not shuffle_buffer)
+    ds = ds.map(decode, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    ds = ds.map(prepare, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    ds = ds.unbatch()
+    if shuffle_buffer:
+        ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def load_arrays(paths, scaler, weight_table=None):
+    """The in-memory equivalent of make_dataset: (scaled X, y, sample weight) for all shards."""
+    X, y, w = (np.concatenate(parts) for parts in zip(*iter_shard_chunks(paths)))
+    X = ((X - scaler.mean_.astype(np.float32)) / scaler.scale_.astype(np.float32)).astype(np.float32)
+    if weight_table is not None:
+        w = w * gather_sample_weights(y, weight_table) * row_multiplicity(y)
+    return X, y.astype(np.float32), w.astype(np.float32)
+
+
+def check(pattern, batch_size=32):
+    """
+    Verify the streaming path against the in-memory one.
+
+    Compares the streaming scaler with StandardScaler.fit on the loaded data, the pipeline's
+    batches with the arrays, and one epoch of training from the same initial weights.
+
+    Returns:
+        True if everything matches
+    """
+    paths = list_shards(pattern)
+    start = time.perf_counter()
+    scaler, table = fit_streaming(paths)
+    print(f"Streaming fit over {len(paths)} shard(s): {scaler.n_samples_seen_} rows in {time.perf_counter() - start:.2f}s")
+
+    X_raw = np.concatenate([X for X, _, _ in iter_shard_chunks(paths)]).astype(np.float64)
+    reference = StandardScaler().fit(X_raw)
+    scaler_ok = np.allclose(scaler.mean_, reference.mean_) and np.allclose(scaler.scale_, reference.scale_)
+    print(f"Scaler vs StandardScaler.fit: max mean diff {np.abs(scaler.mean_ - reference.mean_).max():.2e}, "
+          f"max scale diff {np.abs(scaler.scale_ - reference.scale_).max():.2e}")
+    del X_raw
+
+    X, y, w = load_arrays(paths, scaler, table)
+    ds = make_dataset(paths, scaler, table, batch_size=batch_size, shuffle_buffer=0)
+    X_ds, y_ds, w_ds = (np.concatenate(parts) for parts in zip(*[(b[0].numpy(), b[1].numpy(), b[2].numpy())
+                                                                 for b in ds]))
+    data_ok = np.allclose(X, X_ds, atol=1e-5) and np.array_equal(y, y_ds) and np.allclose(w, w_ds)
+    print(f"Pipeline vs arrays: {len(X_ds)} rows, {'identical' if data_ok else 'MISMATCH'}")
+
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(len(FEATURES),)),
+        tf.keras.layers.Dense(64, activation='relu'),
+        tf.keras.layers.Dense(32, activation='relu'),
+        tf.keras.layers.Dense(len(TARGETS), activation='sigmoid'),
+    ])
+    initial = model.get_weights()
+    predictions = []
+    for fit_args, fit_kwargs in (((X, y), {'sample_weight': w, 'batch_size': batch_size, 'shuffle': False}),
+                                 ((ds,), {'shuffle': False})):
+        model.set_weights(initial)
+        model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=0.001), loss='binary_crossentropy')
+        start = time.perf_counter()
+        model.fit(*fit_args, epochs=1, verbose=0, **fit_kwargs)
+        print(f"Epoch from {'arrays' if len(fit_args) == 2 else 'pipeline'}: {time.perf_counter() - start:.1f}s")
+        predictions.append(model.predict(X[:10000], verbose=0))
+    model_diff = np.abs(predictions[0] - predictions[1]).max()
+    model_ok = model_diff < 1e-3
+    print(f"Trained models: max prediction diff {model_diff:.2e} ({'same' if model_ok else 'DIFFERENT'})")
+    return scaler_ok and data_ok and model_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Out-of-core training data pipeline')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    shard_parser = subparsers.add_parser('shard', help='Convert processed CSV files into binary shards')
+    shard_parser.add_argument('input', help='Glob pattern of processed CSV files')
+    shard_parser.add_argument('output_dir')
+    shard_parser.add_argument('--rows', type=int, default=1_000_000, help='Rows per shard (default: 1000000)')
+
+    scaler_parser = subparsers.add_parser('scaler', help='Fit the scaler in one streaming pass')
+    scaler_parser.add_argument('shards', help='Glob pattern of CSV or binary shards')
+    scaler_parser.add_argument('--output', default='scaler.joblib')
+
+    check_parser = subparsers.add_parser('check', help='Compare the streaming and in-memory paths')
+    check_parser.add_argument('shards', help='Glob pattern of CSV or binary shards')
+
+    args = parser.parse_args()
+
+    if args.command == 'shard':
+        written = write_binary_shards(args.input, args.output_dir, args.rows)
+        print(f"Wrote {len(written)} shard(s) to {args.output_dir}")
+    elif args.command == 'scaler':
+        fitted, _ = fit_streaming(list_shards(args.shards))
+        joblib.dump(fitted, args.output)
+        print(f"Scaler fitted on {fitted.n_samples_seen_} rows, saved as {args.output}")
+    elif not check(args.shards):
+        sys.exit(1)
@@ -0,0 +1,224 @@
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+from evaluate import load_thresholds, split_rows, thresholds_file
+from log_schema import FEATURES, TARGETS, read_log
+
+DEFAULT_POLICY_FILE = 'policy_tree.py'
+DEFAULT_DEPTH = 10
+DEPTHS = (4, 6, 8, 10, 12)
+# Rows of the recorded data timed per frame (pure Python) when reporting latency
+LATENCY_FRAMES = 2000
+
+MODULE_HEADER = '''"""
+Decision tree distilled from {model} by distill.py (depth {depth}, {leaves} leaves).
+
+Reproduces the model's thresholded button output on {fidelity:.2%} of the held-out recorded frames.
+Generated file: rerun distill.py instead of editing it.
+"""
+
+FEATURES = {features!r}
+TARGETS = {targets!r}
+
+# The same tree as flat node arrays (leaves have feature -1) for predict_batch
+FEATURE = {feature!r}
+THRESHOLD = {threshold!r}
+LEFT = {left!r}
+RIGHT = {right!r}
+LEAF_BUTTONS = {leaf_buttons!r}
+
+
+def predict_batch(X):
+    """Button states of many raw feature rows at once: (rows, {n_features}) in, (rows, {n_targets}) uint8 out."""
+    import numpy as np
+
+    X = np.asarray(X, dtype=np.float64)
+    feature, threshold = np.array(FEATURE), np.array(THRESHOLD)
+    left, right = np.array(LEFT), np.array(RIGHT)
+    node = np.zeros(len(X), dtype=np.int64)
+    rows = np.arange(len(X))
+    # Every row walks one level per pass; rows already at a leaf stay there
+    for _ in range({depth}):
+        inner = feature[node] >= 0
+        if not inner.any():
+            break
+        go_left = X[rows, np.maximum(feature[node], 0)] <= threshold[node]
+        node = np.where(inner, np.where(go_left, left[node], right[node]), node)
+    return np.array(LEAF_BUTTONS, dtype=np.uint8)[node]
+
+
+def predict(x):
+    """Button states (one 0/1 per target) for one raw feature vector ordered as FEATURES."""
+'''
+
+
+def mlp_buttons(model, scaler, X_raw, thresholds, batch_size=4096):
+    """The MLP's button output (before NeuralBot's movement/action balancing) for raw feature rows."""
+    probs = model.predict(scaler.transform(X_raw), batch_size=batch_size, verbose=0)
+    return (probs > np.array([thresholds[target] for target in TARGETS])).astype(np.uint8)
+
+
+def fit_tree(X_raw, buttons, sample_weight=None, depth=DEFAULT_DEPTH, min_samples_leaf=5):
+    """
+    Fit one multi-output tree to the 0/1 button outputs.
+
+    A regression tree on 0/1 targets splits exactly as a Gini classification tree would and
+    its leaves hold the fraction pressed, so a leaf presses a button when that is above 0.5.
+    Trees split on the raw features, so the evaluator needs no scaler.
+    """
+    from sklearn.tree import DecisionTreeRegressor
+
+    tree = DecisionTreeRegressor(max_depth=depth, min_samples_leaf=min_samples_leaf, random_state=42)
+    tree.fit(X_raw, buttons, sample_weight=sample_weight)
+    return tree
+
+
+def tree_buttons(tree, X_raw):
+    return (tree.predict(X_raw) > 0.5).astype(np.uint8)
+
+
+def fidelity(reference, predicted, sample_weight=None):
+    """Weighted share of frames whose 8 buttons all match, and per-button agreement."""
+    exact = np.average(np.all(reference == predicted, axis=1), weights=sample_weight)
+    per_button = np.average(reference == predicted, axis=0, weights=sample_weight)
+    return float(exact), per_button
+
+
+def _node_source(tree_, node, leaf_buttons, indent):
+    pad = '    ' * indent
+    if tree_.children_left[node] < 0:
+        return [f"{pad}return {tuple(int(b) for b in leaf_buttons[node])!r}"]
+    return ([f"{pad}if x[{tree_.feature[node]}] <= {float(tree_.threshold[node])!r}:"] +
+            _node_source(tree_, tree_.children_left[node], leaf_buttons, indent + 1) +
+            [f"{pad}else:"] +
+            _node_source(tree_, tree_.children_right[node], leaf_buttons, indent + 1))
+
+
+def generate_module(tree, model_path, exact_match):
+    """Python source of a standalone evaluator for the tree: nested branches plus flat node arrays."""
+    tree_ = tree.tree_
+    # value is (nodes, outputs, 1): the fraction of each button pressed in the node
+    leaf_buttons = (tree_.value[:, :, 0] > 0.5).astype(int)
+    inner = tree_.children_left >= 0
+    source = MODULE_HEADER.format(
+        model=os.path.basename(model_path), depth=tree.get_depth(), leaves=tree.get_n_leaves(),
+        fidelity=exact_match, features=list(FEATURES), targets=list(TARGETS),
+        feature=[int(f) if i else -1 for f, i in zip(tree_.feature, inner)],
+        threshold=[float(t) if i else 0.0 for t, i in zip(tree_.threshold, inner)],
+        left=[int(n) for n in tree_.children_left], right=[int(n) for n in tree_.children_right],
+        leaf_buttons=[tuple(int(b) for b in row) for row in leaf_buttons],
+        n_features=len(FEATURES), n_targets=len(TARGETS))
+    return source + '\n'.join(_node_source(tree_, 0, leaf_buttons, 1)) + '\n'
+
+
+def load_policy(path):
+    """Import a generated evaluator module from its file."""
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if list(module.FEATURES) != list(FEATURES) or list(module.TARGETS) != list(TARGETS):
+        raise ValueError(f"{path} was generated for other features or targets")
+    return module
+
+
+def frame_latency_us(predict, rows):
+    """Mean microseconds of predict(row) over Python lists, the way NeuralBot builds its features."""
+    rows = [list(map(float, row)) for row in rows]
+    start = time.perf_counter()
+    for row in rows:
+        predict(row)
+    return (time.perf_counter() - start) * 1e6 / len(rows)
+
+
+def distill(data_path, model_path, scaler_path, thresholds_path, output, depth=DEFAULT_DEPTH, depths=DEPTHS):
+    """
+    Distill the model into a decision tree over the recorded states and write its evaluator.
+
+    The tree is fitted on train_model.py's training split and scored on its test split; every
+    depth in `depths` is reported, and the `depth` one is written to `output`.
+    """
+    import joblib
+    import tensorflow as tf
+
+    from frame_rle import frame_weights
+
+    df = read_log(data_path, required=FEATURES + TARGETS)
+    X_raw = df[FEATURES].to_numpy(dtype=np.float64)
+    w = frame_weights(df)
+    train_rows, _, test_rows = split_rows(len(X_raw))
+
+    model = tf.keras.models.load_model(model_path)
+    scaler = joblib.load(scaler_path)
+    thresholds_path = thresholds_path or thresholds_file(model_path)
+    if os.path.exists(thresholds_path):
+        thresholds = load_thresholds(thresholds_path, model_path)
+    else:
+        from nn_bot import DEFAULT_ACTIVATION_THRESHOLDS
+        thresholds = DEFAULT_ACTIVATION_THRESHOLDS
+        print(f"{thresholds_path} not found, using NeuralBot's default thresholds")
+    buttons = mlp_buttons(model, scaler, X_raw, thresholds)
+    print(f"Teacher: {model_path} on {len(X_raw)} recorded frames, "
+          f"{buttons[train_rows].mean(axis=0).round(3).tolist()} pressed per button")
+
+    # Per-frame latency of the teacher as NeuralBot runs it, and as a direct call
+    sample = X_raw[test_rows[:200]]
+    predict_us = frame_latency_us(lambda row: model.predict(scaler.transform([row]), verbose=0), sample[:50])
+    call_us = frame_latency_us(lambda row: model(scaler.transform([row]).astype(np.float32), training=False), sample)
+
+    print(f"\n{'depth':>5} {'leaves':>6} {'exact':>7} {'worst button':>18} {'fit s':>6}")
+    chosen = None
+    for d in sorted(set(depths) | {depth}):
+        start = time.perf_counter()
+        tree = fit_tree(X_raw[train_rows], buttons[train_rows], w[train_rows], d)
+        fit_time = time.perf_counter() - start
+        exact, per_button = fidelity(buttons[test_rows], tree_buttons(tree, X_raw[test_rows]), w[test_rows])
+        worst = int(np.argmin(per_button))
+        print(f"{d:>5} {tree.get_n_leaves():>6} {exact:>7.2%} {TARGETS[worst]:>12} {per_button[worst]:>5.1%} "
+              f"{fit_time:>6.2f}")
+        if d == depth:
+            chosen = (tree, exact, per_button)
+
+    tree, exact, per_button = chosen
+    with open(output, 'w') as f:
+        f.write(generate_module(tree, model_path, exact))
+    policy = load_policy(output)
+    # The generated code must reproduce the fitted tree exactly
+    test_X = X_raw[test_rows]
+    generated = np.array([policy.predict(list(row)) for row in test_X[:LATENCY_FRAMES]], dtype=np.uint8)
+    if not (np.array_equal(generated, tree_buttons(tree, test_X[:LATENCY_FRAMES])) and
+            np.array_equal(policy.predict_batch(test_X), tree_buttons(tree, test_X))):
+        raise RuntimeError(f"Generated evaluator {output} disagrees with the fitted tree")
+
+    tree_us = frame_latency_us(policy.predict, test_X[:LATENCY_FRAMES])
+    start = time.perf_counter()
+    policy.predict_batch(test_X)
+    batch_us = (time.perf_counter() - start) * 1e6 / len(test_X)
+    print(f"\nDepth {depth} evaluator written to {output} ({os.path.getsize(output) / 2**10:.0f} KiB): "
+          f"{exact:.2%} of held-out frames match the MLP exactly")
+    print("Per-button agreement: " + ', '.join(f"{t} {a:.1%}" for t, a in zip(TARGETS, per_button)))
+    print(f"Per frame: tree {tree_us:.2f} us, MLP direct call {call_us:.0f} us, MLP predict {predict_us:.0f} us "
+          f"({call_us / tree_us:.0f}x / {predict_us / tree_us:.0f}x); predict_batch {batch_us:.2f} us per row")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Distill the MLP into a decision tree evaluator for NeuralBot')
+    parser.add_argument('--data', type=str, default='GameDataProcessed.csv',
+                        help='Processed CSV of recorded frames (the state distribution to reproduce)')
+    parser.add_argument('--model', type=str, default='StreetFighterBotMLP.keras')
+    parser.add_argument('--scaler', type=str, default='scaler.joblib')
+    parser.add_argument('--thresholds', type=str, default=None,
+                        help="Per-button thresholds of the model (default: <model>.thresholds.json, "
+                             "NeuralBot's defaults if missing)")
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help=f'Depth written out (default: {DEFAULT_DEPTH})')
+    parser.add_argument('--depths', type=str, default=','.join(map(str, DEPTHS)),
+                        help='Comma-separated depths to report fidelity for')
+    parser.add_argument('--output', type=str, default=DEFAULT_POLICY_FILE,
+                        help=f'Generated evaluator (default: {DEFAULT_POLICY_FILE})')
+    args = parser.parse_args()
+
+    distill(args.data, args.model, args.scaler, args.thresholds, args.output, args.depth,
+            [int(d) for d in args.depths.split(',') if d])
@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+from evaluate import metrics_at, print_report, save_thresholds, thresholds_file, tune_thresholds
+from log_schema import FEATURES, TARGETS
+from mlp import BATCH_SIZE, LEARNING_RATE
+from model_card import accuracy_metrics, build_card, card_path, print_summary, save_card
+from sweep import ARRAY_NAMES, prepare_arrays
+
+DEFAULT_DATA_DIR = 'distributed_data'
+# Its own file name, so a distributed run never replaces the models (and scalers) NeuralBot ships with
+DEFAULT_MODEL = 'DistributedBotMLP.keras'
+
+
+def _free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def scaler_file(model_path):
+    """Scaler saved next to a model: DistributedBotMLP.keras -> DistributedBotMLP_scaler.joblib."""
+    return os.path.splitext(model_path)[0] + '_scaler.joblib'
+
+
+def scaled_learning_rate(global_batch, base_rate=LEARNING_RATE, base_batch=BATCH_SIZE):
+    """Linear scaling rule: the learning rate grows with the global batch."""
+    return base_rate * global_batch / base_batch
+
+
+def launch(workers, data_dir, global_batch, epochs, patience, learning_rate, model_path, verbose=False,
+           check_step=False):
+    """
+    Start one training process per worker on localhost and wait for them.
+
+    Each worker gets a TF_CONFIG describing the whole cluster, so MultiWorkerMirroredStrategy
+    all-reduces the gradients across them over local TCP.
+
+    Returns:
+        The chief's report (samples/sec, epochs, final loss)
+    """
+    ports = _free_ports(workers)
+    cluster = {'worker': [f'localhost:{port}' for port in ports]}
+    report_path = os.path.join(tempfile.mkdtemp(prefix='distributed_'), 'report.json')
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    processes = []
+    for index in range(workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}})
+        # Split the cores between the workers instead of letting each one use all of them
+        env['TF_NUM_INTRAOP_THREADS'] = str(threads)
+        env['OMP_NUM_THREADS'] = str(threads)
+        command = [sys.executable, os.path.abspath(__file__), 'worker', '--data-dir', data_dir,
+                   '--global-batch', str(global_batch), '--epochs', str(epochs), '--patience', str(patience),
+                   '--learning-rate', str(learning_rate), '--model', model_path, '--report', report_path]
+        if check_step:
+            command.append('--check-step')
+        quiet = index != 0 and not verbose
+        processes.append(subprocess.Popen(command, env=env,
+                                          stdout=subprocess.DEVNULL if quiet else None,
+                                          stderr=subprocess.DEVNULL if quiet else None))
+
+    # A worker that dies leaves the others blocked in a collective, so stop them all
+    failed = False
+    while any(process.poll() is None for process in processes):
+        if any(process.poll() not in (None, 0) for process in processes):
+            failed = True
+            break
+        time.sleep(0.2)
+    if failed or any(process.returncode != 0 for process in processes):
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        raise RuntimeError(f"Worker exit codes: {[process.wait() for process in processes]}")
+
+    with open(report_path) as f:
+        return json.load(f)
+
+
+def run_worker(data_dir, global_batch, epochs, patience, learning_rate, model_path, report_path, check_step=False):
+    """
+    Body of one worker process: train its shard of every global batch in lockstep with the others.
+
+    With check_step the workers take a single step with plain SGD and no dropout, and the chief
+    saves the weights before and after it to model_path (.npz) for check_first_step().
+    """
+    import tensorflow as tf
+
+    from mlp import build_mlp
+    from sampling import training_weights
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    task = json.loads(os.environ['TF_CONFIG'])['task']
+    is_chief = task['index'] == 0
+    workers = strategy.num_replicas_in_sync
+
+    arrays = {name: np.load(os.path.join(data_dir, name + '.npy'), mmap_mode='r') for name in ARRAY_NAMES}
+    X_train = np.asarray(arrays['X_train'], dtype=np.float32)
+    y_train = np.asarray(arrays['y_train'], dtype=np.float32)
+    train_index, sample_weights = training_weights(arrays['y_train'], arrays['w_train'])
+    steps_per_epoch = len(train_index) // global_batch
+
+    # Each step takes one global batch; the strategy splits it between the workers (DATA
+    # auto-sharding), and every worker shuffles with the same seed so they agree on the batches
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    X = tf.constant(X_train)
+    y = tf.constant(y_train)
+    w = tf.constant(sample_weights.astype(np.float32))
+    train = tf.data.Dataset.from_tensor_slices(train_index)
+    train = train.shuffle(len(train_index), seed=42, reshuffle_each_iteration=True).repeat()
+    train = train.batch(global_batch, drop_remainder=True)
+    train = train.map(lambda rows: (tf.gather(X, rows), tf.gather(y, rows), tf.gather(w, rows)),
+                      num_parallel_calls=tf.data.AUTOTUNE)
+    train = train.prefetch(tf.data.AUTOTUNE).with_options(options)
+
+    tf.keras.utils.set_random_seed(42)
+    with strategy.scope():
+        if check_step:
+            # Adam's first step is almost independent of the gradient's scale; SGD moves by
+            # learning_rate * gradient, so a wrongly aggregated gradient shows in the update
+            model = build_mlp(len(FEATURES), len(TARGETS), dropout=0, learning_rate=learning_rate)
+            optimizer = tf.keras.optimizers.SGD(learning_rate=learning_rate)
+        else:
+            model = build_mlp(len(FEATURES), len(TARGETS), learning_rate=learning_rate)
+            optimizer = model.optimizer
+    train_iterator = iter(strategy.experimental_distribute_dataset(train))
+
+    def replica_step(X, y, w):
+        # Same loss as model.fit: weighted mean binary cross-entropy over the global batch plus L2
+        with tf.GradientTape() as tape:
+            per_row = tf.keras.losses.binary_crossentropy(y, model(X, training=True))
+            loss = tf.nn.compute_average_loss(per_row * w, global_batch_size=global_batch)
+            loss += tf.nn.scale_regularization_loss(tf.add_n(model.losses))
+        gradients = tape.gradient(loss, model.trainable_variables)
+        # In a replica context apply_gradients sums the gradients of every replica itself
+        # (one all-reduce), so all workers apply the same update
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return loss
+
+    @tf.function
+    def train_step():
+        losses = strategy.run(replica_step, args=next(train_iterator))
+        return strategy.reduce(tf.distribute.ReduceOp.SUM, losses, axis=None)
+
+    if check_step:
+        before = model.get_weights()
+        train_step()
+        if is_chief:
+            np.savez(model_path, *[w for pair in zip(before, model.get_weights()) for w in pair])
+            with open(report_path, 'w') as f:
+                json.dump({'workers': workers, 'global_batch': global_batch}, f)
+        return
+
+    X_val = np.asarray(arrays['X_val'], dtype=np.float32)
+    y_val = np.asarray(arrays['y_val'], dtype=np.float32)
+    w_val = np.asarray(arrays['w_val'], dtype=np.float32)
+
+    def validation_loss():
+        # Weights are identical on every worker, so each one scores the whole validation set
+        # locally and they all reach the same early stopping decision
+        per_row = tf.keras.losses.binary_crossentropy(y_val, model.predict(X_val, batch_size=1024, verbose=0))
+        return float(np.sum(per_row.numpy() * w_val) / len(w_val) + sum(float(l) for l in model.losses))
+
+    epoch_times = []
+    val_losses = []
+    best_weights = None
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        total = 0.0
+        for _ in range(steps_per_epoch):
+            total += float(train_step())
+        epoch_times.append(time.perf_counter() - start)
+        val_losses.append(validation_loss())
+        if is_chief:
+            print(f"Epoch {epoch + 1}/{epochs}: loss {total / steps_per_epoch:.4f}, val_loss {val_losses[-1]:.4f}, "
+                  f"{epoch_times[-1]:.1f}s ({steps_per_epoch * global_batch / epoch_times[-1]:,.0f} samples/sec)")
+        if val_losses[-1] <= min(val_losses):
+            best_weights = model.get_weights()
+        elif patience and epoch - int(np.argmin(val_losses)) >= patience:
+            break
+    if patience:
+        model.set_weights(best_weights)
+
+    if is_chief:
+        # The weights are the same on every worker, so only the chief saves them
+        model.save(model_path)
+        # The first epoch includes graph building and the collective set-up
+        timed = epoch_times[1:] or epoch_times
+        report = {
+            'workers': workers,
+            'global_batch': global_batch,
+            'learning_rate': learning_rate,
+            'epochs': len(epoch_times),
+            'samples_per_sec': steps_per_epoch * global_batch * len(timed) / sum(timed),
+            'val_loss': min(val_losses),
+        }
+        with open(report_path, 'w') as f:
+            json.dump(report, f)
+
+
+def finish_model(model_path, data_dir, scaler):
+    """
+    Tune the trained model's per-button thresholds on the validation split, report the test
+    split at them and save the thresholds and the model card next to the model, as
+    train_model.py does.
+    """
+    import tensorflow as tf
+
+    arrays = {name: np.asarray(np.load(os.path.join(data_dir, name + '.npy'), mmap_mode='r'))
+              for name in ARRAY_NAMES}
+    model = tf.keras.models.load_model(model_path)
+    val_probs = model.predict(arrays['X_val'], batch_size=1024, verbose=0)
+    thresholds, _ = tune_thresholds(arrays['y_val'], val_probs, arrays['w_val'])
+    test_probs = model.predict(arrays['X_test'], batch_size=1024, verbose=0)
+
+    print("\nTest split at the per-button thresholds tuned on the validation split:")
+    print_report(arrays['y_test'], test_probs, thresholds, arrays['w_test'])
+    save_thresholds(thresholds_file(model_path), thresholds,
+                    metrics_at(arrays['y_val'], val_probs, thresholds, arrays['w_val']), model_path)
+    print(f"Per-button thresholds saved as {thresholds_file(model_path)}")
+
+    card = build_card(model, scaler, scaler.inverse_transform(arrays['X_test'][:1000]),
+                      accuracy_metrics(arrays['y_test'], test_probs, thresholds, arrays['w_test']),
+                      model_path=model_path)
+    save_card(card, card_path(model_path))
+    print_summary(card, card_path(model_path))
+
+
+def check_first_step(workers, data_dir, global_batch, learning_rate, tolerance=1e-4):
+    """
+    Take the first step of the same global batch with 1 worker and with `workers`, and compare the updates.
+
+    The updates match only if the gradients of the workers are averaged over the global batch
+    exactly once; an extra all-reduce makes the N-worker update N times larger.
+
+    Returns:
+        True if the largest difference is within `tolerance` of the largest 1-worker update
+    """
+    updates = {}
+    directory = tempfile.mkdtemp(prefix='distributed_check_')
+    for count in (1, workers):
+        path = os.path.join(directory, f'step_{count}.npz')
+        launch(count, data_dir, global_batch, 1, 0, learning_rate, path, check_step=True)
+        with np.load(path) as saved:
+            arrays = [saved[f'arr_{i}'] for i in range(len(saved.files))]
+        updates[count] = [after - before for before, after in zip(arrays[::2], arrays[1::2])]
+
+    largest = max(np.abs(update).max() for update in updates[1])
+    difference = max(np.abs(a - b).max() for a, b in zip(updates[1], updates[workers]))
+    ratio = (np.sqrt(sum(np.sum(u ** 2) for u in updates[workers])) /
+             np.sqrt(sum(np.sum(u ** 2) for u in updates[1])))
+    matches = difference <= tolerance * largest
+    print(f"\nFirst SGD step at global batch {global_batch}: {workers}-worker update / 1-worker update = "
+          f"{ratio:.4f} (norm), largest difference {difference:.3g} against largest update {largest:.3g}: "
+          f"{'match' if matches else 'MISMATCH'}")
+    return matches
+
+
+def print_scaling(reports):
+    """Samples/sec per worker count, and efficiency relative to perfect scaling of the smallest run."""
+    base = reports[0]
+    print(f"\n{'workers':>7} {'global batch':>12} {'samples/sec':>12} {'speed-up':>8} {'efficiency':>10} {'val loss':>9}")
+    for report in reports:
+        speedup = report['samples_per_sec'] / base['samples_per_sec']
+        efficiency = speedup * base['workers'] / report['workers']
+        print(f"{report['workers']:>7} {report['global_batch']:>12} {report['samples_per_sec']:>12,.0f} "
+              f"{speedup:>7.2f}x {efficiency:>9.0%} {report['val_loss']:>9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Data-parallel MLP training over local worker processes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help='Train with several local workers')
+    train_parser.add_argument('--data', type=str, default='GameDataProcessed.csv', help='Processed training CSV')
+    train_parser.add_argument('--workers', type=int, default=2, help='Worker processes (default: 2)')
+    train_parser.add_argument('--global-batch', type=int, default=None,
+                              help=f'Rows per synchronized step across all workers (default: {BATCH_SIZE} per worker)')
+    train_parser.add_argument('--epochs', type=int, default=100)
+    train_parser.add_argument('--patience', type=int, default=5, help='Early stopping patience (0 disables it)')
+    train_parser.add_argument('--no-lr-scaling', action='store_true',
+                              help=f'Keep the learning rate at {LEARNING_RATE} instead of scaling it with the global batch')
+    train_parser.add_argument('--model', type=str, default=DEFAULT_MODEL,
+                              help=f'Output model; its scaler, thresholds and card are saved next to it '
+                                   f'(default: {DEFAULT_MODEL})')
+    train_parser.add_argument('--scaling', type=str, default=None,
+                              help='Comma-separated worker counts to benchmark instead (e.g. 1,2,4); '
+                                   'runs --epochs epochs each without early stopping and keeps no model')
+    train_parser.add_argument('--verbose', action='store_true', help='Show the output of every worker')
+    train_parser.add_argument('--check-step', action='store_true',
+                              help='Only check that 1 and --workers workers take the same first step at the '
+                                   'same global batch')
+
+    worker_parser = subparsers.add_parser('worker', help=argparse.SUPPRESS)
+    worker_parser.add_argument('--data-dir', required=True)
+    worker_parser.add_argument('--global-batch', type=int, required=True)
+    worker_parser.add_argument('--epochs', type=int, required=True)
+    worker_parser.add_argument('--patience', type=int, required=True)
+    worker_parser.add_argument('--learning-rate', type=float, required=True)
+    worker_parser.add_argument('--model', required=True)
+    worker_parser.add_argument('--report', required=True)
+    worker_parser.add_argument('--check-step', action='store_true')
+
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_worker(args.data_dir, args.global_batch, args.epochs, args.patience, args.learning_rate,
+                   args.model, args.report, args.check_step)
+        sys.exit(0)
+
+    scaler = prepare_arrays(args.data, DEFAULT_DATA_DIR)
+    if args.check_step:
+        batch = args.global_batch or BATCH_SIZE * args.workers
+        if batch % args.workers:
+            parser.error(f"--global-batch {batch} is not divisible by {args.workers} workers")
+        sys.exit(0 if check_first_step(args.workers, DEFAULT_DATA_DIR, batch, LEARNING_RATE) else 1)
+
+    worker_counts = [int(n) for n in args.scaling.split(',')] if args.scaling else [args.workers]
+    # The benchmark only measures throughput, so its models go to a scratch directory
+    scratch_dir = tempfile.mkdtemp(prefix='distributed_scaling_') if args.scaling else None
+    results = []
+    for count in worker_counts:
+        batch = args.global_batch or BATCH_SIZE * count
+        if batch % count:
+            parser.error(f"--global-batch {batch} is not divisible by {count} workers")
+        rate = LEARNING_RATE if args.no_lr_scaling else scaled_learning_rate(batch)
+        print(f"\nTraining with {count} worker(s), global batch {batch}, learning rate {rate:g}")
+        model_path = os.path.join(scratch_dir, f'{count}_workers.keras') if args.scaling else args.model
+        results.append(launch(count, DEFAULT_DATA_DIR, batch, args.epochs, 0 if args.scaling else args.patience,
+                              rate, model_path, args.verbose))
+        print(f"{results[-1]['samples_per_sec']:,.0f} samples/sec over {results[-1]['epochs']} epoch(s)")
+
+    print_scaling(results)
+    if args.scaling:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    else:
+        joblib.dump(scaler, scaler_file(args.model))
+        print(f"Model saved as {args.model}, scaler saved as {scaler_file(args.model)}")
+        finish_model(args.model, DEFAULT_DATA_DIR, scaler)
@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from log_schema import FEATURES, TARGETS, read_log
+from mlp import EVAL_THRESHOLD
+
+# Thresholds tried for every button when tuning
+DEFAULT_GRID = np.round(np.arange(0.01, 1.0, 0.01), 2)
+# train_model.py's split: this share of the rows is held out, then halved into validation and test
+SPLIT_SIZES = (0.3, 0.5)
+SPLIT_SEED = 42
+
+
+def threshold_metrics(y_true, probs, thresholds=DEFAULT_GRID, sample_weight=None):
+    """
+    Precision, recall, F1 and accuracy of every button at every threshold, in one pass.
+
+    Each button's probabilities are sorted once and the (weighted) positives and negatives
+    accumulated along them; the rows predicted pressed at a threshold (probability above it)
+    are then a suffix of that order, found with one searchsorted for the whole grid.
+    Empty denominators give 0, like zero_division=0 in sklearn.
+
+    Args:
+        y_true: (rows, buttons) 0/1 targets
+        probs: (rows, buttons) predicted probabilities
+        thresholds: 1-D array of thresholds
+        sample_weight: Optional per-row weights
+
+    Returns:
+        Dict of (thresholds, buttons) arrays: 'precision', 'recall', 'f1', 'accuracy', plus
+        'support' (weighted positives per button)
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    positive = np.asarray(y_true) > 0
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    n, k = probs.shape
+    w = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+
+    order = np.argsort(probs, axis=0, kind='stable')
+    sorted_probs = np.take_along_axis(probs, order, axis=0)
+    pos = np.take_along_axis(positive, order, axis=0) * w[order]
+    neg = w[order] - pos
+    # Weight of the rows below each position, with a leading zero row
+    cum_pos = np.vstack([np.zeros(k), np.cumsum(pos, axis=0)])
+    cum_neg = np.vstack([np.zeros(k), np.cumsum(neg, axis=0)])
+
+    # Probabilities lie in [0, 1], so shifting button j by 2j keeps the buttons apart in one sorted array
+    offsets = 2.0 * np.arange(k)
+    keys = (sorted_probs + offsets).T.ravel()
+    queries = (thresholds[:, None] + offsets).ravel()
+    below = np.searchsorted(keys, queries, side='right').reshape(len(thresholds), k) - np.arange(k) * n
+
+    columns = np.arange(k)
+    total_pos, total_neg = cum_pos[n], cum_neg[n]
+    tp = total_pos - cum_pos[below, columns]
+    fp = total_neg - cum_neg[below, columns]
+    predicted = tp + fp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(total_pos > 0, tp / total_pos, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    accuracy = (tp + total_neg - fp) / (total_pos + total_neg)
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'accuracy': accuracy, 'support': total_pos}
+
+
+def metrics_at(y_true, probs, thresholds, sample_weight=None):
+    """
+    Metrics with one threshold per button.
+
+    Args:
+        thresholds: Dict mapping target to threshold, or one threshold for all buttons
+
+    Returns:
+        Dict of per-button arrays: 'precision', 'recall', 'f1', 'accuracy', 'support'
+    """
+    if isinstance(thresholds, dict):
+        per_button = np.array([thresholds[target] for target in TARGETS], dtype=np.float64)
+    else:
+        per_button = np.full(np.shape(probs)[1], thresholds, dtype=np.float64)
+    # Evaluate on the distinct thresholds only and pick each button's own row
+    grid, rows = np.unique(per_button, return_inverse=True)
+    metrics = threshold_metrics(y_true, probs, grid, sample_weight)
+    columns = np.arange(len(per_button))
+    return {name: values if name == 'support' else values[rows, columns] for name, values in metrics.items()}
+
+
+def tune_thresholds(y_true, probs, sample_weight=None, grid=DEFAULT_GRID, targets=TARGETS):
+    """
+    Per-button threshold with the best F1 (the lowest one on ties).
+
+    Buttons never pressed in the data keep EVAL_THRESHOLD, since every threshold scores 0 there.
+
+    Returns:
+        (dict mapping target to threshold, threshold_metrics of the grid)
+    """
+    metrics = threshold_metrics(y_true, probs, grid, sample_weight)
+    best = np.argmax(metrics['f1'], axis=0)
+    thresholds = {
+        target: float(grid[best[i]]) if metrics['support'][i] > 0 else EVAL_THRESHOLD
+        for i, target in enumerate(targets)
+    }
+    return thresholds, metrics
+
+
+def thresholds_file(model_path):
+    """Thresholds file kept next to a model: StreetFighterBotMLP.keras -> StreetFighterBotMLP.thresholds.json."""
+    return os.path.splitext(model_path)[0] + '.thresholds.json'
+
+
+def save_thresholds(path, thresholds, validation=None, source=None):
+    """
+    Write per-button thresholds (and the validation metrics they were chosen with) as JSON.
+
+    Args:
+        path: Output file
+        thresholds: Dict mapping target to threshold
+        validation: Optional metrics_at result on the tuning data
+        source: Optional description of the model they belong to
+    """
+    content = {'thresholds': thresholds, 'source': source}
+    if validation is not None:
+        content['validation'] = {
+            target: {name: round(float(validation[name][i]), 4) for name in ('precision', 'recall', 'f1')}
+            for i, target in enumerate(TARGETS)
+        }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_thresholds(path, model_path=None):
+    """
+    Per-button thresholds saved by save_thresholds.
+
+    With model_path, thresholds tuned for another model (a different file name in their
+    `source`) are refused, since they only fit the model they were tuned on.
+    """
+    with open(path) as f:
+        content = json.load(f)
+    source = content.get('source')
+    if model_path is not None and source and os.path.basename(source) != os.path.basename(model_path):
+        raise ValueError(f"{path} holds thresholds tuned for {source}, not {model_path}")
+    thresholds = content['thresholds']
+    missing = [target for target in TARGETS if target not in thresholds]
+    if missing:
+        raise ValueError(f"{path} has no threshold for {missing}")
+    return {target: float(thresholds[target]) for target in TARGETS}
+
+
+def print_report(y_true, probs, thresholds, sample_weight=None, baseline=EVAL_THRESHOLD):
+    """
+    Per-button precision/recall/F1 at the given thresholds, next to the F1 at one flat threshold.
+
+    Returns:
+        metrics_at result at the given thresholds
+    """
+    tuned = metrics_at(y_true, probs, thresholds, sample_weight)
+    flat = metrics_at(y_true, probs, baseline, sample_weight)
+    print(f"\n{'button':<14} {'threshold':>9} {'precision':>9} {'recall':>7} {'F1':>7} {f'F1@{baseline}':>8} "
+          f"{'support':>9}")
+    for i, target in enumerate(TARGETS):
+        print(f"{target:<14} {thresholds[target]:>9.2f} {tuned['precision'][i]:>9.4f} {tuned['recall'][i]:>7.4f} "
+              f"{tuned['f1'][i]:>7.4f} {flat['f1'][i]:>8.4f} {tuned['support'][i]:>9.0f}")
+    print(f"{'macro':<14} {'':>9} {np.mean(tuned['precision']):>9.4f} {np.mean(tuned['recall']):>7.4f} "
+          f"{np.mean(tuned['f1']):>7.4f} {np.mean(flat['f1']):>8.4f}")
+    return tuned
+
+
+def check(y_true, probs, sample_weight=None, grid=DEFAULT_GRID):
+    """
+    Compare threshold_metrics with sklearn's precision_recall_fscore_support on the whole grid and time both.
+
+    Returns:
+        True if every value matches
+    """
+    from sklearn.metrics import precision_recall_fscore_support
+
+    start = time.perf_counter()
+    fast = threshold_metrics(y_true, probs, grid, sample_weight)
+    fast_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    same = True
+    for t, threshold in enumerate(grid):
+        predicted = (probs > threshold).astype(int)
+        for i in range(probs.shape[1]):
+            precision, recall, f1, _ = precision_recall_fscore_support(
+                y_true[:, i], predicted[:, i], average='binary', sample_weight=sample_weight, zero_division=0)
+            same &= bool(np.allclose([precision, recall, f1],
+                                     [fast['precision'][t, i], fast['recall'][t, i], fast['f1'][t, i]]))
+    slow_time = time.perf_counter() - start
+
+    print(f"{len(grid)} thresholds x {probs.shape[1]} buttons on {len(probs)} rows: "
+          f"sorted cumulative sums {fast_time * 1000:.1f} ms, "
+          f"precision_recall_fscore_support {slow_time:.2f} s ({slow_time / fast_time:.0f}x)")
+    print("Identical metrics" if same else "MISMATCH between the two methods")
+    return same
+
+
+def split_rows(n):
+    """
+    Row numbers of the train, validation and test splits of n rows, as train_model.py splits them.
+
+    Splitting the row numbers gives the same splits as splitting the arrays themselves.
+
+    Returns:
+        (train_rows, val_rows, test_rows)
+    """
+    from sklearn.model_selection import train_test_split
+
+    train_rows, temp_rows = train_test_split(np.arange(n), test_size=SPLIT_SIZES[0], random_state=SPLIT_SEED)
+    val_rows, test_rows = train_test_split(temp_rows, test_size=SPLIT_SIZES[1], random_state=SPLIT_SEED)
+    return train_rows, val_rows, test_rows
+
+
+def validation_split(data_path, scaler):
+    """
+    Validation and test rows of a processed CSV, split as train_model.py splits them.
+
+    Returns:
+        (X_val, y_val, w_val, X_test, y_test, w_test)
+    """
+    from frame_rle import frame_weights
+
+    df = read_log(data_path, required=FEATURES + TARGETS)
+    X = scaler.transform(df[FEATURES].values)
+    y = df[TARGETS].values
+    w = frame_weights(df)
+    _, val_rows, test_rows = split_rows(len(X))
+    return X[val_rows], y[val_rows], w[val_rows], X[test_rows], y[test_rows], w[test_rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluate the model at every threshold and tune per-button thresholds')
+    parser.add_argument('--data', type=str, default='GameDataProcessed.csv',
+                        help='Processed CSV the model was trained on (split as in train_model.py)')
+    parser.add_argument('--model', type=str, default='StreetFighterBotMLP.keras')
+    parser.add_argument('--scaler', type=str, default='scaler.joblib')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Thresholds file NeuralBot loads (default: <model>.thresholds.json)')
+    parser.add_argument('--check', action='store_true',
+                        help='Also compare with sklearn on the validation split and time both')
+    args = parser.parse_args()
+
+    import joblib
+    import tensorflow as tf
+
+    X_val, y_val, w_val, X_test, y_test, w_test = validation_split(args.data, joblib.load(args.scaler))
+    model = tf.keras.models.load_model(args.model)
+    val_probs = model.predict(X_val, batch_size=1024, verbose=0)
+    if args.check and not check(y_val, val_probs, w_val):
+        raise SystemExit(1)
+
+    tuned_thresholds, _ = tune_thresholds(y_val, val_probs, w_val)
+    output = args.output or thresholds_file(args.model)
+    save_thresholds(output, tuned_thresholds, metrics_at(y_val, val_probs, tuned_thresholds, w_val), args.model)
+    print(f"Thresholds tuned on {len(y_val)} validation rows saved as {output}")
+    print("Test split:")
+    print_report(y_test, model.predict(X_test, batch_size=1024, verbose=0), tuned_thresholds, w_test)
@@ -0,0 +1,165 @@
+import argparse
+import copy
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+from tensorflow.keras.callbacks import EarlyStopping
+
+from checkpoints import TrainingCheckpoint
+from evaluate import metrics_at, save_thresholds, thresholds_file, tune_thresholds
+from frame_rle import frame_weights
+from log_schema import FEATURES, TARGETS, read_log
+from mlp import BATCH_SIZE
+from preprocess_data import DEFAULT_CHUNKSIZE
+from sampling import OversampledBatches, training_weights
+
+DEFAULT_LEARNING_RATE = 0.0001
+DEFAULT_EPOCHS = 10
+DEFAULT_REPLAY_RATIO = 1.0
+
+
+def replay_sample(old_data, rows, seed=42, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Uniform random sample of about `rows` rows of the old training data, read in chunks.
+
+    Each row is kept with the same probability, so the old file is never loaded whole.
+    """
+    with open(old_data, 'rb') as f:
+        total = sum(1 for _ in f) - 1
+    keep = min(1.0, rows / total) if total > 0 else 0.0
+    rng = np.random.default_rng(seed)
+    parts = [chunk[rng.random(len(chunk)) < keep]
+             for chunk in read_log(old_data, chunksize=chunksize, required=FEATURES + TARGETS)]
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=FEATURES + TARGETS)
+
+
+def default_scaler_output(output_model):
+    """Scaler path saved next to a fine-tuned model: big.keras -> big_scaler.joblib."""
+    return os.path.splitext(output_model)[0] + '_scaler.joblib'
+
+
+def fold_scaler_change(model, old_scaler, new_scaler):
+    """
+    Rewrite the first Dense layer so the model gives the same outputs on inputs scaled with
+    new_scaler as it gave on inputs scaled with old_scaler.
+
+    An input x scales to (x - old mean) / old scale = (x_new * new scale + new mean - old mean) / old scale
+    with x_new = (x - new mean) / new scale, so the kernel rows are multiplied by new scale / old scale
+    and the bias takes up the shift of the means.
+    """
+    first = model.layers[0]
+    if not isinstance(first, tf.keras.layers.Dense):
+        raise ValueError(f"Expected a Dense first layer to fold the scaler into, found {type(first).__name__}")
+    kernel, bias = first.get_weights()
+    ratio = new_scaler.scale_ / old_scaler.scale_
+    shift = (new_scaler.mean_ - old_scaler.mean_) / old_scaler.scale_
+    first.set_weights([kernel * ratio[:, None], bias + shift @ kernel])
+
+
+def finetune(new_data, old_data=None, base_model='StreetFighterBotMLP.keras', scaler_path='scaler.joblib',
+             output_model=None, replay_ratio=DEFAULT_REPLAY_RATIO, epochs=DEFAULT_EPOCHS,
+             learning_rate=DEFAULT_LEARNING_RATE, checkpoint_dir=None, scaler_output=None):
+    """
+    Continue training a saved model on newly recorded data.
+
+    The scaler statistics are updated with the new rows only (StandardScaler.partial_fit keeps
+    the counts of the data it was fitted on), and the change is folded into the first layer so
+    fine-tuning starts from exactly the base model's function. The model trains on the new rows
+    plus a replay sample of the old data so it does not forget what it learned there. The per-button
+    thresholds are tuned again on the validation rows and saved next to the output model.
+
+    Args:
+        new_data: Processed CSV of the new sessions
+        old_data: Processed CSV the model was trained on, for the replay sample (None: new data only)
+        base_model: Trained model to start from
+        scaler_path: Scaler the model was trained with
+        output_model: Where to save the fine-tuned model (default: overwrite base_model)
+        scaler_output: Where to save the updated scaler (default: scaler_path when the model is
+            overwritten in place, else next to output_model, see default_scaler_output)
+        replay_ratio: Replayed old rows per new row
+        epochs: Maximum fine-tuning epochs
+        learning_rate: Adam learning rate, lower than a full run's so the update stays small
+        checkpoint_dir: If given, checkpoint after every epoch
+    """
+    output_model = output_model or base_model
+    in_place = os.path.abspath(output_model) == os.path.abspath(base_model)
+    scaler_output = scaler_output or (scaler_path if in_place else default_scaler_output(output_model))
+    if not in_place and os.path.abspath(scaler_output) == os.path.abspath(scaler_path):
+        # The base model stays as it is and must keep the scaler it was trained with
+        raise ValueError(f"Writing the updated scaler over {scaler_path} would change the inputs of {base_model}, "
+                         f"which is kept; pass another scaler output")
+
+    start = time.perf_counter()
+    new_df = read_log(new_data, required=FEATURES + TARGETS)
+    scaler = joblib.load(scaler_path)
+    old_scaler = copy.deepcopy(scaler)
+    seen_before = int(np.max(scaler.n_samples_seen_))
+    scaler.partial_fit(new_df[FEATURES].values)
+    print(f"Scaler updated with {len(new_df)} new rows ({seen_before} seen before)")
+
+    if old_data is not None and replay_ratio > 0:
+        old_df = replay_sample(old_data, int(len(new_df) * replay_ratio))
+        print(f"Replaying {len(old_df)} rows of {old_data}")
+        training_df = pd.concat([new_df, old_df], ignore_index=True)
+    else:
+        training_df = new_df
+
+    raw = training_df[FEATURES].values
+    y = training_df[TARGETS].values
+    w = frame_weights(training_df)
+    raw_train, raw_val, y_train, y_val, w_train, w_val = train_test_split(raw, y, w, test_size=0.15, random_state=42)
+    X_train = scaler.transform(raw_train)
+    X_val = scaler.transform(raw_val)
+    train_index, sample_weights = training_weights(y_train, w_train)
+    batches = OversampledBatches(X_train, y_train, train_index, sample_weights, batch_size=BATCH_SIZE, seed=42)
+
+    model = tf.keras.models.load_model(base_model)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss='binary_crossentropy',
+                  metrics=['accuracy'])
+    # The base model's loss on the inputs it was trained for, before its first layer is rewritten
+    baseline = model.evaluate(old_scaler.transform(raw_val), y_val, sample_weight=w_val, verbose=0)[0]
+    fold_scaler_change(model, old_scaler, scaler)
+
+    callbacks = [EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)]
+    if checkpoint_dir is not None:
+        callbacks.append(TrainingCheckpoint(checkpoint_dir, scaler, {'finetune': new_data, 'rows': len(training_df)}))
+    history = model.fit(batches, validation_data=(X_val, y_val, w_val), epochs=epochs, callbacks=callbacks, verbose=1)
+
+    model.save(output_model)
+    joblib.dump(scaler, scaler_output)
+    val_probs = model.predict(X_val, batch_size=1024, verbose=0)
+    thresholds, _ = tune_thresholds(y_val, val_probs, w_val)
+    save_thresholds(thresholds_file(output_model), thresholds, metrics_at(y_val, val_probs, thresholds, w_val),
+                    output_model)
+    print(f"\nValidation loss {baseline:.4f} -> {min(history.history['val_loss']):.4f} "
+          f"after {len(history.history['loss'])} epoch(s), {time.perf_counter() - start:.1f}s")
+    print(f"Model saved as {output_model}, scaler saved as {scaler_output}, "
+          f"thresholds saved as {thresholds_file(output_model)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fine-tune the trained model on newly recorded sessions')
+    parser.add_argument('new_data', help='Processed CSV of the new sessions')
+    parser.add_argument('--old-data', type=str, default=None,
+                        help='Processed CSV the model was trained on, sampled for replay')
+    parser.add_argument('--model', type=str, default='StreetFighterBotMLP.keras', help='Model to fine-tune')
+    parser.add_argument('--scaler', type=str, default='scaler.joblib', help='Scaler the model was trained with')
+    parser.add_argument('--output', type=str, default=None, help='Output model path (default: overwrite --model)')
+    parser.add_argument('--scaler-output', type=str, default=None,
+                        help='Updated scaler path (default: --scaler if --model is overwritten, '
+                             'else <output>_scaler.joblib)')
+    parser.add_argument('--replay-ratio', type=float, default=DEFAULT_REPLAY_RATIO,
+                        help=f'Old rows replayed per new row (default: {DEFAULT_REPLAY_RATIO})')
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS)
+    parser.add_argument('--learning-rate', type=float, default=DEFAULT_LEARNING_RATE)
+    parser.add_argument('--checkpoint-dir', type=str, default=None, help='Checkpoint after every epoch')
+    args = parser.parse_args()
+
+    finetune(args.new_data, args.old_data, args.model, args.scaler, args.output, args.replay_ratio, args.epochs,
+             args.learning_rate, args.checkpoint_dir, args.scaler_output)
@@ -0,0 +1,244 @@
+import argparse
+import csv
+import glob
+import io
+import time
+from operator import itemgetter
+
+import numpy as np
+
+from log_schema import REPEAT_COLUMN, read_log
+
+# Columns that change every frame and are therefore ignored when looking for repeated frames
+VOLATILE_COLUMNS = ('frame', 'timestamp')
+
+
+class RunLengthEncoder:
+    """
+    Collapse consecutive frames that only differ in their volatile columns.
+
+    Each emitted row is the keyframe of a run (the first frame, with its own frame number and
+    timestamp) followed by a repeat count. Rows may be lists (in `columns` order) or dicts.
+    """
+
+    def __init__(self, columns, volatile=VOLATILE_COLUMNS):
+        """
+        Args:
+            columns: Column names of the rows that will be pushed, in order
+            volatile: Columns ignored when comparing a frame with the previous one
+        """
+        self.columns = list(columns)
+        kept = [i for i, name in enumerate(self.columns) if name not in volatile]
+        self._list_key = itemgetter(*kept)
+        self._dict_key = itemgetter(*[self.columns[i] for i in kept])
+        self._pending = None
+        self._pending_key = None
+        self._repeat = 0
+        self.frames_in = 0
+        self.rows_out = 0
+
+    @property
+    def has_pending(self):
+        """True while a run has been started but not yet returned by flush()."""
+        return self._pending is not None
+
+    def push(self, row):
+        """
+        Add one frame. Returns the finished run (row + repeat count) when this frame starts a
+        new run, otherwise None.
+        """
+        self.frames_in += 1
+        key = self._dict_key(row) if isinstance(row, dict) else self._list_key(row)
+        if self._pending is not None and key == self._pending_key:
+            self._repeat += 1
+            return None
+
+        finished = self.flush()
+        self._pending = row
+        self._pending_key = key
+        self._repeat = 1
+        return finished
+
+    def flush(self):
+        """Close the current run and return it, or None if nothing is pending."""
+        if self._pending is None:
+            return None
+
+        if isinstance(self._pending, dict):
+            finished = dict(self._pending)
+            finished[REPEAT_COLUMN] = self._repeat
+        else:
+            finished = list(self._pending) + [self._repeat]
+
+        self._pending = None
+        self._pending_key = None
+        self._repeat = 0
+        self.rows_out += 1
+        return finished
+
+
+class RunLengthWriter:
+    """Drop-in wrapper around a csv writer/DictWriter that writes run-length encoded rows."""
+
+    def __init__(self, writer, columns, volatile=VOLATILE_COLUMNS):
+        """
+        Args:
+            writer: csv.writer or csv.DictWriter; a DictWriter must include REPEAT_COLUMN in its fieldnames
+            columns: Column names of the dense rows, in order
+            volatile: Columns ignored when comparing a frame with the previous one
+        """
+        self.writer = writer
+        self.encoder = RunLengthEncoder(columns, volatile)
+
+    def writeheader(self):
+        if hasattr(self.writer, 'writeheader'):
+            self.writer.writeheader()
+        else:
+            self.writer.writerow(self.encoder.columns + [REPEAT_COLUMN])
+
+    def writerow(self, row):
+        finished = self.encoder.push(row)
+        if finished is not None:
+            self.writer.writerow(finished)
+
+    def flush(self):
+        """Write the run still being accumulated. Call once before closing the file."""
+        finished = self.encoder.flush()
+        if finished is not None:
+            self.writer.writerow(finished)
+
+
+def is_rle(df):
+    """True if a loaded DataFrame is a run-length encoded log."""
+    return REPEAT_COLUMN in df.columns
+
+
+def expand_frames(df):
+    """
+    Expand a run-length encoded DataFrame back to one row per frame.
+
+    Frame numbers are restored as consecutive numbers from each keyframe; the timestamp of the
+    keyframe is repeated for the rest of its run.
+    """
+    if not is_rle(df):
+        return df
+
+    dense = df.loc[df.index.repeat(df[REPEAT_COLUMN])]
+    offsets = dense.groupby(level=0).cumcount().values
+    dense = dense.drop(columns=[REPEAT_COLUMN]).reset_index(drop=True)
+    if 'frame' in dense.columns:
+        dense['frame'] = dense['frame'].values + offsets
+    return dense
+
+
+def frame_weights(df):
+    """Per-row training weights: the repeat count for encoded logs, 1 for dense ones."""
+    if is_rle(df):
+        return df[REPEAT_COLUMN].fillna(1).to_numpy(dtype=np.float64)
+    return np.ones(len(df), dtype=np.float64)
+
+
+def read_rle(path, dense=False):
+    """
+    Load a recorded log, encoded or not.
+
+    Args:
+        path: Path to the CSV file
+        dense: If True, expand runs back to one row per frame; otherwise keep the repeat column
+               so the rows can be used as weighted samples
+    """
+    df = read_log(path)
+    return expand_frames(df) if dense else df
+
+
+def encode_file(input_file, output_file):
+    """Run-length encode an existing dense log. Returns (frames, rows written)."""
+    with open(input_file, newline='') as src, open(output_file, 'w', newline='') as dst:
+        reader = csv.reader(src)
+        columns = next(reader)
+        writer = RunLengthWriter(csv.writer(dst), columns)
+        writer.writeheader()
+        for row in reader:
+            writer.writerow(row)
+        writer.flush()
+    return writer.encoder.frames_in, writer.encoder.rows_out
+
+
+def report(input_files):
+    """
+    Print the size reduction and the recorder CPU cost per frame for dense session logs.
+
+    The cost is measured by replaying each file's rows through csv writers into memory, once
+    dense and once through the run-length writer, so disk speed does not affect the numbers.
+    """
+    total_dense = 0
+    total_rle = 0
+    for path in input_files:
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            columns = next(reader)
+            if REPEAT_COLUMN in columns:
+                print(f"{path}: already run-length encoded, skipping")
+                continue
+            rows = list(reader)
+        if not rows:
+            continue
+
+        dense_buf = io.StringIO()
+        dense_writer = csv.writer(dense_buf)
+        dense_writer.writerow(columns)
+        start = time.perf_counter()
+        for row in rows:
+            dense_writer.writerow(row)
+        dense_time = time.perf_counter() - start
+
+        rle_buf = io.StringIO()
+        rle_writer = RunLengthWriter(csv.writer(rle_buf), columns)
+        rle_writer.writeheader()
+        start = time.perf_counter()
+        for row in rows:
+            rle_writer.writerow(row)
+        rle_writer.flush()
+        rle_time = time.perf_counter() - start
+
+        dense_bytes = len(dense_buf.getvalue())
+        rle_bytes = len(rle_buf.getvalue())
+        total_dense += dense_bytes
+        total_rle += rle_bytes
+        frames = len(rows)
+        print(f"{path}: {frames} frames -> {rle_writer.encoder.rows_out} rows, "
+              f"{dense_bytes / 1024:.1f} KiB -> {rle_bytes / 1024:.1f} KiB "
+              f"({100 * (1 - rle_bytes / dense_bytes):.1f}% smaller), "
+              f"recorder CPU {dense_time / frames * 1e6:.2f} -> {rle_time / frames * 1e6:.2f} us/frame")
+
+    if total_dense:
+        print(f"\nTotal: {total_dense / 1024:.1f} KiB -> {total_rle / 1024:.1f} KiB "
+              f"({100 * (1 - total_rle / total_dense):.1f}% smaller)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run-length encoded game data logs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = subparsers.add_parser('report', help='Size and recorder CPU of encoding dense logs')
+    report_parser.add_argument('pattern', help='Glob pattern of dense logs (e.g. "game_data_*.csv")')
+
+    encode_parser = subparsers.add_parser('encode', help='Run-length encode a dense log')
+    encode_parser.add_argument('input')
+    encode_parser.add_argument('output')
+
+    expand_parser = subparsers.add_parser('expand', help='Expand an encoded log back to one row per frame')
+    expand_parser.add_argument('input')
+    expand_parser.add_argument('output')
+
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report(sorted(glob.glob(args.pattern)))
+    elif args.command == 'encode':
+        frames, rows = encode_file(args.input, args.output)
+        print(f"Encoded {frames} frames into {rows} rows: {args.output}")
+    else:
+        dense_df = read_rle(args.input, dense=True)
+        dense_df.to_csv(args.output, index=False)
+        print(f"Expanded {len(dense_df)} frames: {args.output}")
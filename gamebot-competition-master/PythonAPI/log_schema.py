@@ -0,0 +1,129 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# Column appended to every run-length encoded row: how many consecutive frames it stands for
+REPEAT_COLUMN = 'repeat'
+
+# The 49 columns written by controller.py and the Extras bot, in file order
+LOG_COLUMNS = [
+    'session_id', 'match_id', 'frame', 'timestamp', 'player_id', 'opponent_id',
+    'player_health', 'opponent_health', 'player_x', 'player_y', 'opponent_x',
+    'opponent_y', 'distance', 'timer', 'has_round_started', 'is_round_over',
+    'winner', 'player_jumping', 'player_crouching', 'player_in_move',
+    'player_move_id', 'opponent_jumping', 'opponent_crouching', 'opponent_in_move',
+    'opponent_move_id', 'action_left', 'action_right', 'action_up', 'action_down',
+    'action_A', 'action_B', 'action_X', 'action_Y', 'action_L', 'action_R',
+    'action_select', 'action_start', 'opponent_left', 'opponent_right',
+    'opponent_up', 'opponent_down', 'opponent_A', 'opponent_B', 'opponent_X',
+    'opponent_Y', 'opponent_L', 'opponent_R', 'opponent_select', 'opponent_start'
+]
+
+# Model inputs and outputs, in the order the network uses them
+FEATURES = [
+    'player_x', 'player_y', 'opponent_x', 'opponent_y', 'distance', 'timer',
+    'has_round_started', 'is_round_over', 'player_jumping', 'player_crouching',
+    'player_in_move', 'player_move_id', 'opponent_jumping', 'opponent_crouching',
+    'opponent_in_move', 'opponent_move_id'
+]
+TARGETS = [
+    'action_left', 'action_right', 'action_up', 'action_down',
+    'action_A', 'action_B', 'action_X', 'action_Y'
+]
+
+FLAG_COLUMNS = [
+    'has_round_started', 'is_round_over', 'player_jumping', 'player_crouching',
+    'player_in_move', 'opponent_jumping', 'opponent_crouching', 'opponent_in_move'
+]
+# All 24 player and opponent button columns close the row
+BUTTON_COLUMNS = LOG_COLUMNS[LOG_COLUMNS.index('action_left'):]
+
+# Smallest dtypes that hold every value the recorders write; the processed training format
+# uses the same dtypes for the columns it keeps
+LOG_DTYPES = {
+    'session_id': np.int64,
+    'match_id': np.int32,
+    'frame': np.int32,
+    'timestamp': np.float64,
+    'player_id': np.int16,
+    'opponent_id': np.int16,
+    'player_health': np.int16,
+    'opponent_health': np.int16,
+    'player_x': np.int16,
+    'player_y': np.int16,
+    'opponent_x': np.int16,
+    'opponent_y': np.int16,
+    'distance': np.float32,
+    'timer': np.int16,
+    'winner': np.int8,
+    'player_move_id': np.uint16,
+    'opponent_move_id': np.uint16,
+    REPEAT_COLUMN: np.int32,
+}
+LOG_DTYPES.update({name: np.int8 for name in FLAG_COLUMNS + BUTTON_COLUMNS})
+
+
+def validate_columns(columns, required=LOG_COLUMNS, source='data'):
+    """
+    Check that every required column is present.
+
+    Raises:
+        ValueError: listing the missing columns
+    """
+    missing = [name for name in required if name not in columns]
+    if missing:
+        raise ValueError(f"{source} is missing {len(missing)} column(s): {', '.join(missing)}")
+
+
+def read_log(source, chunksize=None, required=LOG_COLUMNS):
+    """
+    Load a game data CSV (raw or processed, dense or change-only) with the compact dtypes.
+
+    Args:
+        source: Path or file-like object
+        chunksize: If given, return an iterator of DataFrames of this many rows
+        required: Columns that must be present
+    """
+    name = getattr(source, 'name', source)
+    if chunksize is None:
+        df = pd.read_csv(source, dtype=LOG_DTYPES)
+        validate_columns(df.columns, required, name)
+        return df
+
+    def chunks():
+        for chunk in pd.read_csv(source, dtype=LOG_DTYPES, chunksize=chunksize):
+            validate_columns(chunk.columns, required, name)
+            yield chunk
+    return chunks()
+
+
+def memory_report(df, label='Dataset'):
+    """Print the in-memory size of a DataFrame next to its size with pandas' default int64/float64 columns."""
+    actual = df.memory_usage(index=False, deep=True).sum()
+    default = sum(8 * len(df) if np.issubdtype(dtype, np.number) else df[name].memory_usage(index=False, deep=True)
+                  for name, dtype in df.dtypes.items())
+    ratio = default / actual if actual else 0.0
+    print(f"{label}: {len(df)} rows x {len(df.columns)} columns, {actual / 2**20:.2f} MiB "
+          f"(default dtypes: {default / 2**20:.2f} MiB, {ratio:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validate a game data CSV and compare its memory use')
+    parser.add_argument('input', help='Raw or processed game data CSV')
+    parser.add_argument('--processed', action='store_true', help='Validate against the processed columns')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    default_df = pd.read_csv(args.input)
+    default_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compact_df = read_log(args.input, required=FEATURES + TARGETS if args.processed else LOG_COLUMNS)
+    compact_time = time.perf_counter() - start
+
+    print(f"Columns OK ({len(compact_df.columns)} columns)")
+    print(f"Parse time: default {default_time:.2f}s, schema {compact_time:.2f}s")
+    print(f"Default dtypes: {default_df.memory_usage(index=False, deep=True).sum() / 2**20:.2f} MiB")
+    memory_report(compact_df, 'Schema dtypes')
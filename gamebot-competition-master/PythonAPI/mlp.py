@@ -0,0 +1,44 @@
+import tensorflow as tf
+from tensorflow.keras import regularizers
+from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.models import Sequential
+
+# The architecture and optimizer settings train_model.py uses
+HIDDEN_LAYERS = (64, 32, 16)
+DROPOUT = 0.5
+L2 = 0.01
+LEARNING_RATE = 0.001
+BATCH_SIZE = 32
+# Probability above which a button counts as pressed when evaluating
+EVAL_THRESHOLD = 0.2
+
+
+def build_mlp(n_features, n_targets, hidden_layers=HIDDEN_LAYERS, dropout=DROPOUT, l2=L2,
+              learning_rate=LEARNING_RATE):
+    """
+    Build and compile the bot's MLP.
+
+    Every hidden layer but the last is followed by dropout; one sigmoid output per button.
+
+    Args:
+        n_features: Number of input features
+        n_targets: Number of buttons predicted
+        hidden_layers: Units of each hidden ReLU layer
+        dropout: Dropout rate after the hidden layers (0 disables it)
+        l2: L2 regularization factor of the hidden layers
+        learning_rate: Adam learning rate
+    """
+    layers = []
+    for i, units in enumerate(hidden_layers):
+        kwargs = {'input_shape': (n_features,)} if i == 0 else {}
+        layers.append(Dense(units, activation='relu', kernel_initializer='he_normal',
+                            kernel_regularizer=regularizers.l2(l2), **kwargs))
+        if dropout and i < len(hidden_layers) - 1:
+            layers.append(Dropout(dropout))
+    layers.append(Dense(n_targets, activation='sigmoid', kernel_initializer='glorot_normal'))
+    model = Sequential(layers)
+
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss='binary_crossentropy',
+                  metrics=['accuracy'])
+    return model
@@ -0,0 +1,226 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+from evaluate import load_thresholds, metrics_at, tune_thresholds, validation_split
+from log_schema import TARGETS
+
+# One frame at 60 FPS; a model whose single-frame p99 exceeds it drops frames in NeuralBot
+FRAME_BUDGET_MS = 1000 / 60
+CARD_SUFFIX = '.card.json'
+BATCH_SIZES = (64, 1024)
+# Card fields compared for the Pareto front, and whether higher is better
+OBJECTIVES = (('macro_f1', True), ('frame_p99_ms', False), ('weights_kib', False))
+
+
+def card_path(model_path):
+    """Model card file kept next to a saved model."""
+    return os.path.splitext(model_path)[0] + CARD_SUFFIX
+
+
+def benchmark_latency(model, scaler, frames, repeats=200, warmup=20, batch_sizes=BATCH_SIZES):
+    """
+    Time inference the way NeuralBot runs it, and in batches.
+
+    Single frames go through scaler.transform and model.predict one at a time, as in
+    NeuralBot.fight, and are also timed as a direct model call (without predict's per-call
+    set-up); batched inference calls the model on `batch_size` rows at once.
+
+    Args:
+        model: Loaded Keras model
+        scaler: Fitted StandardScaler
+        frames: Raw (unscaled) feature rows to feed it, e.g. from the recorded data
+        repeats: Single frames timed
+        warmup: Untimed calls first (graph tracing, allocations)
+        batch_sizes: Batch sizes timed
+
+    Returns:
+        Dict of latency figures in milliseconds (per batch for batched runs) and microseconds per row
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    latency = {}
+    runners = {
+        'frame': lambda row: model.predict(scaler.transform([row]), verbose=0),
+        'call': lambda row: model(scaler.transform([row]).astype(np.float32), training=False),
+    }
+    for name, run in runners.items():
+        times = []
+        for i in range(warmup + repeats):
+            row = frames[i % len(frames)]
+            start = time.perf_counter()
+            run(row)
+            if i >= warmup:
+                times.append(time.perf_counter() - start)
+        times_ms = np.array(times) * 1000
+        latency[f'{name}_p50_ms'] = round(float(np.percentile(times_ms, 50)), 3)
+        latency[f'{name}_p99_ms'] = round(float(np.percentile(times_ms, 99)), 3)
+
+    for batch_size in batch_sizes:
+        batch = scaler.transform(frames[np.arange(batch_size) % len(frames)]).astype(np.float32)
+        model(batch, training=False)
+        runs = max(3, min(50, 20000 // batch_size))
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(batch, training=False)
+        elapsed = (time.perf_counter() - start) / runs
+        latency[f'batch{batch_size}_ms'] = round(elapsed * 1000, 3)
+        latency[f'batch{batch_size}_us_per_row'] = round(elapsed * 1e6 / batch_size, 3)
+    return latency
+
+
+def model_footprint(model, model_path=None):
+    """Parameter count and size of the weights (and of the saved file)."""
+    weights = model.get_weights()
+    footprint = {
+        'params': int(sum(w.size for w in weights)),
+        'weights_kib': round(sum(w.nbytes for w in weights) / 2**10, 1),
+        'layers': [layer.units for layer in model.layers if hasattr(layer, 'units')],
+    }
+    if model_path is not None:
+        footprint['file_kib'] = round(os.path.getsize(model_path) / 2**10, 1)
+    return footprint
+
+
+def accuracy_metrics(y_true, probs, thresholds, sample_weight=None):
+    """Card fields for the accuracy side: macro F1, mean accuracy and per-button F1 at the given thresholds."""
+    metrics = metrics_at(y_true, probs, thresholds, sample_weight)
+    return {
+        'macro_f1': round(float(np.mean(metrics['f1'])), 5),
+        'accuracy': round(float(np.mean(metrics['accuracy'])), 5),
+        'f1': {target: round(float(f1), 4) for target, f1 in zip(TARGETS, metrics['f1'])},
+        'thresholds': thresholds,
+    }
+
+
+def build_card(model, scaler, frames, metrics=None, repeats=200, model_path=None):
+    """
+    Benchmark a model and describe it in a model card.
+
+    Args:
+        model: Loaded Keras model
+        scaler: Fitted StandardScaler it was trained with
+        frames: Raw feature rows used as benchmark inputs
+        metrics: Accuracy figures to store with it (see accuracy_metrics)
+        repeats: Single frames timed
+        model_path: File the model was saved to, if any
+
+    Returns:
+        The card dict
+    """
+    import tensorflow as tf
+
+    card = {
+        'model': model_path,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'cpu': {'machine': platform.machine(), 'processor': platform.processor(), 'cores': os.cpu_count(),
+                'tensorflow': tf.__version__},
+        **model_footprint(model, model_path),
+        **benchmark_latency(model, scaler, frames, repeats),
+        'frame_budget_ms': round(FRAME_BUDGET_MS, 3),
+        **(metrics or {}),
+    }
+    card['within_budget'] = card['frame_p99_ms'] <= FRAME_BUDGET_MS
+    return card
+
+
+def save_card(card, path):
+    with open(path, 'w') as f:
+        json.dump(card, f, indent=1)
+
+
+def load_cards(patterns):
+    cards = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path) as f:
+                cards.append(json.load(f))
+    return cards
+
+
+def pareto_front(cards, objectives=OBJECTIVES):
+    """
+    Cards no other card beats: at least as good on every objective and better on one.
+
+    Cards missing an objective are left out.
+    """
+    candidates = [card for card in cards if all(card.get(key) is not None for key, _ in objectives)]
+    # Orient every objective so that higher is better
+    values = np.array([[card[key] if higher else -card[key] for key, higher in objectives] for card in candidates],
+                      dtype=np.float64).reshape(len(candidates), len(objectives))
+    front = []
+    for i, card in enumerate(candidates):
+        dominated = np.any(np.all(values >= values[i], axis=1) & np.any(values > values[i], axis=1))
+        if not dominated:
+            front.append(card)
+    return front
+
+
+def print_summary(card, path):
+    print(f"Single frame p50 {card['frame_p50_ms']} ms, p99 {card['frame_p99_ms']} ms "
+          f"(direct call p50 {card['call_p50_ms']} ms) "
+          f"({'within' if card['within_budget'] else 'OVER'} the {FRAME_BUDGET_MS:.1f} ms frame budget), "
+          f"{card['params']} parameters, macro F1 {card.get('macro_f1')}; card saved as {path}")
+
+
+def print_cards(cards, objectives=OBJECTIVES):
+    """Table of the cards, best macro F1 first, with the Pareto-optimal ones marked."""
+    front = {id(card) for card in pareto_front(cards, objectives)}
+    print(f"{'':2}{'model':<40} {'macro F1':>8} {'accuracy':>8} {'frame p50':>9} {'frame p99':>9} {'call p50':>9} "
+          f"{'us/row@1024':>11} {'params':>7} {'KiB':>6}  budget")
+    for card in sorted(cards, key=lambda c: c.get('macro_f1') or 0, reverse=True):
+        mark = '* ' if id(card) in front else '  '
+        name = card.get('trial') or card['model'] or '?'
+        print(f"{mark}{name[-40:]:<40} {card.get('macro_f1') or 0:>8.4f} {card.get('accuracy') or 0:>8.4f} "
+              f"{card['frame_p50_ms']:>7.2f}ms {card['frame_p99_ms']:>7.2f}ms {card['call_p50_ms']:>7.2f}ms "
+              f"{card.get('batch1024_us_per_row', float('nan')):>11.2f} {card['params']:>7} "
+              f"{card['weights_kib']:>6.1f}  {'ok' if card['within_budget'] else 'OVER'}")
+    print(f"* Pareto-optimal on {', '.join(key for key, _ in objectives)} ({len(front)} of {len(cards)}); "
+          f"frame budget {FRAME_BUDGET_MS:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Model cards: inference latency and memory next to accuracy')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    card_parser = subparsers.add_parser('card', help='Benchmark a saved model and write its card')
+    card_parser.add_argument('model', help='Saved Keras model')
+    card_parser.add_argument('--data', type=str, default='GameDataProcessed.csv',
+                             help='Processed CSV it was trained on: benchmark inputs and test split metrics')
+    card_parser.add_argument('--scaler', type=str, default='scaler.joblib')
+    card_parser.add_argument('--thresholds', type=str, default=None,
+                             help='Per-button thresholds for the metrics (default: tuned on the validation split)')
+    card_parser.add_argument('--repeats', type=int, default=200, help='Single frames timed (default: 200)')
+
+    list_parser = subparsers.add_parser('list', help='Compare model cards and mark the Pareto-optimal ones')
+    list_parser.add_argument('patterns', nargs='*', default=['*' + CARD_SUFFIX, 'sweep_results_cards/*.json'],
+                             help='Glob patterns of card files')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        found = load_cards(args.patterns)
+        if not found:
+            raise SystemExit(f"No model cards match {args.patterns}")
+        print_cards(found)
+    else:
+        import joblib
+        import tensorflow as tf
+
+        card_scaler = joblib.load(args.scaler)
+        X_val, y_val, w_val, X_test, y_test, w_test = validation_split(args.data, card_scaler)
+        card_model = tf.keras.models.load_model(args.model)
+        if args.thresholds is not None:
+            card_thresholds = load_thresholds(args.thresholds, args.model)
+        else:
+            card_thresholds, _ = tune_thresholds(y_val, card_model.predict(X_val, batch_size=1024, verbose=0), w_val)
+        test_probs = card_model.predict(X_test, batch_size=1024, verbose=0)
+        model_card = build_card(card_model, card_scaler, card_scaler.inverse_transform(X_test),
+                                accuracy_metrics(y_test, test_probs, card_thresholds, w_test), args.repeats,
+                                args.model)
+        save_card(model_card, card_path(args.model))
+        print_summary(model_card, card_path(args.model))
@@ -2,20 +2,57 @@ import tensorflow as tf
 import numpy as np
 import joblib
 import math
+import os
+from action_table import ActionTable, unpack_mask
+from distill import load_policy
+from evaluate import load_thresholds, thresholds_file
+from log_schema import FEATURES, TARGETS
 from command import Command
 from buttons import Buttons
 
+# Hand-picked per-button activation thresholds, used when no tuned thresholds file exists
+DEFAULT_ACTIVATION_THRESHOLDS = {
+    'action_left': 0.25,    # Slightly lower to encourage use
+    'action_right': 0.25,   # Slightly lower to encourage use
+    'action_up': 0.35,      # Increase to reduce dominance
+    'action_down': 0.25,    # Lower to balance with up
+    'action_A': 0.15,       # Lower to boost
+    'action_B': 0.15,       # Lower to boost
+    'action_X': 0.20,       # Moderate threshold
+    'action_Y': 0.20        # Moderate threshold
+}
+
 class NeuralBot:
-    def __init__(self, model_path='StreetFighterBotMLP.keras', scaler_path='scaler.joblib'):
+    def __init__(self, model_path='StreetFighterBotMLP.keras', scaler_path='scaler.joblib',
+                 thresholds_path=None, policy_path=None, table_path=None):
         """
         Initialize the Neural Network bot with the pre-trained model and scaler
         
         Args:
             model_path: Path to the saved Keras model
             scaler_path: Path to the saved scaler object
+            thresholds_path: Per-button thresholds tuned by train_model.py or evaluate.py (default:
+                             the model's own, <model>.thresholds.json); the hand-picked ones
+                             below are used if the file does not exist
+            policy_path: Evaluator generated by distill.py; if given it replaces the model, scaler
+                         and thresholds
+            table_path: Action table built by action_table.py; states found in it are answered
+                        from it, the others by the model
         """
         self.my_command = Command()
         self.buttons = Buttons()
+        # Define the feature names as used in training
+        self.features = FEATURES
+        self.targets = TARGETS
+        # Debug mode
+        self.debug = False
+        
+        self.policy = None
+        self.table = None
+        if policy_path is not None:
+            print(f"Loading distilled policy from {policy_path}")
+            self.policy = load_policy(policy_path)
+            return
         
         # Load the pre-trained model
         print(f"Loading model from {model_path}")
@@ -34,35 +71,59 @@ class NeuralBot:
         except Exception as e:
             print(f"Error loading scaler: {e}")
             raise
-            
-        # Define the feature names as used in training
-        self.features = [
-            'player_x', 'player_y', 'opponent_x', 'opponent_y', 'distance', 'timer',
-            'has_round_started', 'is_round_over', 'player_jumping', 'player_crouching',
-            'player_in_move', 'player_move_id', 'opponent_jumping', 'opponent_crouching',
-            'opponent_in_move', 'opponent_move_id'
-        ]
-        
-        # Define the target button names
-        self.targets = [
-            'action_left', 'action_right', 'action_up', 'action_down',
-            'action_A', 'action_B', 'action_X', 'action_Y'
-        ]
         
         # Per-button activation thresholds
-        self.activation_thresholds = {
-            'action_left': 0.25,    # Slightly lower to encourage use
-            'action_right': 0.25,   # Slightly lower to encourage use
-            'action_up': 0.35,      # Increase to reduce dominance
-            'action_down': 0.25,    # Lower to balance with up
-            'action_A': 0.15,       # Lower to boost
-            'action_B': 0.15,       # Lower to boost
-            'action_X': 0.20,       # Moderate threshold
-            'action_Y': 0.20        # Moderate threshold
-        }
+        self.activation_thresholds = dict(DEFAULT_ACTIVATION_THRESHOLDS)
+        thresholds_path = thresholds_path or thresholds_file(model_path)
+        if os.path.exists(thresholds_path):
+            self.activation_thresholds = load_thresholds(thresholds_path, model_path)
+            print(f"Thresholds loaded from {thresholds_path}")
+        
+        if table_path is not None:
+            table = ActionTable(table_path)
+            # Table hits and misses must come from the same network and thresholds
+            if table.meta.get('model') != os.path.basename(model_path):
+                raise ValueError(f"{table_path} was built from {table.meta.get('model')}, not {model_path}")
+            table_thresholds = table.meta.get('thresholds') or {}
+            if any(table_thresholds.get(target) != self.activation_thresholds[target] for target in TARGETS):
+                raise ValueError(f"{table_path} was built with other thresholds than {model_path} uses; "
+                                 f"rebuild it with action_table.py build")
+            self.table = table
+            print(f"Action table loaded from {table_path} ({self.table.entries} states)")
+
+    def predict_buttons(self, X):
+        """
+        Button states (0/1 per target) of the network for one raw feature vector
         
-        # Debug mode
-        self.debug = False
+        Args:
+            X: Feature values ordered as self.features
+        """
+        # Normalize the features using the saved scaler
+        try:
+            X_scaled = self.scaler.transform([X])
+        except Exception as e:
+            print(f"Error normalizing features: {e}")
+            print(f"Feature vector: {X}")
+            raise
+        
+        # Get model predictions
+        try:
+            predictions = self.model.predict(X_scaled, verbose=0)[0]
+        except Exception as e:
+            print(f"Error making predictions: {e}")
+            raise
+        
+        if self.debug:
+            # Print predictions for debugging
+            for i, target in enumerate(self.targets):
+                print(f"{target}: {predictions[i]:.4f}")
+        
+        # Apply per-button thresholds and convert to native Python types
+        button_states = [
+            1 if predictions[i] > self.activation_thresholds[target] else 0
+            for i, target in enumerate(self.targets)
+        ]
+        return [int(state) for state in button_states]  # Ensure Python int
 
     def fight(self, current_game_state, player):
         """
@@ -109,32 +170,13 @@ class NeuralBot:
             opponent_data.move_id                    # opponent_move_id
         ]
         
-        # Normalize the features using the saved scaler
-        try:
-            X_scaled = self.scaler.transform([X])
-        except Exception as e:
-            print(f"Error normalizing features: {e}")
-            print(f"Feature vector: {X}")
-            raise
-        
-        # Get model predictions
-        try:
-            predictions = self.model.predict(X_scaled, verbose=0)[0]
-        except Exception as e:
-            print(f"Error making predictions: {e}")
-            raise
-        
-        if self.debug:
-            # Print predictions for debugging
-            for i, target in enumerate(self.targets):
-                print(f"{target}: {predictions[i]:.4f}")
-        
-        # Apply per-button thresholds and convert to native Python types
-        button_states = [
-            1 if predictions[i] > self.activation_thresholds[target] else 0
-            for i, target in enumerate(self.targets)
-        ]
-        button_states = [int(state) for state in button_states]  # Ensure Python int
+        if self.policy is not None:
+            # The distilled tree maps raw features straight to button states
+            button_states = list(self.policy.predict(X))
+        else:
+            # One lookup in the precomputed table; the network answers states it does not have
+            mask = self.table.lookup(X) if self.table is not None else None
+            button_states = unpack_mask(mask) if mask is not None else self.predict_buttons(X)
         
         # Categorize buttons and enforce balance
         movement_buttons = button_states[:4]  # action_left, action_right, action_up, action_down
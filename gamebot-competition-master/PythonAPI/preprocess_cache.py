@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import shutil
+
+DEFAULT_CACHE_DIR = '.preprocess_cache'
+
+
+class PreprocessCache:
+    """
+    Content-addressed store of per-file preprocessing outputs.
+
+    Each entry is a headerless processed CSV part plus a JSON sidecar with its summary
+    aggregate. Keys combine the input (size and mtime, or a hash of its bytes), the selected
+    byte ranges, the output layout and the preprocessing code version, so any change to one
+    of them is a miss.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, version=1, use_hash=False):
+        """
+        Args:
+            cache_dir: Directory holding the cached parts
+            version: Preprocessing code version; entries from other versions are never hit
+            use_hash: Key files by the SHA-1 of their content instead of their size and mtime
+        """
+        self.cache_dir = cache_dir
+        self.version = version
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+        self.rows_reused = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, file, segments, with_repeat):
+        """Cache key for one input file (and optional catalog selection within it)."""
+        if self.use_hash:
+            digest = hashlib.sha1()
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            source = {'sha1': digest.hexdigest()}
+        else:
+            stat = os.stat(file)
+            source = {'path': os.path.abspath(file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        ranges = [[segment['start'], segment['end']] for segment in segments] if segments is not None else None
+        description = {
+            'source': source,
+            'ranges': ranges,
+            'with_repeat': with_repeat,
+            'version': self.version,
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.csv'), os.path.join(self.cache_dir, key + '.json')
+
+    def lookup(self, key):
+        """Return (part path, summary) for a cached entry, or None on a miss."""
+        part_path, summary_path = self._paths(key)
+        if os.path.exists(part_path) and os.path.exists(summary_path):
+            with open(summary_path) as f:
+                summary = json.load(f)
+            self.hits += 1
+            self.rows_reused += summary['rows']
+            return part_path, summary
+        self.misses += 1
+        return None
+
+    def store(self, key, part_path, summary):
+        """Move a freshly processed part into the cache and return its new path."""
+        cached_part, summary_path = self._paths(key)
+        shutil.move(part_path, cached_part)
+        # The sidecar is written last, so an interrupted store is never seen as a hit
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f)
+        return cached_part
+
+    def report(self):
+        print(f"Preprocessing cache ({self.cache_dir}): {self.hits} hit(s), {self.misses} miss(es), "
+              f"{self.rows_reused} rows reused")
+
+
+def clear_cache(cache_dir=DEFAULT_CACHE_DIR):
+    """Delete every cached entry. Returns the number of files removed."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.csv') or name.endswith('.json'):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
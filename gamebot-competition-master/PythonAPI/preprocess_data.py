@@ -1,143 +1,289 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import glob
-import math
+import time
+import shutil
+import tempfile
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from log_schema import FLAG_COLUMNS, REPEAT_COLUMN, TARGETS, read_log
+from preprocess_cache import DEFAULT_CACHE_DIR, PreprocessCache, clear_cache
+from session_catalog import add_selection_arguments, open_segments, select_segments, update_catalog
 
-def preprocess_game_data(input_file, output_file=None):
+# Bump whenever process_dataframe's output changes; cached outputs of other versions are ignored
+PREPROCESS_VERSION = 2
+
+# Rows read from the input per chunk; keeps memory flat regardless of log size
+DEFAULT_CHUNKSIZE = 100_000
+
+# Raw columns copied unchanged into the processed data; the 0/1 flags are cast from truthy values
+PASSTHROUGH_COLUMNS = ['player_x', 'player_y', 'opponent_x', 'opponent_y', 'timer', 'winner',
+                       'player_move_id', 'opponent_move_id'] + TARGETS + [
+                       'opponent_left', 'opponent_right', 'opponent_up', 'opponent_down',
+                       'opponent_A', 'opponent_B', 'opponent_X', 'opponent_Y']
+
+# Column order of the processed data
+PROCESSED_COLUMNS = [
+    'player_x', 'player_y', 'opponent_x', 'opponent_y', 'distance', 'timer',
+    'has_round_started', 'is_round_over', 'winner', 'player_jumping', 'player_crouching',
+    'player_in_move', 'player_move_id', 'opponent_jumping', 'opponent_crouching',
+    'opponent_in_move', 'opponent_move_id'
+] + TARGETS + ['opponent_left', 'opponent_right', 'opponent_up', 'opponent_down',
+               'opponent_A', 'opponent_B', 'opponent_X', 'opponent_Y']
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident set size in MiB, or None where the resource module is unavailable.
+    
+    With children=True, the peak of the largest finished worker process instead of this one.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def new_summary():
+    """Empty partial aggregate: row count, frame count and weighted press count per button."""
+    return {'rows': 0, 'frames': 0.0, 'presses': {button: 0.0 for button in TARGETS}}
+
+def add_to_summary(summary, processed_df):
+    """Fold one processed chunk into a partial aggregate."""
+    weights = processed_df[REPEAT_COLUMN].to_numpy(dtype=np.float64) if REPEAT_COLUMN in processed_df.columns else None
+    summary['rows'] += len(processed_df)
+    summary['frames'] += float(weights.sum()) if weights is not None else len(processed_df)
+    for button in TARGETS:
+        values = processed_df[button].to_numpy(dtype=np.float64)
+        summary['presses'][button] += float(values @ weights) if weights is not None else float(values.sum())
+    return summary
+
+def merge_summaries(summaries):
+    """Combine partial aggregates from several files."""
+    total = new_summary()
+    for summary in summaries:
+        total['rows'] += summary['rows']
+        total['frames'] += summary['frames']
+        for button in TARGETS:
+            total['presses'][button] += summary['presses'][button]
+    return total
+
+def print_summary(title, summary):
+    print(f"\n{title}:")
+    print(f"Total samples: {summary['rows']} ({int(summary['frames'])} frames)")
+    print("\nButton Press Distribution:")
+    for button in TARGETS:
+        press_percentage = summary['presses'][button] / summary['frames'] * 100 if summary['frames'] else 0.0
+        print(f"{button}: {press_percentage:.2f}% pressed")
+
+def preprocess_game_data(input_file, output_file=None, chunksize=DEFAULT_CHUNKSIZE):
     """
     Preprocess the raw game data collected by controller.py to match the format used in training.
     
+    The input is read and processed in chunks of `chunksize` rows and each chunk is appended to
+    the output as soon as it is ready, so memory use does not grow with the size of the log.
+    
     Args:
-        input_file: Path to the raw game data CSV file
+        input_file: Path to the raw game data CSV file (or a file-like object)
         output_file: Path to save the processed data (default: GameDataProcessed.csv)
+        chunksize: Number of rows processed at a time
+    
+    Returns:
+        Summary dict with the row count, frame count and weighted button presses
     """
     if output_file is None:
         output_file = "GameDataProcessed.csv"
     
-    print(f"Loading data from {input_file}...")
-    df = pd.read_csv(input_file)
+    print(f"Loading data from {getattr(input_file, 'name', input_file)}...")
+    print("Processing data...")
+    start = time.perf_counter()
+    summary = new_summary()
+    columns = None
+    with open(output_file, 'w', newline='') as out:
+        for processed_df in iter_processed_chunks(input_file, chunksize):
+            # Dense logs never get a repeat column, so every chunk has the same columns
+            if columns is None:
+                columns = list(processed_df.columns)
+                processed_df.to_csv(out, index=False)
+            else:
+                processed_df.to_csv(out, index=False, header=False)
+            add_to_summary(summary, processed_df)
+    elapsed = time.perf_counter() - start
+    print(f"Processed data saved to {output_file}")
     
-    # Create new dataframe with required features
-    processed_data = []
+    # Print summary statistics
+    print_summary("Data Summary", summary)
+    print_throughput(summary['rows'], elapsed)
     
-    print("Processing data...")
-    for i, row in df.iterrows():
-        # Calculate distance between players
-        distance = math.sqrt((row['player_x'] - row['opponent_x'])**2 + 
-                            (row['player_y'] - row['opponent_y'])**2)
-        
-        # Convert boolean values to integers
-        has_round_started = 1 if row['has_round_started'] else 0
-        is_round_over = 1 if row['is_round_over'] else 0
-        
-        player_jumping = 1 if row['player_jumping'] else 0
-        player_crouching = 1 if row['player_crouching'] else 0
-        player_in_move = 1 if row['player_in_move'] else 0
-        
-        opponent_jumping = 1 if row['opponent_jumping'] else 0
-        opponent_crouching = 1 if row['opponent_crouching'] else 0
-        opponent_in_move = 1 if row['opponent_in_move'] else 0
-        
-        # Create new row with processed data
-        processed_row = {
-            'player_x': row['player_x'],
-            'player_y': row['player_y'],
-            'opponent_x': row['opponent_x'],
-            'opponent_y': row['opponent_y'],
-            'distance': distance,
-            'timer': row['timer'],
-            'has_round_started': has_round_started,
-            'is_round_over': is_round_over,
-            'winner': row['winner'],
-            'player_jumping': player_jumping,
-            'player_crouching': player_crouching,
-            'player_in_move': player_in_move,
-            'player_move_id': row['player_move_id'],
-            'opponent_jumping': opponent_jumping,
-            'opponent_crouching': opponent_crouching,
-            'opponent_in_move': opponent_in_move,
-            'opponent_move_id': row['opponent_move_id'],
-            'action_left': row['action_left'],
-            'action_right': row['action_right'],
-            'action_up': row['action_up'],
-            'action_down': row['action_down'],
-            'action_A': row['action_A'],
-            'action_B': row['action_B'],
-            'action_X': row['action_X'],
-            'action_Y': row['action_Y'],
-            'opponent_left': row['opponent_left'],
-            'opponent_right': row['opponent_right'],
-            'opponent_up': row['opponent_up'],
-            'opponent_down': row['opponent_down'],
-            'opponent_A': row['opponent_A'],
-            'opponent_B': row['opponent_B'],
-            'opponent_X': row['opponent_X'],
-            'opponent_Y': row['opponent_Y']
-        }
-        
-        processed_data.append(processed_row)
+    return summary
+
+def print_throughput(rows, elapsed):
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    peak = peak_rss_mb()
+    peak_text = f"{peak:.1f} MiB" if peak is not None else "n/a"
+    worker_peak = peak_rss_mb(children=True)
+    if worker_peak:
+        peak_text += f" (largest worker {worker_peak:.1f} MiB)"
+    print(f"\nProcessed {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec), peak RSS {peak_text}")
+
+def iter_processed_chunks(input_file, chunksize=DEFAULT_CHUNKSIZE):
+    """Read a raw game data CSV in chunks and yield each chunk processed."""
+    for chunk in read_log(input_file, chunksize=chunksize):
+        yield process_dataframe(chunk)
+
+def process_dataframe(df):
+    """
+    Turn raw game data rows into the processed training format.
     
-    # Create DataFrame from processed data
-    processed_df = pd.DataFrame(processed_data)
+    Works column-wise: distance is computed with array operations and the flags are cast
+    from any truthy value (1, True, ...) to 0/1 in one step.
     
-    # Save to CSV
-    processed_df.to_csv(output_file, index=False)
-    print(f"Processed data saved to {output_file}")
+    Args:
+        df: DataFrame with the columns written by controller.py / the Extras bot
+    """
+    processed = {}
+    for column in PASSTHROUGH_COLUMNS:
+        processed[column] = df[column].to_numpy()
+    for column in FLAG_COLUMNS:
+        processed[column] = df[column].to_numpy().astype(bool).astype(np.int8)
     
-    # Print summary statistics
-    print("\nData Summary:")
-    print(f"Total samples: {len(processed_df)}")
-    print("\nButton Press Distribution:")
-    for button in ['action_left', 'action_right', 'action_up', 'action_down', 
-                  'action_A', 'action_B', 'action_X', 'action_Y']:
-        press_percentage = processed_df[button].mean() * 100
-        print(f"{button}: {press_percentage:.2f}% pressed")
+    # Calculate distance between players
+    dx = df['player_x'].to_numpy(dtype=np.float64) - df['opponent_x'].to_numpy(dtype=np.float64)
+    dy = df['player_y'].to_numpy(dtype=np.float64) - df['opponent_y'].to_numpy(dtype=np.float64)
+    processed['distance'] = np.sqrt(dx * dx + dy * dy).astype(np.float32)
+    
+    processed_df = pd.DataFrame({column: processed[column] for column in PROCESSED_COLUMNS})
+    
+    # Change-only logs: keep the repeat count so training can use it as a sample weight
+    if REPEAT_COLUMN in df.columns:
+        processed_df[REPEAT_COLUMN] = df[REPEAT_COLUMN].to_numpy()
     
     return processed_df
 
-def combine_multiple_files(pattern, output_file):
+def combine_multiple_files(pattern, output_file, catalog_path=None, outcome=None, opponent_id=None,
+                           chunksize=DEFAULT_CHUNKSIZE, workers=None, cache_dir=DEFAULT_CACHE_DIR,
+                           cache_key='stat'):
     """
     Combine multiple game data files into a single processed file
     
+    Files are preprocessed in parallel in a process pool. Their outputs are streamed into the
+    combined file in sorted input order, so the result is deterministic and the whole dataset
+    is never held in memory. Per-file outputs are cached, so only new or changed files are
+    processed again on the next run.
+    
     Args:
         pattern: Glob pattern to match input files (e.g. 'game_data_*.csv')
         output_file: Path to save the combined processed data
+        catalog_path: Optional session catalog; when given only the selected sessions are read
+        outcome: With a catalog, only sessions with this outcome ('win', 'loss' or 'draw')
+        opponent_id: With a catalog, only sessions against this opponent
+        chunksize: Number of rows processed at a time
+        workers: Number of worker processes (default: number of CPU cores)
+        cache_dir: Directory of cached per-file outputs, or None to always reprocess
+        cache_key: 'stat' to key cached files by size and mtime, 'hash' by content
     """
     # Find all files matching the pattern
-    input_files = glob.glob(pattern)
+    input_files = sorted(glob.glob(pattern))
     
     if not input_files:
         print(f"No files found matching pattern: {pattern}")
         return
     
-    print(f"Found {len(input_files)} files to process")
+    # With a catalog, read only the byte ranges of the selected sessions
+    selection = None
+    if catalog_path is not None:
+        catalog = update_catalog([pattern], catalog_path)
+        selection = select_segments(catalog, outcome=outcome, opponent_id=opponent_id, files=input_files)
+        input_files = list(selection)
+        if not input_files:
+            print("No sessions in the catalog match the selection")
+            return
     
-    all_processed_data = []
+    print(f"Found {len(input_files)} files to process")
     
-    # Process each file
-    for i, file in enumerate(input_files):
-        print(f"Processing file {i+1}/{len(input_files)}: {file}")
-        # Process file but don't save yet
-        df = preprocess_game_data(file, output_file=None)
-        all_processed_data.append(df)
+    # As soon as one input is a change-only log, every output row carries a repeat count
+    with_repeat = any(REPEAT_COLUMN in read_header(file) for file in input_files)
+    columns = PROCESSED_COLUMNS + ([REPEAT_COLUMN] if with_repeat else [])
     
-    # Combine all processed data
-    combined_df = pd.concat(all_processed_data, ignore_index=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(input_files)))
+    print(f"Processing with {workers} worker process(es)")
     
-    # Save combined data
-    combined_df.to_csv(output_file, index=False)
+    # Each file is processed into its own headerless part file; parts are appended to the
+    # output in input order as soon as they are ready. Files already in the cache are reused
+    start = time.perf_counter()
+    cache = PreprocessCache(cache_dir, PREPROCESS_VERSION, use_hash=cache_key == 'hash') if cache_dir else None
+    parts_dir = tempfile.mkdtemp(prefix='combine_parts_', dir=os.path.dirname(os.path.abspath(output_file)))
+    summaries = []
+    pool = None
+    try:
+        # Queue every file in input order: a cache hit is ready right away, a miss is processed
+        pending = []
+        for i, file in enumerate(input_files):
+            segments = selection[file] if selection is not None else None
+            key = cache.key(file, segments, with_repeat) if cache else None
+            cached = cache.lookup(key) if cache else None
+            if cached is not None:
+                pending.append((file, key, cached, None))
+                continue
+            task = (file, segments, os.path.join(parts_dir, f"part_{i:05d}.csv"), chunksize, with_repeat)
+            if pool is None and workers > 1:
+                pool = ProcessPoolExecutor(max_workers=workers)
+            result = pool.submit(_process_file_part, task) if pool else task
+            pending.append((file, key, task[2], result))
+        
+        with open(output_file, 'w', newline='') as out:
+            out.write(','.join(columns) + '\n')
+            for i, (file, key, part, result) in enumerate(pending):
+                if result is None:
+                    part_path, summary = part
+                    status = "cached"
+                else:
+                    summary = result.result() if pool else _process_file_part(result)
+                    part_path = cache.store(key, part, summary) if cache else part
+                    status = "processed"
+                print(f"File {i+1}/{len(input_files)} {status}: {file} ({summary['rows']} rows)")
+                with open(part_path, newline='') as part_file:
+                    shutil.copyfileobj(part_file, out)
+                if not cache:
+                    os.remove(part_path)
+                summaries.append(summary)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    elapsed = time.perf_counter() - start
     print(f"Combined processed data saved to {output_file}")
     
-    # Print summary statistics
-    print("\nCombined Data Summary:")
-    print(f"Total samples: {len(combined_df)}")
-    print("\nButton Press Distribution:")
-    for button in ['action_left', 'action_right', 'action_up', 'action_down', 
-                  'action_A', 'action_B', 'action_X', 'action_Y']:
-        press_percentage = combined_df[button].mean() * 100
-        print(f"{button}: {press_percentage:.2f}% pressed")
+    # Print summary statistics from the per-file partial aggregates
+    combined = merge_summaries(summaries)
+    print_summary("Combined Data Summary", combined)
+    print_throughput(combined['rows'], elapsed)
+    if cache:
+        cache.report()
+
+def _process_file_part(task):
+    """Worker for combine_multiple_files: process one file into a headerless part file and return its aggregate."""
+    file, segments, part_path, chunksize, with_repeat = task
+    source = open_segments(file, segments) if segments is not None else file
+    summary = new_summary()
+    with open(part_path, 'w', newline='') as part:
+        for processed_df in iter_processed_chunks(source, chunksize):
+            # Rows from dense logs stand for a single frame
+            if with_repeat and REPEAT_COLUMN not in processed_df.columns:
+                processed_df[REPEAT_COLUMN] = 1
+            processed_df.to_csv(part, index=False, header=False)
+            add_to_summary(summary, processed_df)
+    return summary
+
+def read_header(path):
+    """Column names of a CSV file."""
+    with open(path, newline='') as f:
+        return f.readline().strip().split(',')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Preprocess game data for neural network training')
@@ -146,9 +292,28 @@ if __name__ == "__main__":
                         help='Output file path (default: GameDataProcessed.csv)')
     parser.add_argument('--combine', action='store_true', 
                         help='Combine multiple files matching the input pattern')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help=f'Rows processed at a time (default: {DEFAULT_CHUNKSIZE})')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes used with --combine (default: number of CPU cores)')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                        help=f'Cache of per-file outputs used with --combine (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-key', choices=['stat', 'hash'], default='stat',
+                        help='Key cached files by size/mtime (stat) or by content hash (hash)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Reprocess every file and leave the cache untouched')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Delete all cached per-file outputs')
+    add_selection_arguments(parser)
     
     args = parser.parse_args()
     
+    if args.clear_cache:
+        removed = clear_cache(args.cache_dir)
+        print(f"Removed {removed} cached file(s) from {args.cache_dir}")
+        if args.input is None:
+            sys.exit(0)
+    
     if args.input is None:
         # No args, use GUI dialog if available
         try:
@@ -171,6 +336,8 @@ if __name__ == "__main__":
             print("Please specify an input file with --input")
     else:
         if args.combine:
-            combine_multiple_files(args.input, args.output)
+            combine_multiple_files(args.input, args.output, args.catalog, args.outcome, args.opponent,
+                                   args.chunksize, args.workers,
+                                   None if args.no_cache else args.cache_dir, args.cache_key)
         else:
-            preprocess_game_data(args.input, args.output) 
\ No newline at end of file
+            preprocess_game_data(args.input, args.output, args.chunksize) 
\ No newline at end of file
@@ -0,0 +1,305 @@
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import tensorflow as tf
+
+from log_schema import FEATURES, TARGETS, read_log
+
+# How many times each row with the button pressed appears in an epoch
+OVERSAMPLE_FACTORS = {
+    'action_up': 4,      # Reduce to decrease dominance
+    'action_down': 6,    # Increase to balance with up
+    'action_left': 6,    # Increase to balance with up
+    'action_right': 6,   # Increase to balance with up
+    'action_A': 12,      # Slightly increase to boost
+    'action_B': 12,      # Slightly increase to boost
+    'action_X': 8,       # Slightly increase to boost
+    'action_Y': 8        # Slightly increase to boost
+}
+
+# Scale of each button's balanced class weights (capped at MAX_CLASS_WEIGHT)
+WEIGHT_MULTIPLIERS = {
+    'action_left': 0.8,    # Moderate weight
+    'action_right': 0.8,   # Moderate weight
+    'action_up': 0.5,      # Reduce to decrease dominance
+    'action_down': 1.2,    # Increase to balance with up
+    'action_A': 3.5,       # Slightly increase to boost
+    'action_B': 3.5,       # Slightly increase to boost
+    'action_X': 1.8,       # Slightly increase to boost
+    'action_Y': 1.8        # Slightly increase to boost
+}
+MAX_CLASS_WEIGHT = 5.0
+
+
+def oversample_index(y, targets=TARGETS, factors=OVERSAMPLE_FACTORS):
+    """
+    Row index of the oversampled training set.
+
+    Every row appears once, and each row with a button pressed appears (factor - 1) more times
+    for that button, exactly as stacking copies of the rows would, but only the index is stored.
+
+    Args:
+        y: Base target matrix (rows x buttons)
+        targets: Button names of the columns of y
+        factors: Oversampling factor per button
+
+    Returns:
+        int64 array of row numbers into y (and the matching X and weights)
+    """
+    parts = [np.arange(len(y))]
+    for target, factor in factors.items():
+        indices = np.flatnonzero(y[:, targets.index(target)] == 1)
+        parts.extend([indices] * (factor - 1))
+    return np.concatenate(parts)
+
+
+def vstack_oversample(X, y, w, targets=TARGETS, factors=OVERSAMPLE_FACTORS):
+    """The previous materialized oversampling, kept for comparison with oversample_index."""
+    X_oversampled = X.copy()
+    y_oversampled = y.copy()
+    w_oversampled = w.copy()
+    for target, factor in factors.items():
+        indices = np.where(y[:, targets.index(target)] == 1)[0]
+        X_oversampled = np.vstack([X_oversampled] + [X[indices]] * (factor - 1))
+        y_oversampled = np.vstack([y_oversampled] + [y[indices]] * (factor - 1))
+        w_oversampled = np.concatenate([w_oversampled] + [w[indices]] * (factor - 1))
+    return X_oversampled, y_oversampled, w_oversampled
+
+
+def row_multiplicity(y, targets=TARGETS, factors=OVERSAMPLE_FACTORS):
+    """Times each row appears in the oversampled set; equal to np.bincount(oversample_index(y))."""
+    counts = np.ones(len(y), dtype=np.int64)
+    for target, factor in factors.items():
+        counts += (factor - 1) * (y[:, targets.index(target)] == 1)
+    return counts
+
+
+def class_counts(y, row_counts=None):
+    """(buttons, 2) array of how many (oversampled) rows have each button released and pressed."""
+    if row_counts is None:
+        row_counts = np.ones(len(y), dtype=np.int64)
+    pressed = row_counts @ (y == 1)
+    return np.stack([row_counts.sum() - pressed, pressed], axis=1)
+
+
+def class_weights(y, row_counts=None, targets=TARGETS, multipliers=WEIGHT_MULTIPLIERS):
+    """
+    Per-button class weights: sklearn's 'balanced' weights normalized so "Not Pressed" is 1,
+    scaled by the button's multiplier and capped at MAX_CLASS_WEIGHT.
+
+    Args:
+        y: Base target matrix (0/1)
+        row_counts: Times each row appears in an epoch (np.bincount of the oversampling index);
+                    None counts every row once
+        targets: Button names of the columns of y
+        multipliers: Weight multiplier per button
+
+    Returns:
+        Dict mapping column number to {class: weight}; buttons with a single class map it to 1.0
+    """
+    return class_weights_from_counts(class_counts(y, row_counts), targets, multipliers)
+
+
+def class_weights_from_counts(counts, targets=TARGETS, multipliers=WEIGHT_MULTIPLIERS):
+    """class_weights from a (buttons, 2) array of class counts, e.g. gathered in a streaming pass."""
+    class_weights_dict = {}
+    for i, target in enumerate(targets):
+        classes = np.flatnonzero(counts[i] > 0)
+        if len(classes) > 1:
+            weights = counts[i].sum() / (len(classes) * counts[i][classes])
+            weights = weights / weights[0]  # Normalize "Not Pressed" to 1
+            multiplier = multipliers[target]
+            class_weights_dict[i] = {cls: min(weight * multiplier, MAX_CLASS_WEIGHT) for cls, weight in zip(classes, weights)}
+        else:
+            class_weights_dict[i] = {classes[0]: 1.0}
+    return class_weights_dict
+
+
+def class_weight_table(class_weights_dict, n_targets=len(TARGETS)):
+    """
+    Turn the class weight dict into a (buttons, 2) array indexed by [button, class].
+
+    Buttons with a single class, and classes missing from a button, get 1.0 so they never
+    raise a row above the 1.0 floor used by gather_sample_weights.
+    """
+    table = np.ones((n_targets, 2))
+    for i, weights in class_weights_dict.items():
+        if len(weights) > 1:
+            for cls, weight in weights.items():
+                table[i, int(cls)] = weight
+    return table
+
+
+def gather_sample_weights(y, table):
+    """Per-row weight: the largest class weight among the row's buttons, at least 1.0."""
+    weights = table[np.arange(table.shape[0]), y.astype(np.intp)].max(axis=1)
+    return np.maximum(weights, 1.0)
+
+
+def loop_sample_weights(y, class_weights_dict):
+    """The previous per-row Python loop, kept as the reference for gather_sample_weights."""
+    weights = np.ones(len(y))
+    for j in range(len(y)):
+        max_weight = 1.0
+        for i in range(y.shape[1]):
+            if len(class_weights_dict[i]) > 1:
+                max_weight = max(max_weight, class_weights_dict[i].get(int(y[j, i]), 1.0))
+        weights[j] = max_weight
+    return weights
+
+
+def training_weights(y, frame_weights, factors=OVERSAMPLE_FACTORS, multipliers=WEIGHT_MULTIPLIERS, targets=TARGETS):
+    """
+    Steps 5-7 of train_model.py in one call.
+
+    Returns:
+        (oversampling index, per-row sample weights of the base rows)
+    """
+    index = oversample_index(y, targets, factors)
+    row_counts = np.bincount(index, minlength=len(y))
+    table = class_weight_table(class_weights(y, row_counts, targets, multipliers), len(targets))
+    return index, gather_sample_weights(y, table) * frame_weights
+
+
+class OversampledBatches(tf.keras.utils.Sequence):
+    """
+    Batches drawn from the base arrays through an oversampling index.
+
+    The index is shuffled at the start of every epoch; a batch gathers only its own rows, so the
+    oversampled set never exists in memory. With a seed, each epoch's order depends only on the
+    seed and the epoch number, so a resumed run (set_epoch) sees the same batches.
+    """
+
+    def __init__(self, X, y, index, sample_weight=None, batch_size=32, seed=None):
+        """
+        Args:
+            X: Base feature matrix
+            y: Base target matrix
+            index: Row numbers making up one epoch (from oversample_index)
+            sample_weight: Optional per-row weights of the base rows
+            batch_size: Rows per batch
+            seed: Seed of the per-epoch shuffle
+        """
+        super().__init__()
+        self.X = X
+        self.y = y
+        self.sample_weight = sample_weight
+        self.batch_size = batch_size
+        self.seed = seed
+        self.base_index = index
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        """Shuffle the index for the given epoch."""
+        self.epoch = epoch
+        rng = np.random.default_rng(None if self.seed is None else [self.seed, epoch])
+        self.index = rng.permutation(self.base_index)
+
+    def __len__(self):
+        return (len(self.index) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, batch):
+        rows = self.index[batch * self.batch_size:(batch + 1) * self.batch_size]
+        if self.sample_weight is None:
+            return self.X[rows], self.y[rows]
+        return self.X[rows], self.y[rows], self.sample_weight[rows]
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
+
+
+def _epoch_time(X, y, w=None, batches=None):
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(X.shape[1],)),
+        tf.keras.layers.Dense(64, activation='relu'),
+        tf.keras.layers.Dense(32, activation='relu'),
+        tf.keras.layers.Dense(16, activation='relu'),
+        tf.keras.layers.Dense(y.shape[1], activation='sigmoid'),
+    ])
+    model.compile(optimizer='adam', loss='binary_crossentropy')
+    start = time.perf_counter()
+    if batches is None:
+        model.fit(X, y, sample_weight=w, batch_size=32, epochs=1, verbose=0)
+    else:
+        model.fit(batches, epochs=1, verbose=0)
+    return time.perf_counter() - start
+
+
+def benchmark_sample_weights(y, class_weights_dict):
+    """
+    Check that gather_sample_weights matches the Python loop exactly and print the time of each.
+
+    Returns:
+        True if the two agree on every row
+    """
+    start = time.perf_counter()
+    expected = loop_sample_weights(y, class_weights_dict)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = class_weight_table(class_weights_dict, y.shape[1])
+    actual = gather_sample_weights(y, table)
+    vector_time = time.perf_counter() - start
+
+    same = np.array_equal(actual, expected)
+    print(f"Sample weights for {len(y)} rows: loop {loop_time:.3f}s, table gather {vector_time * 1000:.2f} ms "
+          f"({loop_time / vector_time:.0f}x faster), {'identical' if same else 'MISMATCH'}")
+    return same
+
+
+def compare(data_path, epoch=True):
+    """
+    Print the memory and one-epoch training time of stacked copies versus the oversampling index.
+
+    Args:
+        data_path: Processed training CSV
+        epoch: Also time one training epoch with each approach
+    """
+    df = read_log(data_path, required=FEATURES + TARGETS)
+    X = df[FEATURES].to_numpy(dtype=np.float64)
+    X = (X - X.mean(axis=0)) / np.where(X.std(axis=0) > 0, X.std(axis=0), 1.0)
+    y = df[TARGETS].to_numpy()
+    w = np.ones(len(df))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    X_big, y_big, w_big = vstack_oversample(X, y, w)
+    stack_time = time.perf_counter() - start
+    stack_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = oversample_index(y)
+    index_time = time.perf_counter() - start
+    index_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    base_mb = (X.nbytes + y.nbytes + w.nbytes) / 2**20
+    print(f"Base arrays: {len(X)} rows, {base_mb:.1f} MiB; oversampled epoch: {len(index)} rows")
+    print(f"np.vstack copies: {(X_big.nbytes + y_big.nbytes + w_big.nbytes) / 2**20:.1f} MiB kept, "
+          f"{stack_peak / 2**20:.1f} MiB peak, built in {stack_time:.2f}s")
+    print(f"Oversampling index: {index.nbytes / 2**20:.1f} MiB kept, "
+          f"{index_peak / 2**20:.1f} MiB peak, built in {index_time:.3f}s")
+
+    if epoch:
+        stacked = _epoch_time(X_big, y_big, w_big)
+        del X_big, y_big, w_big
+        indexed = _epoch_time(X, y, batches=OversampledBatches(X, y, index, w, seed=0))
+        print(f"One epoch: np.vstack arrays {stacked:.1f}s, oversampled batches {indexed:.1f}s")
+
+    # Timed on the oversampled rows, the workload of the previous Step 7 loop
+    return benchmark_sample_weights(y[index], class_weights(y, np.bincount(index, minlength=len(y))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare oversampling by stacked copies and by index, '
+                                                 'and the sample weight loop with the table gather')
+    parser.add_argument('data', help='Processed training CSV')
+    parser.add_argument('--no-epoch', action='store_true', help='Skip the training epoch timing')
+    args = parser.parse_args()
+    if not compare(args.data, epoch=not args.no_epoch):
+        sys.exit(1)
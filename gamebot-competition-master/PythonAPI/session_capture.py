@@ -0,0 +1,228 @@
+import argparse
+import struct
+import sys
+import time
+
+import numpy as np
+
+from argv_options import pop_option
+
+# Capture file layout: header, then one record per recv, recv_into or sendall call
+#   header: magic, seed (u64), player id (u8)
+#   record: direction (u8), nanoseconds since capture start (i64), payload length (u32), payload
+CAPTURE_MAGIC = b'SFCAP1'
+HEADER = struct.Struct('<QB')
+RECORD = struct.Struct('<BqI')
+
+RECV = 0
+SEND = 1
+
+
+class CaptureSocket:
+    """
+    Wraps the game socket and records the raw bytes of every recv and sendall call.
+
+    The hot path only appends a tuple to a list; records are packed and written in batches
+    of `flush_every` and on close.
+    """
+
+    def __init__(self, sock, capture_path, seed=0, player_id='1', flush_every=600):
+        """
+        Args:
+            sock: Connected client socket accepted by transport.listen()
+            capture_path: Path of the capture file to write
+            seed: NumPy seed used for the session, stored so the replay can reproduce it
+            player_id: Player ID ('1' or '2') the bot played as
+            flush_every: Number of records buffered before they are written to disk
+        """
+        self.sock = sock
+        self.capture_path = capture_path
+        self.flush_every = flush_every
+        self._records = []
+        self._file = open(capture_path, 'wb')
+        self._file.write(CAPTURE_MAGIC + HEADER.pack(seed, int(player_id)))
+        self._start = time.monotonic_ns()
+
+    def recv(self, bufsize):
+        pay_load = self.sock.recv(bufsize)
+        self._records.append((RECV, time.monotonic_ns(), pay_load))
+        if len(self._records) >= self.flush_every:
+            self.flush()
+        return pay_load
+
+    def recv_into(self, buffer, nbytes=0):
+        count = self.sock.recv_into(buffer, nbytes)
+        self._records.append((RECV, time.monotonic_ns(), bytes(memoryview(buffer)[:count])))
+        if len(self._records) >= self.flush_every:
+            self.flush()
+        return count
+
+    def sendall(self, pay_load):
+        self._records.append((SEND, time.monotonic_ns(), pay_load))
+        self.sock.sendall(pay_load)
+
+    def flush(self):
+        """Pack the buffered records and append them to the capture file."""
+        if not self._records:
+            return
+        chunks = []
+        for direction, t_ns, pay_load in self._records:
+            chunks.append(RECORD.pack(direction, t_ns - self._start, len(pay_load)))
+            chunks.append(pay_load)
+        self._file.write(b''.join(chunks))
+        self._file.flush()
+        self._records = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self.sock.close()
+
+    def __getattr__(self, name):
+        # Anything else (settimeout, fileno, ...) goes to the real socket
+        return getattr(self.sock, name)
+
+
+def pop_capture_arg(argv):
+    """Remove a `--capture <file>` pair from the command line arguments and return the file path."""
+    return pop_option(argv, '--capture')
+
+
+def start_capture(client_socket, capture_path, player_id):
+    """Seed NumPy for a reproducible session and wrap the socket in a CaptureSocket."""
+    seed = time.time_ns() % (2 ** 32)
+    np.random.seed(seed)
+    print(f"Capturing socket traffic to {capture_path} (seed {seed})")
+    return CaptureSocket(client_socket, capture_path, seed=seed, player_id=player_id)
+
+
+def read_capture(capture_path):
+    """
+    Read a capture file.
+
+    Returns:
+        (seed, player_id, records) where records is a list of (direction, t_ns, payload)
+    """
+    with open(capture_path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{capture_path} is not a capture file")
+
+    offset = len(CAPTURE_MAGIC)
+    seed, player_id = HEADER.unpack_from(data, offset)
+    offset += HEADER.size
+
+    records = []
+    while offset + RECORD.size <= len(data):
+        direction, t_ns, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        records.append((direction, t_ns, data[offset:offset + length]))
+        offset += length
+    return seed, str(player_id), records
+
+
+def frame_pairs(records):
+    """Pair each received state with the command sent in reply to it: (recv record, send record or None)."""
+    pairs = []
+    pending = None
+    for record in records:
+        if record[0] == RECV:
+            if pending is not None:
+                pairs.append((pending, None))
+            pending = record
+        elif pending is not None:
+            pairs.append((pending, record))
+            pending = None
+    if pending is not None:
+        pairs.append((pending, None))
+    return pairs
+
+
+def _latency_stats(values_ns):
+    values_us = np.asarray(values_ns, dtype=np.float64) / 1000
+    if len(values_us) == 0:
+        return "n/a"
+    return (f"mean {values_us.mean():.1f} us, p50 {np.percentile(values_us, 50):.1f} us, "
+            f"p95 {np.percentile(values_us, 95):.1f} us, max {values_us.max():.1f} us")
+
+
+def replay(capture_path, bot, realtime=False, max_diffs=10):
+    """
+    Feed a capture back into a bot through the controllers' decode path (transport.ReplayTransport).
+
+    Args:
+        capture_path: Capture file written by CaptureSocket
+        bot: Object with a fight(game_state, player_id) method (Bot or NeuralBot)
+        realtime: If True, wait until each state's original arrival time; otherwise run as fast as possible
+        max_diffs: Number of mismatching frames to print in detail
+
+    Returns:
+        Number of frames whose command differs from the captured one
+    """
+    from transport import ReplayTransport
+
+    transport = ReplayTransport(capture_path)
+    seed, player_id, pairs = transport.seed, transport.player_id, transport.pairs
+    np.random.seed(seed)
+
+    captured_latency = []
+    replay_latency = []
+    mismatches = 0
+    start = time.monotonic_ns()
+    for frame, (recv_record, send_record) in enumerate(pairs):
+        if realtime:
+            delay = (recv_record[1] - (time.monotonic_ns() - start)) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+
+        received_at = time.monotonic_ns()
+        game_state = transport.receive()
+        command = bot.fight(game_state, player_id)
+        transport.send(command)
+
+        if send_record is None:
+            continue
+        replay_latency.append(transport.sent[-1][0] - received_at)
+        captured_latency.append(send_record[1] - recv_record[1])
+
+        produced = transport.command_dict(transport.sent[-1][1])
+        captured = transport.command_dict(send_record[2])
+        if produced != captured:
+            mismatches += 1
+            if mismatches <= max_diffs:
+                key = 'p1' if player_id == '1' else 'p2'
+                changed = {button: (captured[key].get(button), value)
+                           for button, value in produced[key].items() if captured[key].get(button) != value}
+                print(f"Frame {frame}: command differs (button: captured -> replayed) {changed}")
+
+    compared = len(captured_latency)
+    print(f"\nReplayed {len(pairs)} frames from {capture_path} as Player {player_id} (seed {seed}, {transport.name})")
+    print(f"Commands matching the capture: {compared - mismatches}/{compared}")
+    print(f"Captured decision latency: {_latency_stats(captured_latency)}")
+    print(f"Replayed decision latency: {_latency_stats(replay_latency)}")
+    if compared:
+        diffs = np.asarray(replay_latency) - np.asarray(captured_latency)
+        print(f"Replayed minus captured: {_latency_stats(diffs)}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a captured socket session into a bot')
+    parser.add_argument('capture', help='Capture file written with --capture')
+    parser.add_argument('--bot', choices=['rule', 'nn'], default='rule',
+                        help='Bot to replay into: rule-based Bot or NeuralBot (default: rule)')
+    parser.add_argument('--model', default='StreetFighterBotMLP.keras', help='Model path for --bot nn')
+    parser.add_argument('--scaler', default='scaler.joblib', help='Scaler path for --bot nn')
+    parser.add_argument('--realtime', action='store_true',
+                        help='Deliver states at their original timing instead of as fast as possible')
+    args = parser.parse_args()
+
+    if args.bot == 'nn':
+        from nn_bot import NeuralBot
+        replay_bot = NeuralBot(model_path=args.model, scaler_path=args.scaler)
+    else:
+        from bot import Bot
+        replay_bot = Bot()
+
+    mismatched = replay(args.capture, replay_bot, realtime=args.realtime)
+    sys.exit(1 if mismatched else 0)
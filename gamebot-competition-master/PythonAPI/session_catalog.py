@@ -0,0 +1,307 @@
+import argparse
+import glob
+import io
+import json
+import math
+import os
+
+import pandas as pd
+
+from log_schema import REPEAT_COLUMN, TARGETS, read_log
+
+DEFAULT_CATALOG = 'session_catalog.json'
+# Version 2: malformed rows end a segment instead of staying inside its byte range
+CATALOG_VERSION = 2
+# Fields the catalog reads as numbers from every row
+NUMERIC_COLUMNS = ('session_id', 'match_id', 'frame', 'player_id', 'opponent_id', 'player_health',
+                   'opponent_health', 'winner')
+
+
+def load_catalog(catalog_path=DEFAULT_CATALOG):
+    """Load a catalog from disk, or return an empty one if it does not exist yet."""
+    if os.path.exists(catalog_path):
+        with open(catalog_path) as f:
+            catalog = json.load(f)
+        if catalog.get('version') == CATALOG_VERSION:
+            return catalog
+        print(f"Catalog {catalog_path} has an old format, rebuilding it")
+    return {'version': CATALOG_VERSION, 'files': {}}
+
+
+def save_catalog(catalog, catalog_path=DEFAULT_CATALOG):
+    tmp_path = catalog_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(catalog, f, indent=1)
+    os.replace(tmp_path, catalog_path)
+
+
+def _parse_row(line, n_columns, column_index, repeat_index):
+    """
+    Fields of one data line and its repeat count.
+
+    Raises ValueError if the line has the wrong number of fields or a numeric field does not
+    parse as a finite number.
+    """
+    values = line.decode().strip().split(',')
+    if len(values) != n_columns:
+        raise ValueError(f"{len(values)} fields instead of {n_columns}")
+    for name in NUMERIC_COLUMNS:
+        if not math.isfinite(float(values[column_index[name]])):
+            raise ValueError(f"{name} is {values[column_index[name]]}")
+    repeat = int(values[repeat_index]) if repeat_index is not None else 1
+    return values, repeat
+
+
+def _new_segment(start, values, column_index):
+    return {
+        'start': start,
+        'end': start,
+        'session_id': values[column_index['session_id']],
+        'match_id': values[column_index['match_id']],
+        'first_frame': int(float(values[column_index['frame']])),
+        'last_frame': int(float(values[column_index['frame']])),
+        'rows': 0,
+        'frames': 0,
+        'player_id': int(float(values[column_index['player_id']])),
+        'opponent_id': int(float(values[column_index['opponent_id']])),
+        'winner': -1,
+        'player_health_start': float(values[column_index['player_health']]),
+        'opponent_health_start': float(values[column_index['opponent_health']]),
+        'button_presses': {button: 0 for button in TARGETS},
+    }
+
+
+def _close_segment(segment, values, column_index):
+    player_end = float(values[column_index['player_health']])
+    opponent_end = float(values[column_index['opponent_health']])
+    segment['player_health_end'] = player_end
+    segment['opponent_health_end'] = opponent_end
+    # Positive when the player came out of the segment better than the opponent
+    segment['health_swing'] = ((player_end - segment['player_health_start']) -
+                               (opponent_end - segment['opponent_health_start']))
+    if player_end > opponent_end:
+        segment['outcome'] = 'win'
+    elif player_end < opponent_end:
+        segment['outcome'] = 'loss'
+    else:
+        segment['outcome'] = 'draw'
+
+
+def index_file(path, start_offset=None):
+    """
+    Scan one recorded log and split it into sessions/matches.
+
+    A segment is a run of consecutive rows with the same session_id and match_id. Its byte
+    range covers whole lines, so it can be read back without touching the rest of the file.
+    A malformed line (wrong field count, or a numeric field that does not parse) is left out:
+    it ends the current segment, and the rows after it start a new one.
+
+    Args:
+        path: Path to a game data CSV (dense or run-length encoded)
+        start_offset: Byte offset of a line to start scanning from (used when a file grew)
+
+    Returns:
+        (columns, header_end, segments)
+    """
+    segments = []
+    with open(path, 'rb') as f:
+        header = f.readline()
+        header_end = f.tell()
+        columns = header.decode().strip().split(',')
+        column_index = {name: i for i, name in enumerate(columns)}
+        button_index = [(button, column_index[button]) for button in TARGETS if button in column_index]
+        repeat_index = column_index.get(REPEAT_COLUMN)
+
+        offset = header_end if start_offset is None else start_offset
+        f.seek(offset)
+        segment = None
+        key = None
+        last_values = None
+        for line in f:
+            # Ignore a partially written last line; it is picked up by the next update
+            if not line.endswith(b'\n'):
+                break
+            try:
+                values, repeat = _parse_row(line, len(columns), column_index, repeat_index)
+            except ValueError:
+                if segment is not None:
+                    _close_segment(segment, last_values, column_index)
+                    segments.append(segment)
+                segment = key = None
+                offset += len(line)
+                continue
+
+            row_key = (values[column_index['session_id']], values[column_index['match_id']])
+            if row_key != key:
+                if segment is not None:
+                    _close_segment(segment, last_values, column_index)
+                    segments.append(segment)
+                segment = _new_segment(offset, values, column_index)
+                key = row_key
+
+            offset += len(line)
+            segment['end'] = offset
+            segment['rows'] += 1
+            segment['frames'] += repeat
+            segment['last_frame'] = int(float(values[column_index['frame']])) + repeat - 1
+            winner = int(float(values[column_index['winner']]))
+            if winner != -1:
+                segment['winner'] = winner
+            for button, i in button_index:
+                if values[i] not in ('0', '0.0', 'False', ''):
+                    segment['button_presses'][button] += repeat
+            last_values = values
+
+        if segment is not None:
+            _close_segment(segment, last_values, column_index)
+            segments.append(segment)
+
+    for segment in segments:
+        segment['session_id'] = int(float(segment['session_id']))
+        segment['match_id'] = int(float(segment['match_id']))
+    return columns, header_end, segments
+
+
+def update_catalog(patterns, catalog_path=DEFAULT_CATALOG):
+    """
+    Index new and changed files matching the glob patterns and save the catalog.
+
+    Unchanged files (same size and mtime) are skipped. A file that only grew, as GameData.csv
+    does when the Extras bot appends to it, is rescanned from the start of its last segment.
+    Files that no longer exist are dropped.
+    """
+    catalog = load_catalog(catalog_path)
+    files = catalog['files']
+
+    paths = sorted({os.path.normpath(p) for pattern in patterns for p in glob.glob(pattern)})
+    paths = [p for p in paths if os.path.abspath(p) != os.path.abspath(catalog_path)]
+    indexed = 0
+    for path in paths:
+        stat = os.stat(path)
+        entry = files.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            continue
+
+        if entry and entry['segments'] and stat.st_size > entry['size']:
+            kept = entry['segments'][:-1]
+            columns, header_end, new_segments = index_file(path, start_offset=entry['segments'][-1]['start'])
+            segments = kept + new_segments
+        else:
+            columns, header_end, segments = index_file(path)
+
+        files[path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'columns': columns,
+            'header_end': header_end,
+            'segments': segments,
+        }
+        indexed += 1
+
+    for path in list(files):
+        if not os.path.exists(path):
+            del files[path]
+
+    save_catalog(catalog, catalog_path)
+    print(f"Catalog {catalog_path}: {indexed} file(s) indexed, {len(files)} file(s), "
+          f"{sum(len(entry['segments']) for entry in files.values())} session(s)")
+    return catalog
+
+
+def select_segments(catalog, outcome=None, opponent_id=None, player_id=None, files=None):
+    """
+    Pick segments from the catalog.
+
+    Args:
+        catalog: Catalog returned by load_catalog/update_catalog
+        outcome: 'win', 'loss' or 'draw' (by final health), or None for all
+        opponent_id: Only sessions against this opponent id
+        player_id: Only sessions with this player id
+        files: Only segments from these file paths
+
+    Returns:
+        Dict mapping file path to its list of selected segments
+    """
+    wanted_files = {os.path.normpath(p) for p in files} if files is not None else None
+    selection = {}
+    for path, entry in catalog['files'].items():
+        if wanted_files is not None and path not in wanted_files:
+            continue
+        chosen = [
+            segment for segment in entry['segments']
+            if (outcome is None or segment['outcome'] == outcome)
+            and (opponent_id is None or segment['opponent_id'] == opponent_id)
+            and (player_id is None or segment['player_id'] == player_id)
+        ]
+        if chosen:
+            selection[path] = chosen
+    return selection
+
+
+def open_segments(path, segments):
+    """Return a file-like object holding the header and only the selected byte ranges of one file."""
+    ranges = []
+    for segment in sorted(segments, key=lambda s: s['start']):
+        if ranges and ranges[-1][1] == segment['start']:
+            ranges[-1][1] = segment['end']
+        else:
+            ranges.append([segment['start'], segment['end']])
+
+    with open(path, 'rb') as f:
+        parts = [f.readline()]
+        for start, end in ranges:
+            f.seek(start)
+            parts.append(f.read(end - start))
+
+    buffer = io.BytesIO(b''.join(parts))
+    buffer.name = path
+    return buffer
+
+
+def read_segments(selection):
+    """Load the selected segments of every file into one DataFrame."""
+    frames = [read_log(open_segments(path, segments)) for path, segments in selection.items()]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def add_selection_arguments(parser):
+    """Add the subset selection options shared by preprocess_data.py and train_model.py."""
+    parser.add_argument('--catalog', type=str, default=None,
+                        help=f'Session catalog to select from (e.g. {DEFAULT_CATALOG})')
+    parser.add_argument('--outcome', choices=['win', 'loss', 'draw'], default=None,
+                        help='Only sessions with this outcome for the recorded player')
+    parser.add_argument('--opponent', type=int, default=None,
+                        help='Only sessions against this opponent_id')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index recorded game data sessions')
+    parser.add_argument('--catalog', type=str, default=DEFAULT_CATALOG,
+                        help=f'Catalog file (default: {DEFAULT_CATALOG})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser('update', help='Index new or changed files')
+    update_parser.add_argument('patterns', nargs='*', default=['game_data_*.csv', 'GameData*.csv'],
+                               help='Glob patterns of recorded logs (default: game_data_*.csv GameData*.csv)')
+
+    list_parser = subparsers.add_parser('list', help='List indexed sessions')
+    list_parser.add_argument('--outcome', choices=['win', 'loss', 'draw'], default=None)
+    list_parser.add_argument('--opponent', type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        update_catalog(args.patterns, args.catalog)
+    else:
+        selected = select_segments(load_catalog(args.catalog), outcome=args.outcome, opponent_id=args.opponent)
+        total_frames = 0
+        for file_path, file_segments in selected.items():
+            for seg in file_segments:
+                total_frames += seg['frames']
+                print(f"{file_path} [{seg['start']}:{seg['end']}] session {seg['session_id']} "
+                      f"match {seg['match_id']} frames {seg['first_frame']}-{seg['last_frame']} "
+                      f"player {seg['player_id']} vs {seg['opponent_id']} {seg['outcome']} "
+                      f"(winner {seg['winner']}, swing {seg['health_swing']:+.0f})")
+        print(f"\n{sum(len(s) for s in selected.values())} session(s), {total_frames} frames")
@@ -0,0 +1,315 @@
+import argparse
+import contextlib
+import io
+import mmap
+import multiprocessing
+import os
+import platform
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from command import Command
+from game_state import GameState
+from wire_codec import (COMMAND, STATE, WIRE_VERSION, StandInGame, decode_command, decode_state, encode_command,
+                        encode_state, negotiate)
+
+RING_MAGIC = b'SFRB'
+DEFAULT_SLOTS = 4
+# Ring files live in RAM on Linux; elsewhere the temp directory's pages stay in the page cache
+RING_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+# Header: magic and wire version in the first 8 bytes, then these 64-bit words
+HEADER_SIZE = 64
+SLOTS, ATTACHED, CLOSED, STATES_WRITTEN, STATES_READ, COMMANDS_WRITTEN, COMMANDS_READ = range(1, 8)
+# Checks of the counter before giving up the CPU. On a single core the peer cannot run while
+# we spin, so there the wait yields straight away.
+DEFAULT_SPIN = 2000 if (os.cpu_count() or 1) > 1 else 0
+# After spinning, the wait yields the CPU for this long, then sleeps in growing steps up to MAX_SLEEP
+YIELD_SECONDS = 0.002
+MIN_SLEEP = 0.00005
+MAX_SLEEP = 0.0002
+DEFAULT_BENCH_FRAMES = 3000
+# Machines whose stores become visible to other cores in program order. Python has no memory
+# fences, so the ring is only safe where the hardware gives that ordering for free.
+X86_MACHINES = ('x86_64', 'amd64', 'i386', 'i486', 'i586', 'i686', 'x86')
+
+
+def ring_path(port):
+    """Ring file of a player's port (the port the TCP transport would listen on)."""
+    return os.path.join(RING_DIR, f'street_fighter_{port}.ring')
+
+
+def _stride(size):
+    # Slots start on 8-byte boundaries
+    return (size + 7) // 8 * 8
+
+
+_yield = os.sched_yield if hasattr(os, 'sched_yield') else lambda: time.sleep(0)
+
+
+def check_store_order():
+    """Refuse the ring on CPUs (ARM, POWER, ...) that may reorder the slot copy after the counter bump."""
+    machine = platform.machine()
+    if machine.lower() not in X86_MACHINES:
+        raise RuntimeError(f"The shared-memory ring needs x86 store ordering, not {machine or 'an unknown machine'}; "
+                           f"use the tcp transport")
+
+
+class SharedRing:
+    """
+    Game states and commands passed through a memory-mapped file instead of a socket.
+
+    The file holds two single-producer single-consumer queues of fixed-size binary-codec
+    messages: states from the game to the bot and commands back. Each queue has a written
+    and a read counter; a message is copied into slot `written % slots` before the written
+    counter is bumped with one aligned 64-bit store, so the reader never sees it half
+    written (stores become visible in program order on x86; create() and attach() refuse
+    other machines, where they may not). A writer waits while the
+    queue is full and a reader while it is empty: it spins, then yields the CPU, then
+    sleeps in short steps.
+    """
+
+    def __init__(self, path, file, owner, spin=DEFAULT_SPIN):
+        self.path = path
+        self.spin = spin
+        self.owner = owner
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._file = file
+        self._map = mmap.mmap(file.fileno(), 0)
+        self._counters = memoryview(self._map)[:HEADER_SIZE].cast('Q')
+        self.slots = self._counters[SLOTS]
+        state_offset = HEADER_SIZE
+        command_offset = state_offset + self.slots * _stride(STATE.size)
+        # (written counter, read counter, first slot, slot stride, message size)
+        self._states = (STATES_WRITTEN, STATES_READ, state_offset, _stride(STATE.size), STATE.size)
+        self._commands = (COMMANDS_WRITTEN, COMMANDS_READ, command_offset, _stride(COMMAND.size), COMMAND.size)
+
+    @classmethod
+    def create(cls, path, slots=DEFAULT_SLOTS, spin=DEFAULT_SPIN):
+        """Create the ring file (bot side), replacing any left from an earlier run."""
+        check_store_order()
+        size = HEADER_SIZE + slots * (_stride(STATE.size) + _stride(COMMAND.size))
+        # Initialized under a temporary name so the game never attaches to a half-written header
+        with open(path + '.tmp', 'w+b') as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as init:
+                init[:len(RING_MAGIC) + 1] = RING_MAGIC + bytes([WIRE_VERSION])
+                init[SLOTS * 8:SLOTS * 8 + 8] = slots.to_bytes(8, 'little')
+        os.replace(path + '.tmp', path)
+        return cls(path, open(path, 'r+b'), owner=True, spin=spin)
+
+    @classmethod
+    def attach(cls, path, timeout=None, spin=DEFAULT_SPIN):
+        """Open the ring file the bot created (game side), waiting for it to appear."""
+        check_store_order()
+        start = time.perf_counter()
+        while not os.path.exists(path):
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError(f"No ring at {path} after {timeout}s")
+            time.sleep(0.01)
+        ring = cls(path, open(path, 'r+b'), owner=False, spin=spin)
+        header = bytes(ring._map[:len(RING_MAGIC) + 1])
+        if header != RING_MAGIC + bytes([WIRE_VERSION]):
+            ring.close()
+            raise ValueError(f"{path} is not a wire version {WIRE_VERSION} ring")
+        ring._counters[ATTACHED] = 1
+        return ring
+
+    def wait_attached(self, timeout=None):
+        self._wait(ATTACHED, 1, timeout)
+
+    def _wait(self, index, value, timeout):
+        """Wait until the counter at `index` reaches `value`."""
+        counters = self._counters
+        for _ in range(self.spin):
+            if counters[index] >= value:
+                return
+        start = time.perf_counter()
+        pause = MIN_SLEEP
+        while counters[index] < value:
+            if counters[CLOSED]:
+                raise ConnectionError("The other side closed the ring")
+            elapsed = time.perf_counter() - start
+            if timeout is not None and elapsed > timeout:
+                raise TimeoutError(f"Nothing from the other side of {self.path} for {timeout}s")
+            if elapsed < YIELD_SECONDS:
+                _yield()
+            else:
+                time.sleep(pause)
+                pause = min(pause * 2, MAX_SLEEP)
+
+    def _put(self, queue, payload, timeout):
+        written_index, read_index, offset, stride, size = queue
+        written = self._counters[written_index]
+        self._wait(read_index, written - self.slots + 1, timeout)
+        start = offset + written % self.slots * stride
+        self._map[start:start + size] = payload
+        self._counters[written_index] = written + 1
+        self.bytes_sent += size
+
+    def _get(self, queue, timeout):
+        written_index, read_index, offset, stride, size = queue
+        read = self._counters[read_index]
+        self._wait(written_index, read + 1, timeout)
+        start = offset + read % self.slots * stride
+        payload = self._map[start:start + size]
+        self._counters[read_index] = read + 1
+        self.bytes_received += size
+        return payload
+
+    def send_state(self, payload, timeout=None):
+        self._put(self._states, payload, timeout)
+
+    def receive_state(self, timeout=None):
+        return self._get(self._states, timeout)
+
+    def send_command(self, payload, timeout=None):
+        self._put(self._commands, payload, timeout)
+
+    def receive_command(self, timeout=None):
+        return self._get(self._commands, timeout)
+
+    def close(self):
+        """Tell the other side the connection is over and unmap; the bot side also removes the file."""
+        if self._map.closed:
+            return
+        self._counters[CLOSED] = 1
+        self._counters.release()
+        self._map.close()
+        self._file.close()
+        if self.owner:
+            with contextlib.suppress(OSError):
+                os.remove(self.path)
+
+
+def connect(port, slots=DEFAULT_SLOTS, timeout=None):
+    """Create the ring of the player's port and wait for the game to attach, like a socket accept."""
+    ring = SharedRing.create(ring_path(port), slots)
+    ring.wait_attached(timeout)
+    print("Connected to game!")
+    return ring
+
+
+def send(ring, command):
+    ring.send_command(encode_command(command))
+
+
+def receive(ring):
+    return GameState(decode_state(ring.receive_state()))
+
+
+class SharedMemoryStandIn(StandInGame):
+    """StandInGame that attaches to the bot's ring instead of connecting to its port."""
+
+    def run(self):
+        """Play one round against the bot that created the port's ring. Returns the seconds it took."""
+        ring = SharedRing.attach(ring_path(self.port))
+        try:
+            return self.play(lambda input_dict: ring.send_state(encode_state(input_dict)),
+                             lambda: decode_command(ring.receive_command()))
+        finally:
+            self.bytes_sent, self.bytes_received = ring.bytes_sent, ring.bytes_received
+            ring.close()
+
+
+def _load_simulator():
+    import simulator  # noqa: F401
+
+
+def _stand_in(transport, port, frames, seed):
+    """Game side of a benchmark round (run in a separate process)."""
+    game = (SharedMemoryStandIn if transport == 'shm' else StandInGame)(port, 'binary', '1', seed, frames)
+    seconds = game.run()
+    return game.frames_played, game.bytes_sent + game.bytes_received, seconds
+
+
+def _bot_round(transport, frames, seed, pool):
+    """Play the bot side of one round against a stand-in game in `pool`; returns the per-frame latencies."""
+    if transport == 'shm':
+        port = 40000 + os.getpid() % 20000
+        ring = SharedRing.create(ring_path(port))
+        future = pool.submit(_stand_in, transport, port, frames, seed)
+        ring.wait_attached()
+        channel, do_send, do_receive = ring, send, receive
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        future = pool.submit(_stand_in, transport, listener.getsockname()[1], frames, seed)
+        channel, _ = listener.accept()
+        listener.close()
+        channel.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        codec = negotiate(channel)
+        do_send, do_receive = codec.send, codec.receive
+
+    # A constant bot, so the frame time is the transport, the codec and the stand-in's simulator
+    command = Command()
+    latencies = []
+    game_state = do_receive(channel)
+    while not game_state.is_round_over:
+        start = time.perf_counter_ns()
+        do_send(channel, command)
+        game_state = do_receive(channel)
+        latencies.append(time.perf_counter_ns() - start)
+    channel.close()
+    frames_played, wire_bytes, seconds = future.result()
+    return np.array(latencies) / 1000, frames_played, wire_bytes, seconds
+
+
+def benchmark(frames=DEFAULT_BENCH_FRAMES, seed=0, rounds=3):
+    """
+    Round trips of TCP loopback with the binary codec against the shared-memory ring.
+
+    The game side is a stand-in in its own process; the bot answers every state with the
+    same command. The latency is from sending a command to holding the next state.
+    """
+    for variable in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OMP_NUM_THREADS'):
+        os.environ[variable] = '1'
+    print(f"{rounds} round(s) of up to {frames} frames per transport, spin {DEFAULT_SPIN}, "
+          f"{os.cpu_count()} CPU core(s)\n")
+    print(f"{'transport':<10} {'frames':>7} {'B/frame':>8} {'frames/s':>9} {'mean':>9} {'p50':>9} {'p99':>9}")
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # Import the simulator in the worker before anything is timed
+        pool.submit(_load_simulator).result()
+        for transport in ('tcp', 'shm'):
+            latencies, played, wire_bytes, seconds = [], 0, 0, 0.0
+            for i in range(rounds):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    us, frames_played, round_bytes, round_seconds = _bot_round(transport, frames, seed + i, pool)
+                latencies.append(us)
+                played += frames_played
+                wire_bytes += round_bytes
+                seconds += round_seconds
+            us = np.concatenate(latencies)
+            print(f"{transport:<10} {played:>7} {wire_bytes / max(played, 1):>8.1f} {played / seconds:>9.0f} "
+                  f"{np.mean(us):>6.1f} us {np.percentile(us, 50):>6.1f} us {np.percentile(us, 99):>6.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Shared-memory ring transport: stand-in game and benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Stand-in game: attach to a bot\'s ring and play one simulated '
+                                                       'round (run the controller with --transport shm)')
+    serve_parser.add_argument('player', choices=['1', '2'], help='Player the bot controls')
+    serve_parser.add_argument('--frames', type=int, default=None, help='End the round after this many frames')
+    serve_parser.add_argument('--seed', type=int, default=0)
+
+    bench_parser = subparsers.add_parser('bench', help='Compare round trips with TCP loopback')
+    bench_parser.add_argument('--frames', type=int, default=DEFAULT_BENCH_FRAMES,
+                              help=f'Frame limit of every benchmark round (default: {DEFAULT_BENCH_FRAMES})')
+    bench_parser.add_argument('--rounds', type=int, default=3, help='Rounds per transport (default: 3)')
+    bench_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        stand_in = SharedMemoryStandIn(9999 if args.player == '1' else 10000, 'binary', args.player, args.seed,
+                                       args.frames)
+        seconds = stand_in.run()
+        print(f"{stand_in.frames_played} frames in {seconds:.2f}s over {ring_path(stand_in.port)}")
+    else:
+        benchmark(args.frames, args.seed, args.rounds)
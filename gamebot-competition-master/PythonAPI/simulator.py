@@ -0,0 +1,490 @@
+import argparse
+import contextlib
+import os
+import random
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from game_state import GameState
+
+# Approximate Street Fighter II figures: full health, floor height and round length
+MAX_HEALTH = 176
+GROUND_Y = 192
+STAGE_LEFT = 40
+STAGE_RIGHT = 470
+START_X = (180, 330)
+ROUND_TIME = 99
+FRAMES_PER_TICK = 60
+CHARACTERS = (0, 0)
+
+WALK_SPEED = 2
+JUMP_SPEED = 3
+# Jumps are integer ballistics: up at JUMP_VELOCITY pixels per frame, slowed by GRAVITY every frame
+JUMP_VELOCITY = -12
+GRAVITY = 1
+# Closest two grounded fighters can stand
+BODY_WIDTH = 40
+HITSTUN_FRAMES = 16
+BLOCKSTUN_FRAMES = 8
+HIT_PUSHBACK = 10
+BLOCK_PUSHBACK = 6
+# Frames of directional input searched for a special move's motion
+MOTION_WINDOW = 15
+
+PUNCHES = ('Y', 'X', 'L')
+KICKS = ('B', 'A', 'R')
+BUTTON_NAMES = ('Up', 'Down', 'Right', 'Left', 'Select', 'Start', 'Y', 'B', 'X', 'A', 'L', 'R')
+
+# height: what the defender has to do to block it ('mid' either stance, 'low' crouching,
+# 'high' standing); jump attacks end on landing
+Move = namedtuple('Move', 'move_id startup active recovery damage reach height')
+NORMALS = {
+    ('stand', 'Y'): Move(1, 3, 2, 6, 8, 60, 'mid'),
+    ('stand', 'X'): Move(2, 5, 3, 10, 12, 65, 'mid'),
+    ('stand', 'L'): Move(3, 7, 4, 18, 20, 70, 'mid'),
+    ('stand', 'B'): Move(4, 4, 2, 8, 8, 65, 'mid'),
+    ('stand', 'A'): Move(5, 6, 3, 12, 14, 75, 'mid'),
+    ('stand', 'R'): Move(6, 8, 4, 20, 22, 85, 'mid'),
+    ('crouch', 'Y'): Move(7, 3, 2, 6, 7, 55, 'mid'),
+    ('crouch', 'X'): Move(8, 5, 3, 10, 11, 60, 'mid'),
+    ('crouch', 'L'): Move(9, 6, 4, 18, 18, 65, 'mid'),
+    ('crouch', 'B'): Move(10, 4, 2, 8, 7, 70, 'low'),
+    ('crouch', 'A'): Move(11, 6, 3, 12, 12, 80, 'low'),
+    ('crouch', 'R'): Move(12, 8, 4, 22, 20, 90, 'low'),
+    ('air', 'Y'): Move(13, 3, 8, 0, 8, 55, 'high'),
+    ('air', 'X'): Move(14, 4, 8, 0, 12, 60, 'high'),
+    ('air', 'L'): Move(15, 5, 8, 0, 18, 65, 'high'),
+    ('air', 'B'): Move(16, 3, 8, 0, 8, 60, 'high'),
+    ('air', 'A'): Move(17, 4, 8, 0, 12, 65, 'high'),
+    ('air', 'R'): Move(18, 5, 8, 0, 18, 70, 'high'),
+}
+CROUCHING_MOVES = frozenset(move for (stance, _), move in NORMALS.items() if stance == 'crouch')
+AIR_MOVES = frozenset(move for (stance, _), move in NORMALS.items() if stance == 'air')
+# Quarter circle forward + punch throws a projectile; quarter circle back + kick travels forward
+FIREBALL = Move(19, 12, 1, 30, 20, 0, 'mid')
+HURRICANE = Move(20, 8, 16, 12, 22, 60, 'high')
+FIREBALL_MOTION = ('down', 'down-forward', 'forward')
+HURRICANE_MOTION = ('down', 'down-back', 'back')
+FIREBALL_SPEED = 4
+FIREBALL_WIDTH = 20
+# Fireballs pass under fighters higher than this above the floor
+FIREBALL_HEIGHT = 30
+HURRICANE_SPEED = 3
+HITSTUN_ID = 30
+BLOCKSTUN_ID = 31
+# Share of a special move's damage taken when blocking it
+CHIP_DIVISOR = 4
+
+
+class Fighter:
+    """State of one fighter between frames."""
+
+    __slots__ = ('x', 'y', 'vx', 'vy', 'health', 'facing', 'crouching', 'move', 'move_frame', 'stun',
+                 'stun_id', 'connected', 'buttons', 'motion', 'projectile')
+
+    def __init__(self, x):
+        self.x = x
+        self.y = GROUND_Y
+        self.vx = 0
+        self.vy = 0
+        self.health = MAX_HEALTH
+        self.facing = 1
+        self.crouching = False
+        self.move = None
+        self.move_frame = 0
+        self.stun = 0
+        self.stun_id = 0
+        self.connected = False
+        self.buttons = {name: False for name in BUTTON_NAMES}
+        self.motion = deque(maxlen=MOTION_WINDOW)
+        # x of this fighter's fireball in flight, or None
+        self.projectile = None
+
+    @property
+    def airborne(self):
+        return self.y < GROUND_Y
+
+    @property
+    def in_move(self):
+        return self.move is not None or self.stun > 0
+
+    @property
+    def move_id(self):
+        if self.stun > 0:
+            return self.stun_id
+        return self.move.move_id if self.move is not None else 0
+
+    def direction(self, buttons):
+        """Held direction relative to the opponent: 'forward', 'down-back', ... or 'neutral'."""
+        toward, away = ('Right', 'Left') if self.facing > 0 else ('Left', 'Right')
+        horizontal = 'forward' if buttons[toward] else 'back' if buttons[away] else ''
+        if buttons['Down']:
+            return 'down-' + horizontal if horizontal else 'down'
+        if buttons['Up']:
+            return 'up-' + horizontal if horizontal else 'up'
+        return horizontal or 'neutral'
+
+    def performed(self, motion):
+        """Whether the last MOTION_WINDOW frames of input contain the motion, ending on this frame."""
+        if not self.motion or self.motion[-1] != motion[-1]:
+            return False
+        position = 0
+        for direction in self.motion:
+            if direction == motion[position]:
+                position += 1
+                if position == len(motion):
+                    return True
+        return False
+
+    def player_dict(self, character):
+        return {
+            'character': character,
+            'health': self.health,
+            'x': self.x,
+            'y': self.y,
+            'jumping': self.airborne,
+            'crouching': self.crouching,
+            'buttons': dict(self.buttons),
+            'in_move': self.in_move,
+            'move': self.move_id,
+        }
+
+
+class FightSimulator:
+    """
+    Deterministic stand-in for one round of the game, with no emulator or ROM.
+
+    Two fighters walk, jump, crouch, block (holding back) and attack with six normal moves per
+    stance plus two special moves entered as motions, each a startup/active/recovery state
+    machine. Hits take health and put the defender in hitstun; the timer counts down once per
+    FRAMES_PER_TICK frames and the round ends at a KO or time over. The figures are close to
+    the real game's but not taken from it: states have the right shape and plausible dynamics,
+    not frame-exact behaviour.
+
+    Every frame is the dict GameState(input_dict) consumes; the same seed and the same button
+    inputs always give the same frames.
+    """
+
+    def __init__(self, seed=0, start_jitter=20, characters=CHARACTERS):
+        """
+        Args:
+            seed: Seed of the start position jitter
+            start_jitter: Largest random shift of the start positions, in pixels
+            characters: Character ids reported for the two players
+        """
+        self.seed = seed
+        self.start_jitter = start_jitter
+        self.characters = characters
+        self.rng = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        """Start a new round. Returns its first frame."""
+        shift = self.rng.randint(-self.start_jitter, self.start_jitter) if self.start_jitter else 0
+        self.fighters = (Fighter(START_X[0] + shift), Fighter(START_X[1] + shift))
+        self.frame = 0
+        self.timer = ROUND_TIME
+        self.round_over = False
+        self.winner = -1
+        self._face()
+        return self.state()
+
+    def state(self):
+        """The current frame as GameState's input dict."""
+        p1, p2 = self.fighters
+        return {
+            'p1': p1.player_dict(self.characters[0]),
+            'p2': p2.player_dict(self.characters[1]),
+            'timer': self.timer,
+            'result': self.winner,
+            'round_started': True,
+            'round_over': self.round_over,
+        }
+
+    def step(self, p1_buttons=None, p2_buttons=None):
+        """
+        Advance one frame.
+
+        Args:
+            p1_buttons: Held buttons of player 1 as a Buttons.object_to_dict() dict (None for none)
+            p2_buttons: Same for player 2
+
+        Returns:
+            The new frame as GameState's input dict; after the round is over the last frame is repeated
+        """
+        if self.round_over:
+            return self.state()
+        for fighter, buttons in zip(self.fighters, (p1_buttons, p2_buttons)):
+            self._control(fighter, buttons or {})
+        for fighter in self.fighters:
+            self._advance(fighter)
+
+        hits = [(attacker, defender, attacker.move) for attacker, defender in (self.fighters, self.fighters[::-1])
+                if self._connects(attacker, defender)]
+        hits += self._projectile_hits()
+        # Both sides' hits are found before any is applied, so simultaneous attacks trade
+        for attacker, defender, move in hits:
+            self._resolve(attacker, defender, move)
+
+        self._separate()
+        self._face()
+        self.frame += 1
+        if self.frame % FRAMES_PER_TICK == 0:
+            self.timer = max(0, self.timer - 1)
+        self._check_round_end()
+        return self.state()
+
+    def _control(self, fighter, buttons):
+        buttons = {name: bool(buttons.get(name, False)) for name in BUTTON_NAMES}
+        pressed = [name for name in PUNCHES + KICKS if buttons[name] and not fighter.buttons[name]]
+        fighter.buttons = buttons
+        fighter.motion.append(fighter.direction(buttons))
+        fighter.crouching = False
+        if fighter.in_move:
+            return
+
+        if fighter.airborne:
+            if pressed:
+                self._start(fighter, NORMALS[('air', pressed[0])])
+            return
+
+        punch = next((name for name in pressed if name in PUNCHES), None)
+        kick = next((name for name in pressed if name in KICKS), None)
+        if punch and fighter.projectile is None and fighter.performed(FIREBALL_MOTION):
+            self._start(fighter, FIREBALL)
+        elif kick and fighter.performed(HURRICANE_MOTION):
+            self._start(fighter, HURRICANE)
+        elif buttons['Up']:
+            fighter.vy = JUMP_VELOCITY
+            fighter.vx = JUMP_SPEED * (buttons['Right'] - buttons['Left'])
+            # A button pressed with the jump comes out as a jump attack
+            if pressed:
+                self._start(fighter, NORMALS[('air', pressed[0])])
+        elif pressed:
+            stance = 'crouch' if buttons['Down'] else 'stand'
+            fighter.crouching = buttons['Down']
+            self._start(fighter, NORMALS[(stance, pressed[0])])
+        elif buttons['Down']:
+            fighter.crouching = True
+        else:
+            fighter.x += WALK_SPEED * (buttons['Right'] - buttons['Left'])
+
+    @staticmethod
+    def _start(fighter, move):
+        fighter.move = move
+        fighter.move_frame = 0
+        fighter.connected = False
+
+    def _advance(self, fighter):
+        if fighter.stun > 0:
+            fighter.stun -= 1
+        if fighter.move is not None:
+            fighter.move_frame += 1
+            move = fighter.move
+            if move is HURRICANE and move.startup < fighter.move_frame <= move.startup + move.active:
+                fighter.x += HURRICANE_SPEED * fighter.facing
+            if move is FIREBALL and fighter.move_frame == move.startup:
+                fighter.projectile = fighter.x + fighter.facing * BODY_WIDTH
+            if fighter.move_frame >= move.startup + move.active + move.recovery:
+                fighter.move = None
+            elif move in CROUCHING_MOVES:
+                fighter.crouching = True
+
+        if fighter.airborne or fighter.vy < 0:
+            fighter.x += fighter.vx
+            fighter.y += fighter.vy
+            fighter.vy += GRAVITY
+            if fighter.y >= GROUND_Y:
+                fighter.y, fighter.vx, fighter.vy = GROUND_Y, 0, 0
+                if fighter.move in AIR_MOVES:
+                    fighter.move = None
+
+        if fighter.projectile is not None:
+            fighter.projectile += FIREBALL_SPEED * fighter.facing
+            if not STAGE_LEFT - FIREBALL_WIDTH <= fighter.projectile <= STAGE_RIGHT + FIREBALL_WIDTH:
+                fighter.projectile = None
+
+    @staticmethod
+    def _connects(attacker, defender):
+        move = attacker.move
+        if move is None or move is FIREBALL or attacker.connected:
+            return False
+        if not move.startup < attacker.move_frame <= move.startup + move.active:
+            return False
+        if move.height == 'low' and defender.airborne:
+            return False
+        distance = (defender.x - attacker.x) * attacker.facing
+        return 0 <= distance <= move.reach
+
+    def _projectile_hits(self):
+        hits = []
+        for attacker, defender in (self.fighters, self.fighters[::-1]):
+            if attacker.projectile is None:
+                continue
+            if (abs(attacker.projectile - defender.x) <= FIREBALL_WIDTH and
+                    GROUND_Y - defender.y <= FIREBALL_HEIGHT):
+                hits.append((attacker, defender, FIREBALL))
+        return hits
+
+    @staticmethod
+    def _blocks(defender, move):
+        if defender.airborne or defender.move is not None or (defender.stun and defender.stun_id == HITSTUN_ID):
+            return False
+        away = 'Left' if defender.facing > 0 else 'Right'
+        if not defender.buttons[away]:
+            return False
+        crouching = defender.buttons['Down']
+        return move.height == 'mid' or (move.height == 'low') == crouching
+
+    def _resolve(self, attacker, defender, move):
+        if move is FIREBALL:
+            attacker.projectile = None
+        else:
+            attacker.connected = True
+        push = attacker.facing
+        if self._blocks(defender, move):
+            if move in (FIREBALL, HURRICANE):
+                defender.health -= move.damage // CHIP_DIVISOR
+            defender.stun, defender.stun_id = BLOCKSTUN_FRAMES, BLOCKSTUN_ID
+            defender.x += push * BLOCK_PUSHBACK
+        else:
+            defender.health -= move.damage
+            defender.move = None
+            defender.stun, defender.stun_id = HITSTUN_FRAMES, HITSTUN_ID
+            defender.x += push * HIT_PUSHBACK
+        defender.health = max(0, defender.health)
+
+    def _separate(self):
+        p1, p2 = self.fighters
+        for fighter in self.fighters:
+            fighter.x = min(max(fighter.x, STAGE_LEFT), STAGE_RIGHT)
+        if p1.airborne or p2.airborne:
+            return
+        overlap = BODY_WIDTH - abs(p2.x - p1.x)
+        if overlap > 0:
+            # Push both apart, away from each other, keeping them on the stage
+            left, right = (p1, p2) if p1.x < p2.x or (p1.x == p2.x and p1.facing > 0) else (p2, p1)
+            left.x -= overlap // 2
+            right.x += overlap - overlap // 2
+            if left.x < STAGE_LEFT:
+                left.x, right.x = STAGE_LEFT, STAGE_LEFT + BODY_WIDTH
+            elif right.x > STAGE_RIGHT:
+                left.x, right.x = STAGE_RIGHT - BODY_WIDTH, STAGE_RIGHT
+
+    def _face(self):
+        p1, p2 = self.fighters
+        # Fighters only turn around on the ground and outside a move, as in the game
+        for fighter, other in ((p1, p2), (p2, p1)):
+            if fighter.airborne or fighter.in_move or fighter.x == other.x:
+                continue
+            fighter.facing = 1 if other.x > fighter.x else -1
+
+    def _check_round_end(self):
+        p1, p2 = self.fighters
+        if p1.health > 0 and p2.health > 0 and self.timer > 0:
+            return
+        self.round_over = True
+        if p1.health > p2.health:
+            self.winner = 1
+        elif p2.health > p1.health:
+            self.winner = 2
+        else:
+            self.winner = 0
+
+
+def fight(bot1, bot2, simulator, max_frames=None, on_frame=None, quiet=True):
+    """
+    Play one round between two bots, each deciding from a GameState as in the controllers.
+
+    Args:
+        bot1: Object with a fight(game_state, player_id) method playing as Player 1
+        bot2: Same for Player 2 (a different object from bot1)
+        simulator: FightSimulator; the round starts from simulator.reset()
+        max_frames: Stop after this many frames even if the round is not over
+        on_frame: Optional callback(game_state, command1, command2) called every frame, e.g. to record it
+        quiet: Silence the bots' printing (the rule Bot prints every input it makes)
+
+    Returns:
+        Dict with the winner (1, 2, 0 for a draw, -1 if stopped early), final health of both
+        players, frames played, wall time and every frame's decision time of each bot in nanoseconds
+    """
+    input_dict = simulator.reset()
+    decisions = ([], [])
+    frames = 0
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        while not input_dict['round_over'] and (max_frames is None or frames < max_frames):
+            game_state = GameState(input_dict)
+            started = time.perf_counter_ns()
+            command1 = bot1.fight(game_state, "1")
+            decided = time.perf_counter_ns()
+            command2 = bot2.fight(game_state, "2")
+            decisions[0].append(decided - started)
+            decisions[1].append(time.perf_counter_ns() - decided)
+            if on_frame is not None:
+                on_frame(game_state, command1, command2)
+            input_dict = simulator.step(command1.player_buttons.object_to_dict(),
+                                        command2.player2_buttons.object_to_dict())
+            frames += 1
+    p1, p2 = input_dict['p1'], input_dict['p2']
+    return {
+        'winner': input_dict['result'],
+        'health': (p1['health'], p2['health']),
+        'frames': frames,
+        'seconds': time.perf_counter() - start,
+        'decision_ns': decisions,
+    }
+
+
+def make_bot(kind, model_path='StreetFighterBotMLP.keras', scaler_path='scaler.joblib', thresholds_path=None,
+             policy_path=None, table_path=None):
+    """The rule-based Bot ('rule') or a NeuralBot ('nn') with the given files."""
+    if kind == 'rule':
+        from bot import Bot
+        return Bot()
+    from nn_bot import NeuralBot
+    return NeuralBot(model_path, scaler_path, thresholds_path, policy_path, table_path)
+
+
+def _mean_us(values_ns):
+    return np.mean(values_ns) / 1000 if len(values_ns) else float('nan')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fight two bots in the headless simulator')
+    parser.add_argument('--p1', choices=['rule', 'nn'], default='rule', help='Player 1 bot (default: rule)')
+    parser.add_argument('--p2', choices=['rule', 'nn'], default='rule', help='Player 2 bot (default: rule)')
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds to play (default: 5)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the start positions and of the bots\' NumPy randomness (default: 0)')
+    parser.add_argument('--max-frames', type=int, default=None, help='Cut every round after this many frames')
+    parser.add_argument('--model', default='StreetFighterBotMLP.keras', help='Model path for nn bots')
+    parser.add_argument('--scaler', default='scaler.joblib', help='Scaler path for nn bots')
+    parser.add_argument('--thresholds', default=None, help='Thresholds file for nn bots')
+    parser.add_argument('--policy', default=None, help='Distilled evaluator (distill.py) for nn bots')
+    parser.add_argument('--table', default=None, help='Action table (action_table.py) for nn bots')
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    bots = [make_bot(kind, args.model, args.scaler, args.thresholds, args.policy, args.table)
+            for kind in (args.p1, args.p2)]
+    sim = FightSimulator(seed=args.seed)
+    wins = [0, 0, 0]
+    total_frames = 0
+    total_seconds = 0.0
+    for round_number in range(1, args.rounds + 1):
+        result = fight(bots[0], bots[1], sim, args.max_frames)
+        if result['winner'] >= 0:
+            wins[result['winner']] += 1
+        total_frames += result['frames']
+        total_seconds += result['seconds']
+        print(f"Round {round_number}: winner {result['winner']}, health {result['health'][0]}-{result['health'][1]}, "
+              f"{result['frames']} frames, {result['frames'] / result['seconds']:.0f} frames/s; decision "
+              f"{_mean_us(result['decision_ns'][0]):.1f} us (P1 {args.p1}) / "
+              f"{_mean_us(result['decision_ns'][1]):.1f} us (P2 {args.p2})")
+    print(f"\nP1 ({args.p1}) {wins[1]} - {wins[2]} P2 ({args.p2}), {wins[0]} draws; "
+          f"{total_frames} frames in {total_seconds:.2f} s ({total_frames / total_seconds:.0f} frames/s)")
@@ -0,0 +1,283 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from evaluate import metrics_at, split_rows, tune_thresholds
+from frame_rle import frame_weights
+from log_schema import FEATURES, TARGETS, read_log
+from mlp import BATCH_SIZE, DROPOUT, HIDDEN_LAYERS, L2, LEARNING_RATE
+from model_card import build_card, load_cards, print_cards, save_card
+from sampling import OVERSAMPLE_FACTORS, WEIGHT_MULTIPLIERS
+
+DEFAULT_RESULTS = 'sweep_results.csv'
+
+# Values tried for each hyperparameter when no --space file is given. Dict-valued entries
+# (oversample_factors, weight_multipliers) override the defaults of the buttons they name.
+# Thresholds are not part of the space: every trial tunes its own on the validation split.
+DEFAULT_SPACE = {
+    'hidden_layers': [list(HIDDEN_LAYERS), [128, 64, 32], [32, 16]],
+    'dropout': [DROPOUT, 0.3],
+    'l2': [L2, 0.001],
+    'learning_rate': [LEARNING_RATE, 0.003],
+    'batch_size': [BATCH_SIZE],
+    'oversample_factors': [{}],
+    'weight_multipliers': [{}],
+    'epochs': [100],
+    'patience': [5],
+}
+
+ARRAY_NAMES = ('X_train', 'y_train', 'w_train', 'X_val', 'y_val', 'w_val', 'X_test', 'y_test', 'w_test')
+METRICS = ('precision', 'recall', 'f1')
+RESULT_COLUMNS = (['trial', 'thresholds', 'wall_time', 'epochs_run', 'val_loss', 'accuracy', 'macro_f1'] +
+                  [f'{metric}_{target}' for target in TARGETS for metric in METRICS] + ['params'])
+
+# Arrays of the worker process, memory mapped once by _init_worker
+_arrays = {}
+
+
+def trial_grid(space):
+    """Every combination of the search space."""
+    keys = sorted(space)
+    values = [space[key] if isinstance(space[key], list) else [space[key]] for key in keys]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def data_identity(data_path):
+    """Path, size and modification time of the training data, so results of other data are not resumed."""
+    stat = os.stat(data_path)
+    return {'path': os.path.abspath(data_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def trial_id(params, data):
+    """Id of a configuration trained on the data of data_identity."""
+    key = json.dumps({'params': params, 'data': data}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def prepare_arrays(data_path, data_dir):
+    """
+    Load, scale and split the training data once, as train_model.py does, and save each array
+    as a .npy file the workers memory map.
+
+    Returns:
+        The fitted StandardScaler
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    df = read_log(data_path, required=FEATURES + TARGETS)
+    scaler = StandardScaler()
+    X = scaler.fit_transform(df[FEATURES].values)
+    y = df[TARGETS].values
+    w = frame_weights(df)
+    arrays = {}
+    for split, rows in zip(('train', 'val', 'test'), split_rows(len(X))):
+        arrays.update({f'X_{split}': X[rows], f'y_{split}': y[rows], f'w_{split}': w[rows]})
+    for name, array in arrays.items():
+        np.save(os.path.join(data_dir, name + '.npy'), array)
+    joblib.dump(scaler, os.path.join(data_dir, 'scaler.joblib'))
+    print(f"Prepared {len(X)} rows ({sum(a.nbytes for a in arrays.values()) / 2**20:.1f} MiB) in {data_dir}")
+    return scaler
+
+
+def _init_worker(data_dir):
+    import tensorflow as tf
+    # Trials run side by side, one per core, so each TF runtime gets a single thread
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    for name in ARRAY_NAMES:
+        _arrays[name] = np.load(os.path.join(data_dir, name + '.npy'), mmap_mode='r')
+
+
+def run_trial(trial, params, models_dir):
+    """
+    Train one configuration on the shared arrays, tune its per-button thresholds on the
+    validation split, score it on the test split at those thresholds and save it to models_dir
+    for benchmarking.
+
+    Returns:
+        Result row
+    """
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping
+
+    from mlp import build_mlp
+    from sampling import OversampledBatches, training_weights
+
+    start = time.perf_counter()
+    tf.keras.utils.set_random_seed(42)
+    X_train, y_train, w_train = _arrays['X_train'], _arrays['y_train'], _arrays['w_train']
+    factors = {**OVERSAMPLE_FACTORS, **params['oversample_factors']}
+    multipliers = {**WEIGHT_MULTIPLIERS, **params['weight_multipliers']}
+
+    train_index, sample_weights = training_weights(y_train, w_train, factors, multipliers)
+    batches = OversampledBatches(X_train, y_train, train_index, sample_weights,
+                                 batch_size=params['batch_size'], seed=42)
+
+    model = build_mlp(len(FEATURES), len(TARGETS), params['hidden_layers'], params['dropout'], params['l2'],
+                      params['learning_rate'])
+    history = model.fit(batches,
+                        validation_data=(np.asarray(_arrays['X_val']), np.asarray(_arrays['y_val']),
+                                         np.asarray(_arrays['w_val'])),
+                        epochs=params['epochs'],
+                        callbacks=[EarlyStopping(monitor='val_loss', patience=params['patience'],
+                                                 restore_best_weights=True)],
+                        verbose=0)
+    val_probs = model.predict(np.asarray(_arrays['X_val']), verbose=0)
+    thresholds, _ = tune_thresholds(np.asarray(_arrays['y_val']), val_probs, np.asarray(_arrays['w_val']))
+    # The test split is only scored at the thresholds chosen on validation, never used to choose them
+    test_probs = model.predict(np.asarray(_arrays['X_test']), verbose=0)
+    metrics = metrics_at(np.asarray(_arrays['y_test']), test_probs, thresholds, np.asarray(_arrays['w_test']))
+    wall_time = time.perf_counter() - start
+    model.save(os.path.join(models_dir, trial + '.keras'))
+
+    row = {
+        'trial': trial,
+        'thresholds': json.dumps(thresholds),
+        'wall_time': round(wall_time, 2),
+        'epochs_run': len(history.history['loss']),
+        'val_loss': round(min(history.history['val_loss']), 5),
+        'accuracy': round(float(np.mean(metrics['accuracy'])), 5),
+    }
+    for i, target in enumerate(TARGETS):
+        row.update({f'precision_{target}': round(float(metrics['precision'][i]), 4),
+                    f'recall_{target}': round(float(metrics['recall'][i]), 4),
+                    f'f1_{target}': round(float(metrics['f1'][i]), 4)})
+    row['macro_f1'] = round(float(np.mean(metrics['f1'])), 5)
+    row['params'] = json.dumps(params, sort_keys=True)
+    return row
+
+
+def completed_trials(results_path):
+    """Trial ids already in the results table."""
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path, newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != RESULT_COLUMNS:
+            raise ValueError(f"{results_path} has other columns than this sweep writes; use another --results file")
+        return {row['trial'] for row in reader}
+
+
+def sweep(data_path, space, results_path=DEFAULT_RESULTS, workers=None, trials=None, seed=0):
+    """
+    Run every (or a random subset of) configuration in the search space in parallel.
+
+    Rows are appended to the results table as trials finish, so an interrupted sweep picks up
+    where it stopped: trials already in the table for the same data file (path, size and
+    modification time) are skipped.
+
+    Args:
+        data_path: Processed training CSV
+        space: Dict mapping hyperparameter to the list of values to try
+        results_path: Results CSV, appended to
+        workers: Concurrent trials (default: number of CPU cores)
+        trials: Number of configurations sampled from the grid (default: all)
+        seed: Seed of the sampling
+    """
+    if 'threshold' in space:
+        raise ValueError("Thresholds are tuned per trial on the validation split; drop 'threshold' from the space")
+    space = {**DEFAULT_SPACE, **space}
+    grid = trial_grid(space)
+    if trials is not None and trials < len(grid):
+        grid = random.Random(seed).sample(grid, trials)
+    data = data_identity(data_path)
+    done = completed_trials(results_path)
+    pending = [(trial_id(params, data), params) for params in grid]
+    pending = [(trial, params) for trial, params in pending if trial not in done]
+    print(f"{len(grid)} trial(s), {len(grid) - len(pending)} already in {results_path}, {len(pending)} to run")
+    if not pending:
+        return
+
+    data_dir = os.path.splitext(results_path)[0] + '_data'
+    models_dir = os.path.splitext(results_path)[0] + '_models'
+    os.makedirs(models_dir, exist_ok=True)
+    scaler = prepare_arrays(data_path, data_dir)
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    # Also read by TF and the BLAS libraries at start-up in the workers
+    for variable in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OMP_NUM_THREADS'):
+        os.environ[variable] = '1'
+
+    start = time.perf_counter()
+    trial_rows = {}
+    write_header = not os.path.exists(results_path)
+    with open(results_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        if write_header:
+            writer.writeheader()
+        # Spawned workers do not inherit a TF runtime from this process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(data_dir,)) as pool:
+            futures = {pool.submit(run_trial, trial, params, models_dir): params for trial, params in pending}
+            for finished, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                trial_rows[row['trial']] = row
+                writer.writerow(row)
+                f.flush()
+                print(f"[{finished}/{len(pending)}] trial {row['trial']}: test macro F1 {row['macro_f1']:.4f} "
+                      f"at validation-tuned thresholds, {row['wall_time']:.1f}s {futures[future]}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(pending)} trial(s) in {elapsed:.1f}s with {workers} worker(s)")
+    print_best(results_path)
+
+    cards_dir = os.path.splitext(results_path)[0] + '_cards'
+    write_trial_cards(trial_rows, models_dir, cards_dir, data_dir, scaler)
+    print()
+    print_cards(load_cards([os.path.join(cards_dir, '*.json')]))
+
+
+def write_trial_cards(trial_rows, models_dir, cards_dir, data_dir, scaler):
+    """
+    Benchmark the saved model of every finished trial, one at a time so the timings do not
+    compete for the cores, and write its model card (test metrics at its tuned thresholds plus latency).
+    """
+    import tensorflow as tf
+
+    os.makedirs(cards_dir, exist_ok=True)
+    frames = scaler.inverse_transform(np.load(os.path.join(data_dir, 'X_test.npy'), mmap_mode='r')[:1000])
+    for trial, row in trial_rows.items():
+        model_path = os.path.join(models_dir, trial + '.keras')
+        metrics = {'trial': trial, 'macro_f1': row['macro_f1'], 'accuracy': row['accuracy'],
+                   'thresholds': json.loads(row['thresholds']), 'hyperparameters': json.loads(row['params'])}
+        card = build_card(tf.keras.models.load_model(model_path), scaler, frames, metrics, model_path=model_path)
+        save_card(card, os.path.join(cards_dir, trial + '.json'))
+        print(f"Trial {trial}: single frame p50 {card['frame_p50_ms']} ms, p99 {card['frame_p99_ms']} ms, "
+              f"{card['params']} parameters")
+
+
+def print_best(results_path, top=5):
+    with open(results_path, newline='') as f:
+        rows = sorted(csv.DictReader(f), key=lambda row: float(row['macro_f1']), reverse=True)
+    print(f"Top {min(top, len(rows))} of {len(rows)} trial(s) by test macro F1 at validation-tuned thresholds:")
+    for row in rows[:top]:
+        print(f"  {row['trial']}: macro F1 {row['macro_f1']}, accuracy {row['accuracy']}, {row['wall_time']}s, "
+              f"{row['params']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter sweep of the MLP')
+    parser.add_argument('--data', type=str, default='GameDataProcessed.csv', help='Processed training CSV')
+    parser.add_argument('--space', type=str, default=None,
+                        help='JSON file mapping hyperparameters to lists of values (default: built-in space)')
+    parser.add_argument('--results', type=str, default=DEFAULT_RESULTS,
+                        help=f'Results table, resumed if it exists (default: {DEFAULT_RESULTS})')
+    parser.add_argument('--workers', type=int, default=None, help='Concurrent trials (default: all cores)')
+    parser.add_argument('--trials', type=int, default=None, help='Random sample of this many configurations')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for --trials sampling')
+    args = parser.parse_args()
+
+    search_space = {}
+    if args.space is not None:
+        with open(args.space) as space_file:
+            search_space = json.load(space_file)
+    sweep(args.data, search_space, args.results, args.workers, args.trials, args.seed)
@@ -0,0 +1,242 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model_card import FRAME_BUDGET_MS
+from simulator import FightSimulator, fight, make_bot
+
+DEFAULT_ROUNDS = 10
+INITIAL_ELO = 1500
+ELO_K = 32
+# Per-round results table columns
+ROUND_COLUMNS = ['round', 'seed', 'p1', 'p2', 'winner', 'p1_health', 'p2_health', 'frames', 'seconds',
+                 'p1_decision_us', 'p2_decision_us']
+# make_bot options an entrant spec may set
+SPEC_KEYS = ('model', 'scaler', 'thresholds', 'policy', 'table')
+
+# Entrants of the worker process: their specs, and the NeuralBots already loaded
+_specs = {}
+_loaded = {}
+
+
+def parse_entrant(text):
+    """
+    Entrant from 'name=kind[,key=value...]', e.g. 'tree=nn,policy=policy_tree.py'.
+
+    kind is 'rule' or 'nn'; keys are make_bot's files (model, scaler, thresholds, policy, table).
+
+    Returns:
+        (name, spec dict)
+    """
+    name, _, spec_text = text.partition('=')
+    kind, *options = spec_text.split(',')
+    if not name or kind not in ('rule', 'nn'):
+        raise ValueError(f"Entrant '{text}' is not name=rule or name=nn[,key=value...]")
+    spec = {'kind': kind}
+    for option in options:
+        key, _, value = option.partition('=')
+        if key not in SPEC_KEYS or not value:
+            raise ValueError(f"Entrant '{text}': unknown option '{option}' (expected one of {', '.join(SPEC_KEYS)})")
+        spec[key] = value
+    return name, spec
+
+
+def _init_worker(specs):
+    _specs.update(specs)
+
+
+def _bot(name):
+    spec = _specs[name]
+    if spec['kind'] == 'rule':
+        # The rule bot keeps its input sequence between frames, so every round gets a fresh one
+        return make_bot('rule')
+    if name not in _loaded:
+        _loaded[name] = make_bot('nn', spec.get('model', 'StreetFighterBotMLP.keras'),
+                                 spec.get('scaler', 'scaler.joblib'), spec.get('thresholds'), spec.get('policy'),
+                                 spec.get('table'))
+    return _loaded[name]
+
+
+def play_round(round_number, p1, p2, seed, max_frames=None):
+    """
+    Play one simulated round between two entrants (run in a worker).
+
+    Returns:
+        Dict of the result and every decision time in nanoseconds
+    """
+    bot1, bot2 = _bot(p1), _bot(p2)
+    np.random.seed(seed)
+    result = fight(bot1, bot2, FightSimulator(seed=seed), max_frames)
+    return {
+        'round': round_number, 'seed': seed, 'p1': p1, 'p2': p2, 'winner': result['winner'],
+        'p1_health': result['health'][0], 'p2_health': result['health'][1], 'frames': result['frames'],
+        'seconds': result['seconds'],
+        'decision_ns': (np.asarray(result['decision_ns'][0], dtype=np.int64),
+                        np.asarray(result['decision_ns'][1], dtype=np.int64)),
+    }
+
+
+def schedule(names, rounds, seed=0):
+    """
+    Round-robin rounds: every pair of entrants plays `rounds` times, swapping sides every round.
+
+    Returns:
+        List of (round number, p1, p2, seed)
+    """
+    games = []
+    for a, b in itertools.combinations(names, 2):
+        for i in range(rounds):
+            p1, p2 = (a, b) if i % 2 == 0 else (b, a)
+            games.append((len(games), p1, p2, seed + len(games)))
+    return games
+
+
+def elo_ratings(results, names, k=ELO_K, initial=INITIAL_ELO):
+    """Elo ratings after the rounds in round order (a draw or a cut round scores half)."""
+    ratings = {name: float(initial) for name in names}
+    for result in sorted(results, key=lambda r: r['round']):
+        p1, p2 = result['p1'], result['p2']
+        expected = 1 / (1 + 10 ** ((ratings[p2] - ratings[p1]) / 400))
+        score = {1: 1.0, 2: 0.0}.get(result['winner'], 0.5)
+        ratings[p1] += k * (score - expected)
+        ratings[p2] -= k * (score - expected)
+    return ratings
+
+
+def pairing_table(results, names):
+    """Per pair (a, b) of entrants: rounds, a's wins, b's wins, draws and a's mean health lead."""
+    table = {}
+    for result in results:
+        a, b = sorted((result['p1'], result['p2']), key=names.index)
+        row = table.setdefault((a, b), {'rounds': 0, 'wins': 0, 'losses': 0, 'draws': 0, 'health_diff': []})
+        a_side = 1 if result['p1'] == a else 2
+        health = {1: result['p1_health'], 2: result['p2_health']}
+        row['rounds'] += 1
+        if result['winner'] == a_side:
+            row['wins'] += 1
+        elif result['winner'] in (1, 2):
+            row['losses'] += 1
+        else:
+            row['draws'] += 1
+        row['health_diff'].append(health[a_side] - health[3 - a_side])
+    return table
+
+
+def entrant_table(results, names):
+    """Per entrant: record, mean health lead and all its decision times in microseconds."""
+    table = {name: {'wins': 0, 'losses': 0, 'draws': 0, 'health_diff': [], 'decision_us': []} for name in names}
+    for result in results:
+        for side, name in ((1, result['p1']), (2, result['p2'])):
+            row = table[name]
+            if result['winner'] == side:
+                row['wins'] += 1
+            elif result['winner'] in (1, 2):
+                row['losses'] += 1
+            else:
+                row['draws'] += 1
+            health = {1: result['p1_health'], 2: result['p2_health']}
+            row['health_diff'].append(health[side] - health[3 - side])
+            row['decision_us'].append(result['decision_ns'][side - 1] / 1000)
+    for row in table.values():
+        row['decision_us'] = np.concatenate(row['decision_us']) if row['decision_us'] else np.zeros(0)
+    return table
+
+
+def print_report(results, names):
+    pairs = pairing_table(results, names)
+    print(f"\n{'pairing':<40} {'rounds':>6} {'W-L-D':>9} {'win rate':>8} {'health diff':>11}")
+    for (a, b), row in pairs.items():
+        win_rate = (row['wins'] + row['draws'] / 2) / row['rounds']
+        print(f"{f'{a} vs {b}'[:40]:<40} {row['rounds']:>6} "
+              f"{row['wins']:>3}-{row['losses']}-{row['draws']:<3} {win_rate:>8.1%} "
+              f"{np.mean(row['health_diff']):>+11.1f}")
+
+    ratings = elo_ratings(results, names)
+    entrants = entrant_table(results, names)
+    print(f"\n{'entrant':<20} {'Elo':>6} {'W-L-D':>11} {'win rate':>8} {'health diff':>11} "
+          f"{'decision mean':>13} {'p50':>9} {'p99':>9} {'over budget':>11}")
+    for name in sorted(names, key=ratings.get, reverse=True):
+        row = entrants[name]
+        played = row['wins'] + row['losses'] + row['draws']
+        us = row['decision_us']
+        over = np.mean(us > FRAME_BUDGET_MS * 1000) if len(us) else 0.0
+        print(f"{name[:20]:<20} {ratings[name]:>6.0f} {row['wins']:>4}-{row['losses']}-{row['draws']:<4} "
+              f"{(row['wins'] + row['draws'] / 2) / max(played, 1):>8.1%} {np.mean(row['health_diff']):>+11.1f} "
+              f"{np.mean(us):>10.1f} us {np.percentile(us, 50):>6.1f} us {np.percentile(us, 99):>6.1f} us "
+              f"{over:>11.1%}")
+    print(f"Decision times are per frame, against the {FRAME_BUDGET_MS:.1f} ms frame budget")
+
+
+def tournament(entrants, rounds=DEFAULT_ROUNDS, workers=None, seed=0, max_frames=None, results_path=None):
+    """
+    Round-robin tournament of simulated rounds, run across a process pool.
+
+    Args:
+        entrants: Dict mapping entrant name to its spec (see parse_entrant)
+        rounds: Rounds per pair of entrants
+        workers: Worker processes (default: number of CPU cores)
+        seed: Seed of the first round; round i uses seed + i for the simulator and the bots
+        max_frames: Cut every round after this many frames (a cut round counts as a draw)
+        results_path: Optional CSV to write every round's result to
+
+    Returns:
+        List of round results
+    """
+    names = list(entrants)
+    games = schedule(names, rounds, seed)
+    workers = min(workers or os.cpu_count() or 1, len(games))
+    for variable in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OMP_NUM_THREADS'):
+        os.environ[variable] = '1'
+    print(f"{len(names)} entrants, {len(games)} rounds on {workers} worker(s)")
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(entrants,)) as pool:
+        futures = [pool.submit(play_round, *game, max_frames) for game in games]
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            print(f"Round {result['round']}: {result['p1']} vs {result['p2']}, winner {result['winner']}, "
+                  f"health {result['p1_health']}-{result['p2_health']}, {result['frames']} frames")
+    elapsed = time.perf_counter() - start
+    frames = sum(result['frames'] for result in results)
+    print(f"\n{len(results)} rounds, {frames} frames in {elapsed:.1f}s ({frames / elapsed:.0f} frames/s)")
+
+    if results_path is not None:
+        with open(results_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=ROUND_COLUMNS)
+            writer.writeheader()
+            for result in results:
+                writer.writerow({**{key: result[key] for key in ROUND_COLUMNS if key in result},
+                                 'p1_decision_us': round(float(np.mean(result['decision_ns'][0])) / 1000, 2),
+                                 'p2_decision_us': round(float(np.mean(result['decision_ns'][1])) / 1000, 2)})
+        print(f"Round results saved to {results_path}")
+    print_report(results, names)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Round-robin tournament of bots in the headless simulator')
+    parser.add_argument('entrants', nargs='+',
+                        help="Entrants as name=kind[,key=value...]: kind 'rule' or 'nn', keys model, scaler, "
+                             "thresholds, policy, table (e.g. rule=rule tree=nn,policy=policy_tree.py)")
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+                        help=f'Rounds per pairing, sides swapped every round (default: {DEFAULT_ROUNDS})')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first round (default: 0)')
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help='Cut every round after this many frames; cut rounds count as draws')
+    parser.add_argument('--results', type=str, default=None, help='CSV to write every round\'s result to')
+    args = parser.parse_args()
+
+    parsed = dict(parse_entrant(text) for text in args.entrants)
+    if len(parsed) < 2:
+        raise SystemExit("A tournament needs at least two entrants with different names")
+    tournament(parsed, args.rounds, args.workers, args.seed, args.max_frames, args.results)
@@ -1,164 +1,217 @@
 # Import necessary libraries
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import classification_report
-from sklearn.utils.class_weight import compute_class_weight
-import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout
 from tensorflow.keras.callbacks import EarlyStopping
-from tensorflow.keras import regularizers
 import joblib
-
-# Step 1: Load and prepare the data
-training_file_path = 'X:/6th Semester/Artificial Intelligence/AI Project/gamebot-competition-master/PythonAPI/GameDataUpdated.csv'
-training_df = pd.read_csv(training_file_path)
-
-# Define features and targets
-features = [
-    'player_x', 'player_y', 'opponent_x', 'opponent_y', 'distance', 'timer',
-    'has_round_started', 'is_round_over', 'player_jumping', 'player_crouching',
-    'player_in_move', 'player_move_id', 'opponent_jumping', 'opponent_crouching',
-    'opponent_in_move', 'opponent_move_id'
-]
-targets = [
-    'action_left', 'action_right', 'action_up', 'action_down',
-    'action_A', 'action_B', 'action_X', 'action_Y'
-]
-
-# Extract features and targets
-X = training_df[features].values
-y = training_df[targets].values
-
-# Step 2: Check class distribution
-print("Class Distribution (Proportion of 'Pressed' for each action):")
-print(training_df[targets].sum() / len(training_df))
-
-# Step 3: Normalize the features and save the scaler
-scaler = StandardScaler()
-X = scaler.fit_transform(X)
-joblib.dump(scaler, 'scaler.joblib')
-print("Scaler saved as scaler.joblib")
-
-# Step 4: Split the data
-X_train, X_temp, y_train, y_temp = train_test_split(X, y, test_size=0.3, random_state=42)
-X_val, X_test, y_val, y_test = train_test_split(X_temp, y_temp, test_size=0.5, random_state=42)
-
-# Step 5: Manually oversample minority classes with adjusted factors
-# Identify rows where rare buttons are pressed
-minority_mask = (
-    (y_train[:, targets.index('action_up')] == 1) |
-    (y_train[:, targets.index('action_down')] == 1) |
-    (y_train[:, targets.index('action_A')] == 1) |
-    (y_train[:, targets.index('action_B')] == 1) |
-    (y_train[:, targets.index('action_X')] == 1) |
-    (y_train[:, targets.index('action_Y')] == 1)
-)
-minority_indices = np.where(minority_mask)[0]
-minority_X = X_train[minority_indices]
-minority_y = y_train[minority_indices]
-
-# Oversample with adjusted factors
-oversample_factors = {
-    'action_up': 4,      # Reduce to decrease dominance
-    'action_down': 6,    # Increase to balance with up
-    'action_left': 6,    # Increase to balance with up
-    'action_right': 6,   # Increase to balance with up
-    'action_A': 12,      # Slightly increase to boost
-    'action_B': 12,      # Slightly increase to boost
-    'action_X': 8,       # Slightly increase to boost
-    'action_Y': 8        # Slightly increase to boost
-}
-X_train_oversampled = X_train.copy()
-y_train_oversampled = y_train.copy()
-for target, factor in oversample_factors.items():
-    indices = np.where(y_train[:, targets.index(target)] == 1)[0]
-    X_target = X_train[indices]
-    y_target = y_train[indices]
-    X_train_oversampled = np.vstack([X_train_oversampled] + [X_target] * (factor - 1))
-    y_train_oversampled = np.vstack([y_train_oversampled] + [y_target] * (factor - 1))
-
-# Step 6: Compute class weights with custom multipliers
-class_weights_dict = {}
-weight_multipliers = {
-    'action_left': 0.8,    # Moderate weight
-    'action_right': 0.8,   # Moderate weight
-    'action_up': 0.5,      # Reduce to decrease dominance
-    'action_down': 1.2,    # Increase to balance with up
-    'action_A': 3.5,       # Slightly increase to boost
-    'action_B': 3.5,       # Slightly increase to boost
-    'action_X': 1.8,       # Slightly increase to boost
-    'action_Y': 1.8        # Slightly increase to boost
-}
-
-for i, target in enumerate(targets):
-    classes = np.unique(y_train_oversampled[:, i])
-    if len(classes) > 1:
-        weights = compute_class_weight('balanced', classes=classes, y=y_train_oversampled[:, i])
-        weights = weights / weights[0]  # Normalize "Not Pressed" to 1
-        multiplier = weight_multipliers[target]
-        class_weights_dict[i] = {cls: min(weight * multiplier, 5.0) for cls, weight in zip(classes, weights)}
+import argparse
+import os
+import time
+from array_cache import DEFAULT_ARRAY_CACHE_DIR, ArrayCache, clear_array_cache
+from checkpoints import DEFAULT_CHECKPOINT_DIR, TrainingCheckpoint
+from data_pipeline import DEFAULT_SHUFFLE_BUFFER, fit_streaming, list_shards, load_arrays, make_dataset
+from evaluate import (SPLIT_SEED, SPLIT_SIZES, metrics_at, print_report, save_thresholds, split_rows,
+                      thresholds_file, tune_thresholds)
+from frame_rle import frame_weights
+from log_schema import FEATURES, TARGETS, memory_report, read_log
+from mlp import BATCH_SIZE, EVAL_THRESHOLD, build_mlp
+from model_card import accuracy_metrics, build_card, card_path, print_summary, save_card
+from preprocess_data import PREPROCESS_VERSION, process_dataframe
+from sampling import (MAX_CLASS_WEIGHT, OVERSAMPLE_FACTORS, WEIGHT_MULTIPLIERS, OversampledBatches,
+                      class_weight_table, class_weights, gather_sample_weights, oversample_index)
+from session_catalog import add_selection_arguments, read_segments, select_segments, update_catalog
+
+parser = argparse.ArgumentParser(description='Train the MLP bot model')
+parser.add_argument('--data', type=str,
+                    default='X:/6th Semester/Artificial Intelligence/AI Project/gamebot-competition-master/PythonAPI/GameDataUpdated.csv',
+                    help='Processed training CSV (ignored when --catalog is given)')
+parser.add_argument('--sessions', type=str, default='game_data_*.csv',
+                    help='Glob pattern of recorded logs to index when --catalog is given')
+parser.add_argument('--shards', type=str, default=None,
+                    help='Glob pattern of processed CSV or binary shards to stream instead of loading --data')
+parser.add_argument('--val-shards', type=str, default=None, help='Validation shards (required with --shards)')
+parser.add_argument('--test-shards', type=str, default=None, help='Test shards (required with --shards)')
+parser.add_argument('--shuffle-buffer', type=int, default=DEFAULT_SHUFFLE_BUFFER,
+                    help=f'Rows in the streaming shuffle buffer (default: {DEFAULT_SHUFFLE_BUFFER})')
+parser.add_argument('--checkpoint-dir', type=str, default=DEFAULT_CHECKPOINT_DIR,
+                    help=f'Where model, optimizer, scaler and epoch are saved after every epoch (default: {DEFAULT_CHECKPOINT_DIR})')
+parser.add_argument('--resume', action='store_true', help='Continue from the latest checkpoint in --checkpoint-dir')
+parser.add_argument('--array-cache', type=str, default=DEFAULT_ARRAY_CACHE_DIR,
+                    help=f'Directory of cached prepared arrays (default: {DEFAULT_ARRAY_CACHE_DIR})')
+parser.add_argument('--cache-key', choices=['stat', 'hash'], default='stat',
+                    help='Key the input files by size/mtime (stat) or by content hash (hash)')
+parser.add_argument('--no-cache', action='store_true', help='Prepare the arrays again and leave the cache untouched')
+parser.add_argument('--clear-cache', action='store_true', help='Delete all cached prepared arrays first')
+add_selection_arguments(parser)
+args = parser.parse_args()
+if args.clear_cache:
+    print(f"Removed {clear_array_cache(args.array_cache)} cached entries from {args.array_cache}")
+if args.shards is not None and (args.val_shards is None or args.test_shards is None):
+    parser.error('--shards needs --val-shards and --test-shards')
+
+if args.shards is not None:
+    # Steps 1-7 on data larger than memory: one streaming pass fits the scaler and counts the
+    # classes, then batches are read, scaled and weighted from the shards during training
+    train_paths = list_shards(args.shards)
+    data_info = {'shards': train_paths}
+    scaler, weight_table = fit_streaming(train_paths)
+    joblib.dump(scaler, 'scaler.joblib')
+    print(f"Scaler fitted on {scaler.n_samples_seen_} rows from {len(train_paths)} shard(s), saved as scaler.joblib")
+    targets = TARGETS
+    features = FEATURES
+    train_data = make_dataset(train_paths, scaler, weight_table, batch_size=BATCH_SIZE,
+                              shuffle_buffer=args.shuffle_buffer, seed=42)
+    val_paths = list_shards(args.val_shards)
+    test_paths = list_shards(args.test_shards)
+    # Early stopping picks the epoch on the validation shards, so they cannot also give the test score
+    if set(val_paths) & set(test_paths):
+        parser.error('--test-shards must not share shards with --val-shards')
+    validation_data = make_dataset(val_paths, scaler, shuffle_buffer=0)
+    X_test, y_test, w_test = load_arrays(test_paths, scaler)
+    data_info['rows'] = int(scaler.n_samples_seen_)
+else:
+    cache = None if args.no_cache else ArrayCache(args.array_cache, use_hash=args.cache_key == 'hash')
+    features = FEATURES
+    targets = TARGETS
+    # Everything the prepared arrays depend on besides the input files
+    cache_params = {
+        'features': features,
+        'targets': targets,
+        'oversample_factors': OVERSAMPLE_FACTORS,
+        'weight_multipliers': WEIGHT_MULTIPLIERS,
+        'max_class_weight': MAX_CLASS_WEIGHT,
+        'test_sizes': list(SPLIT_SIZES),
+        'random_state': SPLIT_SEED,
+    }
+
+    # Step 1: Load and prepare the data
+    if args.catalog is not None:
+        # Read only the byte ranges of the selected sessions and preprocess them here
+        catalog = update_catalog([args.sessions], args.catalog)
+        selection = select_segments(catalog, outcome=args.outcome, opponent_id=args.opponent)
+        print(f"Training on {sum(len(s) for s in selection.values())} selected session(s)")
+        data_info = {'catalog': args.catalog, 'outcome': args.outcome, 'opponent': args.opponent}
+        sources = sorted(selection)
+        cache_params['segments'] = {path: [[s['start'], s['end']] for s in selection[path]] for path in sources}
+        cache_params['preprocess_version'] = PREPROCESS_VERSION
     else:
-        class_weights_dict[i] = {classes[0]: 1.0}
-
-# Step 7: Create sample weights
-sample_weights = np.ones(len(y_train_oversampled))
-for j in range(len(y_train_oversampled)):
-    max_weight = 1.0
-    for i in range(y_train_oversampled.shape[1]):
-        if len(class_weights_dict[i]) > 1:
-            max_weight = max(max_weight, class_weights_dict[i].get(int(y_train_oversampled[j, i]), 1.0))
-    sample_weights[j] = max_weight
-
-# Step 8: Build the MLP model
-model = Sequential([
-    Dense(64, activation='relu', input_shape=(len(features),), kernel_initializer='he_normal',
-          kernel_regularizer=regularizers.l2(0.01)),
-    Dropout(0.5),
-    Dense(32, activation='relu', kernel_initializer='he_normal',
-          kernel_regularizer=regularizers.l2(0.01)),
-    Dropout(0.5),
-    Dense(16, activation='relu', kernel_initializer='he_normal',
-          kernel_regularizer=regularizers.l2(0.01)),
-    Dense(len(targets), activation='sigmoid', kernel_initializer='glorot_normal')
-])
-
+        training_file_path = args.data
+        data_info = {'data': training_file_path}
+        sources = [training_file_path]
+
+    # Steps 1-7 are skipped when the same inputs were prepared before: the cached arrays are memory mapped
+    prepare_start = time.perf_counter()
+    key = cache.key(sources, cache_params) if cache else None
+    cached = cache.lookup(key) if cache else None
+    if cached is not None:
+        prepared, scaler, meta = cached
+        print(f"Prepared arrays of {meta['rows']} rows memory mapped from {os.path.join(args.array_cache, key)}")
+        print("Class Distribution (Proportion of 'Pressed' for each action):")
+        w = prepared['w']
+        print(pd.Series((prepared['y'] * w[:, None]).sum(axis=0) / w.sum(), index=targets))
+    else:
+        if args.catalog is not None:
+            training_df = process_dataframe(read_segments(selection))
+        else:
+            training_df = read_log(training_file_path, required=FEATURES + TARGETS)
+        memory_report(training_df, 'Training data')
+
+        # Extract features and targets
+        X = training_df[features].values
+        y = training_df[targets].values
+        # Rows from change-only logs stand for 'repeat' identical frames; dense logs weigh 1 per row
+        w = frame_weights(training_df)
+
+        # Step 2: Check class distribution
+        print("Class Distribution (Proportion of 'Pressed' for each action):")
+        print((training_df[targets].mul(w, axis=0)).sum() / w.sum())
+
+        # Step 3: Normalize the features
+        scaler = StandardScaler()
+        # The model computes in float32 anyway, so the cached copy is stored at that precision
+        X = scaler.fit_transform(X).astype(np.float32)
+
+        # Step 4: Split the data
+        # The cache keeps the row numbers of the splits
+        train_rows, val_rows, test_rows = split_rows(len(X))
+        y_train, w_train = y[train_rows], w[train_rows]
+
+        # Step 5: Manually oversample minority classes with adjusted factors
+        # The oversampled set is a row index into the base arrays (see sampling.py); batches are gathered
+        # from it during training instead of stacking copies of the rows
+        train_index = oversample_index(y_train, targets, OVERSAMPLE_FACTORS)
+        # How many times each base row appears in an epoch
+        row_counts = np.bincount(train_index, minlength=len(y_train))
+
+        # Step 6: Compute class weights with custom multipliers (WEIGHT_MULTIPLIERS in sampling.py)
+        class_weights_dict = class_weights(y_train, row_counts, targets, WEIGHT_MULTIPLIERS)
+
+        # Step 7: Create sample weights
+        # A row's weight is its largest class weight: one gather from the (buttons, 2) table, then a max
+        sample_weights = gather_sample_weights(y_train, class_weight_table(class_weights_dict, len(targets)))
+        sample_weights *= w_train
+
+        prepared = {'X': X, 'y': y, 'w': w, 'train_rows': train_rows, 'val_rows': val_rows, 'test_rows': test_rows,
+                    'train_index': train_index, 'sample_weights': sample_weights}
+        meta = {'rows': len(X), 'sources': sources}
+        if cache:
+            cache.store(key, prepared, scaler, meta)
+
+    data_info['rows'] = meta['rows']
+    joblib.dump(scaler, 'scaler.joblib')
+    print("Scaler saved as scaler.joblib")
+    X, y, w = prepared['X'], prepared['y'], prepared['w']
+    X_train, y_train = X[prepared['train_rows']], y[prepared['train_rows']]
+    X_val, y_val, w_val = X[prepared['val_rows']], y[prepared['val_rows']], w[prepared['val_rows']]
+    X_test, y_test, w_test = X[prepared['test_rows']], y[prepared['test_rows']], w[prepared['test_rows']]
+    train_index = prepared['train_index']
+    print(f"Oversampled training set: {len(train_index)} rows drawn from {len(y_train)}")
+    print(f"Training arrays ready in {time.perf_counter() - prepare_start:.2f}s")
+    train_data = OversampledBatches(X_train, y_train, train_index, np.asarray(prepared['sample_weights']),
+                                    batch_size=BATCH_SIZE, seed=42)
+    validation_data = (X_val, y_val, w_val)
+
+# Step 8: Build the MLP model (layer sizes, dropout, L2 and learning rate in mlp.py)
 # Step 9: Compile the model
-model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=0.001), 
-              loss='binary_crossentropy', 
-              metrics=['accuracy'])
+model = build_mlp(len(features), len(targets))
+checkpoint = TrainingCheckpoint(args.checkpoint_dir, scaler, data_info)
+initial_epoch = checkpoint.restore(model) if args.resume else 0
+if isinstance(train_data, OversampledBatches):
+    # Continue with the batch order of the epoch the checkpoint stopped at
+    train_data.set_epoch(initial_epoch)
 
 # Step 10: Train the model
 early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
 history = model.fit(
-    X_train_oversampled, y_train_oversampled,
-    validation_data=(X_val, y_val),
+    train_data,
+    validation_data=validation_data,
     epochs=100,
-    batch_size=32,
-    sample_weight=sample_weights,
-    callbacks=[early_stopping],
+    initial_epoch=initial_epoch,
+    callbacks=[early_stopping, checkpoint],
     verbose=1
 )
 
-# Step 11: Evaluate the model
+# Step 11: Tune per-button thresholds on the validation split and evaluate the model on the test split
+if args.shards is not None:
+    X_val, y_val, w_val = load_arrays(list_shards(args.val_shards), scaler)
+val_probs = model.predict(X_val, batch_size=1024, verbose=0)
+thresholds, _ = tune_thresholds(y_val, val_probs, w_val)
 y_pred_probs = model.predict(X_test)
-y_pred_binary = (y_pred_probs > 0.2).astype(int)
-
-print("\nClassification Report for Each Button:")
-for i, target in enumerate(targets):
-    classes = np.unique(y_test[:, i])
-    target_names = [f'Not {target}' if c == 0 else target for c in classes]
-    print(f"\n{target}:")
-    print(classification_report(y_test[:, i], y_pred_binary[:, i], 
-                               labels=classes, target_names=target_names, 
-                               zero_division=0))
-
-accuracies = [np.mean(y_test[:, i] == y_pred_binary[:, i]) for i in range(y_test.shape[1])]
-average_accuracy = np.mean(accuracies)
+
+print("\nClassification Report for Each Button (thresholds tuned on the validation split):")
+test_metrics = print_report(y_test, y_pred_probs, thresholds, w_test, baseline=EVAL_THRESHOLD)
+average_accuracy = np.mean(test_metrics['accuracy'])
 print(f"\nAverage Accuracy Across All Buttons: {average_accuracy:.4f}")
 
 # Step 12: Save the model
 model.save('ShadowFightBotMLP.keras')
-print("Model saved as ShadowFightBotMLP.keras")
\ No newline at end of file
+print("Model saved as ShadowFightBotMLP.keras")
+save_thresholds(thresholds_file('ShadowFightBotMLP.keras'), thresholds, metrics_at(y_val, val_probs, thresholds, w_val),
+                'ShadowFightBotMLP.keras')
+print(f"Per-button thresholds saved as {thresholds_file('ShadowFightBotMLP.keras')}")
+
+# Step 13: Benchmark single-frame and batched inference and store it with the test metrics in a model card
+card = build_card(model, scaler, scaler.inverse_transform(X_test[:1000]),
+                  accuracy_metrics(y_test, y_pred_probs, thresholds, w_test), model_path='ShadowFightBotMLP.keras')
+save_card(card, card_path('ShadowFightBotMLP.keras'))
+print_summary(card, card_path('ShadowFightBotMLP.keras'))
@@ -0,0 +1,235 @@
+import array
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+import shm_transport
+from game_state import GameState
+from session_capture import RECV, SEND, frame_pairs, read_capture, start_capture
+from wire_codec import STATE, WIRE_MAGIC, decode_command, decode_state, encode_command, negotiate
+
+# Port the game connects to for each player; the shared-memory ring is named after it too
+PORTS = {'1': 9999, '2': 10000}
+# Seconds without a state (or without room to send) before the bot gives up on the game,
+# instead of hanging on a connection the emulator has dropped
+DEFAULT_TIMEOUT = 60.0
+TRANSPORT_HELP = "tcp (default), shm or replay:<capture file>"
+
+
+class Transport:
+    """
+    Connection of a controller to the game, with byte and latency counters.
+
+    Backends implement _receive() (the next GameState) and _send(command) and keep
+    bytes_received and bytes_sent up to date; receive() and send() time them.
+    """
+
+    name = 'transport'
+
+    def __init__(self):
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        # Per frame, in nanoseconds: waiting for the state, and from holding the state to having
+        # sent the reply (the bot's decision plus the send); arrays stay small over long sessions
+        self.wait_ns = array.array('q')
+        self.reply_ns = array.array('q')
+        self._received_at = None
+
+    def receive(self):
+        start = time.perf_counter_ns()
+        game_state = self._receive()
+        self._received_at = time.perf_counter_ns()
+        self.wait_ns.append(self._received_at - start)
+        return game_state
+
+    def send(self, command):
+        self._send(command)
+        if self._received_at is not None:
+            self.reply_ns.append(time.perf_counter_ns() - self._received_at)
+            self._received_at = None
+
+    def _receive(self):
+        raise NotImplementedError
+
+    def _send(self, command):
+        raise NotImplementedError
+
+    def stats(self):
+        """Counters so far: frames, bytes each way, mean wait for a state and state-to-reply latencies."""
+        frames = len(self.wait_ns)
+        reply_us = np.frombuffer(self.reply_ns, dtype=np.int64) / 1000 if len(self.reply_ns) else np.zeros(1)
+        wait_ms = np.frombuffer(self.wait_ns, dtype=np.int64) / 1e6 if frames else np.zeros(1)
+        return {
+            'transport': self.name, 'frames': frames,
+            'bytes_received': self.bytes_received, 'bytes_sent': self.bytes_sent,
+            'wait_ms_mean': float(np.mean(wait_ms)), 'reply_us_mean': float(np.mean(reply_us)),
+            'reply_us_p50': float(np.percentile(reply_us, 50)), 'reply_us_p99': float(np.percentile(reply_us, 99)),
+        }
+
+    def report(self):
+        stats = self.stats()
+        frames = max(stats['frames'], 1)
+        print(f"Transport {stats['transport']}: {stats['frames']} frames, "
+              f"{stats['bytes_received'] / frames:.1f} bytes in and {stats['bytes_sent'] / frames:.1f} out per frame, "
+              f"{stats['wait_ms_mean']:.2f} ms mean wait per state")
+        print(f"State to reply sent: mean {stats['reply_us_mean']:.1f} us, p50 {stats['reply_us_p50']:.1f} us, "
+              f"p99 {stats['reply_us_p99']:.1f} us")
+
+    def close(self):
+        pass
+
+
+class SocketTransport(Transport):
+    """TCP connection to the game, speaking the codec negotiated with it (binary if offered, else JSON)."""
+
+    def __init__(self, sock, codec):
+        super().__init__()
+        self.sock = sock
+        self.codec = codec
+        self.name = f'tcp/{codec.name}'
+
+    def _receive(self):
+        game_state = self.codec.receive(self.sock)
+        self.bytes_received = self.codec.bytes_received
+        return game_state
+
+    def _send(self, command):
+        self.codec.send(self.sock, command)
+        self.bytes_sent = self.codec.bytes_sent
+
+    def close(self):
+        self.sock.close()
+
+
+class SharedMemoryTransport(Transport):
+    """Ring of shm_transport.py in a memory-mapped file, for a game on the same machine."""
+
+    name = 'shm'
+
+    def __init__(self, ring, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.ring = ring
+        self.timeout = timeout
+
+    def _receive(self):
+        game_state = GameState(decode_state(self.ring.receive_state(self.timeout)))
+        self.bytes_received = self.ring.bytes_received
+        return game_state
+
+    def _send(self, command):
+        self.ring.send_command(encode_command(command), self.timeout)
+        self.bytes_sent = self.ring.bytes_sent
+
+    def close(self):
+        self.ring.close()
+
+
+def _binary_messages(records):
+    """Records of a binary capture as whole messages: the hello exchange dropped, states cut to STATE.size."""
+    messages = []
+    pending = bytearray()
+    hello_reply = True
+    for direction, t_ns, pay_load in records[1:]:
+        if direction == SEND:
+            if hello_reply and pay_load[:len(WIRE_MAGIC)] == WIRE_MAGIC:
+                hello_reply = False
+                continue
+            messages.append((SEND, t_ns, pay_load))
+            continue
+        pending += pay_load
+        # A state may arrive over several recv calls, and stamps the time its last byte came in
+        while len(pending) >= STATE.size:
+            messages.append((RECV, t_ns, bytes(pending[:STATE.size])))
+            del pending[:STATE.size]
+    return messages
+
+
+class ReplayTransport(Transport):
+    """
+    The states of a capture file, served in order to replay a session offline.
+
+    A capture that starts with the binary hello is decoded with the binary codec, otherwise
+    as JSON. Every (state record, reply record) pair is in `pairs`, and the commands the bot
+    sends are kept in `sent` as (monotonic ns, payload).
+    """
+
+    def __init__(self, capture_path):
+        super().__init__()
+        self.seed, self.player_id, records = read_capture(capture_path)
+        self.binary = bool(records) and records[0][0] == RECV and records[0][2][:len(WIRE_MAGIC)] == WIRE_MAGIC
+        self.name = f"replay/{'binary' if self.binary else 'json'}"
+        self.pairs = frame_pairs(_binary_messages(records) if self.binary else records)
+        self.position = 0
+        self.sent = []
+
+    def _receive(self):
+        if self.position >= len(self.pairs):
+            raise ConnectionError("End of the capture")
+        pay_load = self.pairs[self.position][0][2]
+        self.position += 1
+        self.bytes_received += len(pay_load)
+        return GameState(decode_state(pay_load) if self.binary else json.loads(pay_load))
+
+    def _send(self, command):
+        pay_load = encode_command(command) if self.binary else json.dumps(command.object_to_dict()).encode()
+        self.sent.append((time.monotonic_ns(), pay_load))
+        self.bytes_sent += len(pay_load)
+
+    def command_dict(self, pay_load):
+        """Command dict of a sent or captured command payload."""
+        return decode_command(pay_load) if self.binary else json.loads(pay_load)
+
+
+def listen(port, player_id='1', capture_path=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Accept the game's connection on the port and negotiate the codec.
+
+    The connection gets TCP_NODELAY, so the small replies are not held back by Nagle's
+    algorithm, and a receive timeout. With capture_path the raw traffic, negotiation
+    included, is recorded for session_capture.py.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+        if os.name != 'nt':
+            # Restarting the bot right after a round must not fail on the port's TIME_WAIT
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind(("127.0.0.1", port))
+        server_socket.listen(1)
+        client_socket, _ = server_socket.accept()
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    client_socket.settimeout(timeout)
+    print("Connected to game!")
+    if capture_path:
+        client_socket = start_capture(client_socket, capture_path, player_id)
+    return SocketTransport(client_socket, negotiate(client_socket))
+
+
+def open_transport(player_id, spec='tcp', capture_path=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Connect a controller's player to the game.
+
+    Args:
+        player_id: '1' or '2'; picks the port (9999 or 10000) and the shared-memory ring
+        spec: 'tcp' (binary codec if the game offers it, else JSON), 'shm' or 'replay:<capture file>'
+        capture_path: File to record the raw TCP traffic to (tcp only)
+        timeout: Seconds to wait for a state or for room to send before giving up
+
+    Returns:
+        Transport with receive(), send(command), report() and close()
+    """
+    if spec == 'tcp':
+        return listen(PORTS[player_id], player_id, capture_path, timeout)
+    if capture_path:
+        raise ValueError("--capture records the TCP traffic and needs the tcp transport")
+    if spec == 'shm':
+        return SharedMemoryTransport(shm_transport.connect(PORTS[player_id], timeout=None), timeout)
+    if spec.startswith('replay:'):
+        transport = ReplayTransport(spec[len('replay:'):])
+        if transport.player_id != player_id:
+            raise ValueError(f"The capture was played as Player {transport.player_id}, not Player {player_id}")
+        # The same seed as the captured session, for bots that use NumPy's randomness
+        np.random.seed(transport.seed)
+        return transport
+    raise ValueError(f"Unknown transport '{spec}' (expected {TRANSPORT_HELP})")
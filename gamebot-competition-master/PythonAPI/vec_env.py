@@ -0,0 +1,432 @@
+import argparse
+import math
+import time
+
+import numpy as np
+
+from log_schema import FEATURES, TARGETS
+from simulator import (AIR_MOVES, BLOCK_PUSHBACK, BLOCKSTUN_FRAMES, BLOCKSTUN_ID, BODY_WIDTH, BUTTON_NAMES,
+                       CHIP_DIVISOR, CROUCHING_MOVES, FIREBALL, FIREBALL_HEIGHT, FIREBALL_MOTION, FIREBALL_SPEED,
+                       FIREBALL_WIDTH, FRAMES_PER_TICK, GRAVITY, GROUND_Y, HIT_PUSHBACK, HITSTUN_FRAMES, HITSTUN_ID,
+                       HURRICANE, HURRICANE_MOTION, HURRICANE_SPEED, JUMP_SPEED, JUMP_VELOCITY, KICKS, MAX_HEALTH,
+                       MOTION_WINDOW, NORMALS, PUNCHES, ROUND_TIME, STAGE_LEFT, STAGE_RIGHT, START_X, WALK_SPEED,
+                       FightSimulator)
+
+ENV_SIZES = (1, 4, 16, 64, 256, 1024, 4096)
+COLUMN = {name: i for i, name in enumerate(BUTTON_NAMES)}
+ATTACKS = PUNCHES + KICKS
+ATTACK_COLUMNS = [COLUMN[name] for name in ATTACKS]
+# Button columns the 8 model targets drive, in TARGETS order
+TARGET_COLUMNS = [COLUMN[name] for name in ('Left', 'Right', 'Up', 'Down', 'A', 'B', 'X', 'Y')]
+
+# The simulator's moves as table rows; row 0 is "no move"
+MOVES = [None] + list(NORMALS.values()) + [FIREBALL, HURRICANE]
+MOVE_ID = np.array([0] + [move.move_id for move in MOVES[1:]], dtype=np.int32)
+STARTUP = np.array([0] + [move.startup for move in MOVES[1:]], dtype=np.int32)
+ACTIVE_END = np.array([0] + [move.startup + move.active for move in MOVES[1:]], dtype=np.int32)
+TOTAL = np.array([0] + [move.startup + move.active + move.recovery for move in MOVES[1:]], dtype=np.int32)
+DAMAGE = np.array([0] + [move.damage for move in MOVES[1:]], dtype=np.int32)
+REACH = np.array([0] + [move.reach for move in MOVES[1:]], dtype=np.int32)
+HEIGHTS = ('mid', 'low', 'high')
+HEIGHT = np.array([0] + [HEIGHTS.index(move.height) for move in MOVES[1:]], dtype=np.int8)
+IS_AIR = np.array([move in AIR_MOVES for move in MOVES], dtype=bool)
+IS_CROUCH = np.array([move in CROUCHING_MOVES for move in MOVES], dtype=bool)
+IS_SPECIAL = np.array([move in (FIREBALL, HURRICANE) for move in MOVES], dtype=bool)
+FIREBALL_ROW = MOVES.index(FIREBALL)
+HURRICANE_ROW = MOVES.index(HURRICANE)
+# Row of the normal move for (stance, attack button): stances stand, crouch, air
+STANCES = ('stand', 'crouch', 'air')
+NORMAL_ROW = np.array([[MOVES.index(NORMALS[(stance, name)]) for name in ATTACKS] for stance in STANCES],
+                      dtype=np.int32)
+
+# Held directions coded as 3 * vertical (none, down, up) + horizontal (none, forward, back)
+NO_INPUT = -1
+DIRECTION_CODES = {'neutral': 0, 'forward': 1, 'back': 2, 'down': 3, 'down-forward': 4, 'down-back': 5,
+                   'up': 6, 'up-forward': 7, 'up-back': 8}
+
+
+class VectorFightEnv:
+    """
+    N independent rounds of the FightSimulator game, stepped together as NumPy arrays.
+
+    State is kept as structure-of-arrays: one (2, N) array per fighter field (row 0 is Player 1,
+    row 1 Player 2) and one (N,) array per round field, so a step costs a fixed number of array
+    operations whatever N is. The rules are FightSimulator's, frame for frame (check() compares
+    the two). Rounds that end are reset in the same step.
+    """
+
+    def __init__(self, n, seed=0, start_jitter=20):
+        """
+        Args:
+            n: Number of simultaneous rounds
+            seed: Seed of the start position jitter
+            start_jitter: Largest random shift of the start positions, in pixels
+        """
+        self.n = n
+        self.start_jitter = start_jitter
+        self.rng = np.random.default_rng(seed)
+        shape = (2, n)
+        self.x = np.zeros(shape, dtype=np.int32)
+        self.y = np.zeros(shape, dtype=np.int32)
+        self.vx = np.zeros(shape, dtype=np.int32)
+        self.vy = np.zeros(shape, dtype=np.int32)
+        self.health = np.zeros(shape, dtype=np.int32)
+        self.facing = np.zeros(shape, dtype=np.int32)
+        self.crouching = np.zeros(shape, dtype=bool)
+        self.move = np.zeros(shape, dtype=np.int32)
+        self.move_frame = np.zeros(shape, dtype=np.int32)
+        self.stun = np.zeros(shape, dtype=np.int32)
+        self.stun_id = np.zeros(shape, dtype=np.int32)
+        self.connected = np.zeros(shape, dtype=bool)
+        self.projectile = np.zeros(shape, dtype=np.int32)
+        self.has_projectile = np.zeros(shape, dtype=bool)
+        self.buttons = np.zeros(shape + (len(BUTTON_NAMES),), dtype=bool)
+        self.motion = np.full(shape + (MOTION_WINDOW,), NO_INPUT, dtype=np.int8)
+        self.frame = np.zeros(n, dtype=np.int32)
+        self.timer = np.zeros(n, dtype=np.int32)
+        self.reset()
+
+    def reset(self, mask=None):
+        """Start new rounds in the envs selected by the (N,) bool mask (all by default). Returns features(1)."""
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        count = int(mask.sum())
+        shift = self.rng.integers(-self.start_jitter, self.start_jitter + 1, count) if self.start_jitter else 0
+        self.x[0, mask] = START_X[0] + shift
+        self.x[1, mask] = START_X[1] + shift
+        self.facing[0, mask] = 1
+        self.facing[1, mask] = -1
+        self.health[:, mask] = MAX_HEALTH
+        self.y[:, mask] = GROUND_Y
+        for field in (self.vx, self.vy, self.move, self.move_frame, self.stun, self.stun_id, self.projectile):
+            field[:, mask] = 0
+        for field in (self.crouching, self.connected, self.has_projectile, self.buttons):
+            field[:, mask] = False
+        self.motion[:, mask] = NO_INPUT
+        self.frame[mask] = 0
+        self.timer[mask] = ROUND_TIME
+        return self.features(1)
+
+    def features(self, player=1):
+        """
+        (N, 16) float64 feature matrix of every round from one player's side, in FEATURES order.
+
+        Args:
+            player: 1 or 2
+        """
+        me, other = (0, 1) if player == 1 else (1, 0)
+        columns = {
+            'player_x': self.x[me], 'player_y': self.y[me],
+            'opponent_x': self.x[other], 'opponent_y': self.y[other],
+            'distance': np.hypot(self.x[me] - self.x[other], self.y[me] - self.y[other]),
+            'timer': self.timer, 'has_round_started': 1,
+            # Rounds are reset in the step that ends them, so no returned frame is over
+            'is_round_over': 0,
+            'player_jumping': self.y[me] < GROUND_Y, 'player_crouching': self.crouching[me],
+            'player_in_move': (self.move[me] != 0) | (self.stun[me] > 0), 'player_move_id': self._move_id(me),
+            'opponent_jumping': self.y[other] < GROUND_Y, 'opponent_crouching': self.crouching[other],
+            'opponent_in_move': (self.move[other] != 0) | (self.stun[other] > 0),
+            'opponent_move_id': self._move_id(other),
+        }
+        X = np.empty((self.n, len(FEATURES)), dtype=np.float64)
+        for i, name in enumerate(FEATURES):
+            X[:, i] = columns[name]
+        return X
+
+    def step(self, p1_buttons, p2_buttons=None):
+        """
+        Advance every round one frame.
+
+        Args:
+            p1_buttons: (N, 12) bool/0-1 matrix of Player 1's held buttons, columns in BUTTON_NAMES order
+            p2_buttons: Same for Player 2 (None: nothing held)
+
+        Returns:
+            (features, done, winner): features(1) after the step, (N,) bool of rounds that ended
+            in it (already reset, so their features are the new round's first frame) and (N,)
+            winners of those rounds (1, 2 or 0 for a draw; -1 elsewhere)
+        """
+        if p2_buttons is None:
+            p2_buttons = np.zeros((self.n, len(BUTTON_NAMES)), dtype=bool)
+        self._control(np.stack([np.asarray(p1_buttons, dtype=bool), np.asarray(p2_buttons, dtype=bool)]))
+        self._advance()
+        self._hits()
+        self._separate()
+        self._face()
+
+        self.frame += 1
+        tick = self.frame % FRAMES_PER_TICK == 0
+        self.timer[tick] = np.maximum(0, self.timer[tick] - 1)
+        done = (self.health[0] <= 0) | (self.health[1] <= 0) | (self.timer <= 0)
+        winner = np.where(done, np.where(self.health[0] > self.health[1], 1,
+                                         np.where(self.health[1] > self.health[0], 2, 0)), -1).astype(np.int8)
+        if done.any():
+            self.reset(done)
+        return self.features(1), done, winner
+
+    def _move_id(self, player):
+        return np.where(self.stun[player] > 0, self.stun_id[player], MOVE_ID[self.move[player]])
+
+    def _performed(self, motion, candidates):
+        """
+        (2, N) bool: among the candidates, the input window holds the motion as a subsequence ending on this frame.
+
+        With the last direction fixed to the motion's last one, that is a first direction
+        somewhere in the window followed by the second one before the last frame.
+        """
+        first, second, last = (DIRECTION_CODES[direction] for direction in motion)
+        candidates = candidates & (self.motion[:, :, -1] == last)
+        players, rounds = np.nonzero(candidates)
+        if len(players) == 0:
+            return candidates
+        # Only the candidates' windows are searched: motions complete on few frames
+        window = self.motion[players, rounds]
+        starts = window == first
+        first_at = np.where(starts.any(axis=1), starts.argmax(axis=1), MOTION_WINDOW)
+        later = np.arange(MOTION_WINDOW - 1) > first_at[:, None]
+        candidates[players, rounds] = ((window[:, :-1] == second) & later).any(axis=1)
+        return candidates
+
+    def _start(self, mask, rows):
+        self.move[mask] = rows[mask]
+        self.move_frame[mask] = 0
+        self.connected[mask] = False
+
+    def _control(self, buttons):
+        attacks = buttons[:, :, ATTACK_COLUMNS]
+        pressed = attacks & ~self.buttons[:, :, ATTACK_COLUMNS]
+        any_pressed = pressed.any(axis=2)
+        first = pressed.argmax(axis=2)
+        punch = pressed[:, :, :len(PUNCHES)].any(axis=2)
+        kick = pressed[:, :, len(PUNCHES):].any(axis=2)
+        self.buttons = buttons
+
+        up, down = buttons[:, :, COLUMN['Up']], buttons[:, :, COLUMN['Down']]
+        right, left = buttons[:, :, COLUMN['Right']], buttons[:, :, COLUMN['Left']]
+        toward = np.where(self.facing > 0, right, left)
+        away = np.where(self.facing > 0, left, right)
+        horizontal = np.where(toward, 1, np.where(away, 2, 0))
+        vertical = np.where(down, 1, np.where(up, 2, 0))
+        self.motion[:, :, :-1] = self.motion[:, :, 1:]
+        self.motion[:, :, -1] = 3 * vertical + horizontal
+        self.crouching[:] = False
+
+        free = (self.move == 0) & (self.stun <= 0)
+        airborne = self.y < GROUND_Y
+        self._start(free & airborne & any_pressed, NORMAL_ROW[2][first])
+
+        ground = free & ~airborne
+        fireball = self._performed(FIREBALL_MOTION, ground & punch & ~self.has_projectile)
+        hurricane = self._performed(HURRICANE_MOTION, ground & ~fireball & kick)
+        rest = ground & ~fireball & ~hurricane
+        self._start(fireball, np.full_like(first, FIREBALL_ROW))
+        self._start(hurricane, np.full_like(first, HURRICANE_ROW))
+
+        jump = rest & up
+        self.vy[jump] = JUMP_VELOCITY
+        self.vx[jump] = (JUMP_SPEED * (right.astype(np.int32) - left))[jump]
+        self._start(jump & any_pressed, NORMAL_ROW[2][first])
+
+        normal = rest & ~up & any_pressed
+        self.crouching |= normal & down
+        self._start(normal, np.where(down, NORMAL_ROW[1][first], NORMAL_ROW[0][first]))
+        self.crouching |= rest & ~up & ~any_pressed & down
+        walk = rest & ~up & ~any_pressed & ~down
+        self.x += np.where(walk, WALK_SPEED * (right.astype(np.int32) - left), 0)
+
+    def _advance(self):
+        self.stun = np.where(self.stun > 0, self.stun - 1, self.stun)
+        moving = self.move != 0
+        self.move_frame += moving
+        active = (STARTUP[self.move] < self.move_frame) & (self.move_frame <= ACTIVE_END[self.move])
+        self.x += np.where(moving & (self.move == HURRICANE_ROW) & active, HURRICANE_SPEED * self.facing, 0)
+        spawn = moving & (self.move == FIREBALL_ROW) & (self.move_frame == STARTUP[FIREBALL_ROW])
+        self.projectile[spawn] = (self.x + self.facing * BODY_WIDTH)[spawn]
+        self.has_projectile |= spawn
+        ended = moving & (self.move_frame >= TOTAL[self.move])
+        self.crouching |= moving & ~ended & IS_CROUCH[self.move]
+        self.move[ended] = 0
+
+        air = (self.y < GROUND_Y) | (self.vy < 0)
+        self.x += np.where(air, self.vx, 0)
+        self.y += np.where(air, self.vy, 0)
+        self.vy += np.where(air, GRAVITY, 0)
+        landed = air & (self.y >= GROUND_Y)
+        self.y[landed] = GROUND_Y
+        self.vx[landed] = 0
+        self.vy[landed] = 0
+        self.move[landed & IS_AIR[self.move]] = 0
+
+        self.projectile += np.where(self.has_projectile, FIREBALL_SPEED * self.facing, 0)
+        self.has_projectile &= ((STAGE_LEFT - FIREBALL_WIDTH <= self.projectile) &
+                                (self.projectile <= STAGE_RIGHT + FIREBALL_WIDTH))
+
+    def _hits(self):
+        # Row p of an "opponent" array is the other fighter of row p
+        move = self.move
+        x_other, y_other = self.x[::-1], self.y[::-1]
+        distance = (x_other - self.x) * self.facing
+        melee = ((move != 0) & (move != FIREBALL_ROW) & ~self.connected &
+                 (STARTUP[move] < self.move_frame) & (self.move_frame <= ACTIVE_END[move]) &
+                 ~((HEIGHT[move] == HEIGHTS.index('low')) & (y_other < GROUND_Y)) &
+                 (distance >= 0) & (distance <= REACH[move]))
+        projectile = (self.has_projectile & (np.abs(self.projectile - x_other) <= FIREBALL_WIDTH) &
+                      (GROUND_Y - y_other <= FIREBALL_HEIGHT))
+        # Every hit is found before any is applied, then applied in FightSimulator's order
+        melee_rows = move.copy()
+        for attacker in (0, 1):
+            self._resolve(attacker, melee[attacker], melee_rows[attacker])
+        fireball_rows = np.full(self.n, FIREBALL_ROW)
+        for attacker in (0, 1):
+            self._resolve(attacker, projectile[attacker], fireball_rows, projectile=True)
+
+    def _resolve(self, attacker, mask, rows, projectile=False):
+        if not mask.any():
+            return
+        defender = 1 - attacker
+        if projectile:
+            self.has_projectile[attacker, mask] = False
+        else:
+            self.connected[attacker, mask] = True
+        height = HEIGHT[rows]
+        away = np.where(self.facing[defender] > 0, self.buttons[defender, :, COLUMN['Left']],
+                        self.buttons[defender, :, COLUMN['Right']])
+        crouching = self.buttons[defender, :, COLUMN['Down']]
+        blocks = (mask & (self.y[defender] >= GROUND_Y) & (self.move[defender] == 0) &
+                  ~((self.stun[defender] > 0) & (self.stun_id[defender] == HITSTUN_ID)) & away &
+                  ((height == HEIGHTS.index('mid')) | ((height == HEIGHTS.index('low')) == crouching)))
+        hit = mask & ~blocks
+        damage = np.where(hit, DAMAGE[rows], np.where(blocks & IS_SPECIAL[rows], DAMAGE[rows] // CHIP_DIVISOR, 0))
+        self.health[defender] = np.maximum(0, self.health[defender] - damage)
+        self.stun[defender] = np.where(hit, HITSTUN_FRAMES, np.where(blocks, BLOCKSTUN_FRAMES, self.stun[defender]))
+        self.stun_id[defender] = np.where(hit, HITSTUN_ID, np.where(blocks, BLOCKSTUN_ID, self.stun_id[defender]))
+        self.x[defender] += self.facing[attacker] * np.where(hit, HIT_PUSHBACK, np.where(blocks, BLOCK_PUSHBACK, 0))
+        self.move[defender, hit] = 0
+
+    def _separate(self):
+        np.clip(self.x, STAGE_LEFT, STAGE_RIGHT, out=self.x)
+        x1, x2 = self.x
+        overlap = BODY_WIDTH - np.abs(x2 - x1)
+        push = (overlap > 0) & (self.y[0] >= GROUND_Y) & (self.y[1] >= GROUND_Y)
+        if not push.any():
+            return
+        p1_left = (x1 < x2) | ((x1 == x2) & (self.facing[0] > 0))
+        left = np.where(p1_left, x1, x2) - overlap // 2
+        right = np.where(p1_left, x2, x1) + overlap - overlap // 2
+        at_left_wall = left < STAGE_LEFT
+        at_right_wall = ~at_left_wall & (right > STAGE_RIGHT)
+        left = np.where(at_left_wall, STAGE_LEFT, np.where(at_right_wall, STAGE_RIGHT - BODY_WIDTH, left))
+        right = np.where(at_left_wall, STAGE_LEFT + BODY_WIDTH, np.where(at_right_wall, STAGE_RIGHT, right))
+        self.x[0] = np.where(push, np.where(p1_left, left, right), x1)
+        self.x[1] = np.where(push, np.where(p1_left, right, left), x2)
+
+    def _face(self):
+        x_other = self.x[::-1]
+        turn = (self.y >= GROUND_Y) & (self.move == 0) & (self.stun <= 0) & (self.x != x_other)
+        self.facing = np.where(turn, np.where(x_other > self.x, 1, -1), self.facing)
+
+
+def buttons_from_targets(states):
+    """(N, 12) button matrix of (N, 8) 0/1 model outputs in TARGETS order, e.g. from a policy's predict_batch."""
+    states = np.asarray(states)
+    buttons = np.zeros((len(states), len(BUTTON_NAMES)), dtype=bool)
+    buttons[:, TARGET_COLUMNS] = states[:, :len(TARGETS)] > 0
+    return buttons
+
+
+def random_buttons(rng, n, p=0.15):
+    """(N, 12) matrix with every button held with probability p."""
+    return rng.random((n, len(BUTTON_NAMES))) < p
+
+
+def _dict_features(input_dict, player):
+    me, other = (input_dict['p1'], input_dict['p2']) if player == 1 else (input_dict['p2'], input_dict['p1'])
+    columns = {
+        'player_x': me['x'], 'player_y': me['y'], 'opponent_x': other['x'], 'opponent_y': other['y'],
+        'distance': math.sqrt((me['x'] - other['x']) ** 2 + (me['y'] - other['y']) ** 2),
+        'timer': input_dict['timer'], 'has_round_started': input_dict['round_started'],
+        'is_round_over': input_dict['round_over'], 'player_jumping': me['jumping'],
+        'player_crouching': me['crouching'], 'player_in_move': me['in_move'], 'player_move_id': me['move'],
+        'opponent_jumping': other['jumping'], 'opponent_crouching': other['crouching'],
+        'opponent_in_move': other['in_move'], 'opponent_move_id': other['move'],
+    }
+    return [float(columns[name]) for name in FEATURES]
+
+
+def check(n=16, frames=3000, seed=0):
+    """
+    Step VectorFightEnv and n FightSimulators with the same random buttons and compare every frame.
+
+    Returns:
+        True if the features of both players match on every frame
+    """
+    rng = np.random.default_rng(seed)
+    env = VectorFightEnv(n, start_jitter=0)
+    sims = [FightSimulator(start_jitter=0) for _ in range(n)]
+    seen_moves = set()
+    rounds = 0
+    for frame in range(frames):
+        p1, p2 = random_buttons(rng, n), random_buttons(rng, n)
+        env.step(p1, p2)
+        expected = ([], [])
+        for i, sim in enumerate(sims):
+            input_dict = sim.step(dict(zip(BUTTON_NAMES, p1[i].tolist())), dict(zip(BUTTON_NAMES, p2[i].tolist())))
+            if input_dict['round_over']:
+                rounds += 1
+                input_dict = sim.reset()
+            seen_moves.update((input_dict['p1']['move'], input_dict['p2']['move']))
+            expected[0].append(_dict_features(input_dict, 1))
+            expected[1].append(_dict_features(input_dict, 2))
+        for player in (1, 2):
+            if not np.allclose(env.features(player), expected[player - 1]):
+                rows = np.nonzero(~np.all(np.isclose(env.features(player), expected[player - 1]), axis=1))[0]
+                print(f"Frame {frame}: Player {player} features differ in rounds {rows[:10].tolist()}")
+                return False
+    print(f"{frames} frames x {n} rounds identical to FightSimulator ({rounds} rounds ended, "
+          f"move ids seen {sorted(seen_moves)})")
+    return True
+
+
+def benchmark(sizes=ENV_SIZES, seconds=1.0, seed=0):
+    """Steps and frames per second of VectorFightEnv for every N, against FightSimulator stepping one round."""
+    rng = np.random.default_rng(seed)
+    # Inputs are generated up front so only the environment is timed
+    pool = [random_buttons(rng, max(sizes)) for _ in range(64)]
+    sim = FightSimulator(seed=seed)
+    dicts = [dict(zip(BUTTON_NAMES, row.tolist())) for row in pool[0][:64]]
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if sim.step(dicts[steps % 64], dicts[(steps + 1) % 64])['round_over']:
+            sim.reset()
+        steps += 1
+    scalar_fps = steps / (time.perf_counter() - start)
+    print(f"FightSimulator (one round, Python objects): {scalar_fps:.0f} frames/s")
+
+    print(f"\n{'N':>6} {'steps/s':>10} {'frames/s':>12} {'us/step':>9} {'vs scalar':>9}")
+    for n in sizes:
+        env = VectorFightEnv(n, seed=seed)
+        inputs = [buttons[:n] for buttons in pool]
+        steps = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            env.step(inputs[steps % 64], inputs[(steps + 1) % 64])
+            steps += 1
+        elapsed = time.perf_counter() - start
+        print(f"{n:>6} {steps / elapsed:>10.0f} {n * steps / elapsed:>12.0f} {elapsed * 1e6 / steps:>9.1f} "
+              f"{n * steps / elapsed / scalar_fps:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Vectorized batch of simulated rounds: check and benchmark')
+    parser.add_argument('--sizes', type=str, default=','.join(map(str, ENV_SIZES)),
+                        help='Comma-separated numbers of simultaneous rounds to benchmark')
+    parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on every size (default: 1)')
+    parser.add_argument('--check', action='store_true',
+                        help='First compare every frame with FightSimulator on random inputs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check and not check(seed=args.seed):
+        raise SystemExit(1)
+    benchmark([int(n) for n in args.sizes.split(',') if n], args.seconds, args.seed)
@@ -0,0 +1,391 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from buttons import Buttons
+from command import Command
+from game_state import GameState
+
+WIRE_MAGIC = b'SFWC'
+WIRE_VERSION = 1
+# Sent by the game right after connecting (magic, highest version it speaks) and echoed
+# back by the bot with the version chosen; a game that starts with a JSON state gets JSON
+HELLO = struct.Struct('<4sB')
+# Button bit i is the i-th button of Buttons.object_to_dict()
+BUTTON_ORDER = tuple(Buttons().object_to_dict())
+# Per player: character, health, x, y, flags (jumping, crouching, in_move), move id, buttons
+PLAYER_FORMAT = 'BhhhBHH'
+# version, player 1, player 2, timer, result, flags (round_started, round_over)
+STATE = struct.Struct('<B' + PLAYER_FORMAT * 2 + 'hbB')
+# version, player 1 buttons, player 2 buttons
+COMMAND = struct.Struct('<BHH')
+JUMPING, CROUCHING, IN_MOVE = 1, 2, 4
+ROUND_STARTED, ROUND_OVER = 1, 2
+DEFAULT_BENCH_FRAMES = 5000
+
+
+def pack_buttons(buttons_dict):
+    bits = 0
+    for i, name in enumerate(BUTTON_ORDER):
+        if buttons_dict[name]:
+            bits |= 1 << i
+    return bits
+
+
+# Button dict of every 12-bit value, copied on decode instead of rebuilt bit by bit
+_BUTTON_DICTS = [{name: bool(bits >> i & 1) for i, name in enumerate(BUTTON_ORDER)}
+                 for bits in range(1 << len(BUTTON_ORDER))]
+
+
+def unpack_buttons(bits):
+    return _BUTTON_DICTS[bits].copy()
+
+
+def _player_fields(player):
+    flags = (JUMPING if player['jumping'] else 0) | (CROUCHING if player['crouching'] else 0) | \
+            (IN_MOVE if player['in_move'] else 0)
+    return (player['character'], player['health'], player['x'], player['y'], flags, player['move'],
+            pack_buttons(player['buttons']))
+
+
+def _player_dict(character, health, x, y, flags, move, buttons):
+    return {
+        'character': character, 'health': health, 'x': x, 'y': y,
+        'jumping': bool(flags & JUMPING), 'crouching': bool(flags & CROUCHING),
+        'buttons': unpack_buttons(buttons), 'in_move': bool(flags & IN_MOVE), 'move': move,
+    }
+
+
+def encode_state(input_dict, version=WIRE_VERSION):
+    """Pack a game state dict (the JSON the game sends) into STATE.size bytes."""
+    flags = (ROUND_STARTED if input_dict['round_started'] else 0) | (ROUND_OVER if input_dict['round_over'] else 0)
+    return STATE.pack(version, *_player_fields(input_dict['p1']), *_player_fields(input_dict['p2']),
+                      input_dict['timer'], input_dict['result'], flags)
+
+
+def decode_state(payload):
+    """The game state dict of a packed state, as GameState(input_dict) consumes it."""
+    fields = STATE.unpack(payload)
+    if fields[0] != WIRE_VERSION:
+        raise ValueError(f"State of wire version {fields[0]}, expected {WIRE_VERSION}")
+    size = len(PLAYER_FORMAT)
+    timer, result, flags = fields[1 + 2 * size:]
+    return {
+        'p1': _player_dict(*fields[1:1 + size]),
+        'p2': _player_dict(*fields[1 + size:1 + 2 * size]),
+        'timer': timer, 'result': result,
+        'round_started': bool(flags & ROUND_STARTED), 'round_over': bool(flags & ROUND_OVER),
+    }
+
+
+def encode_command(command, version=WIRE_VERSION):
+    """Pack a Command into COMMAND.size bytes: two bytes of button bits per player."""
+    return COMMAND.pack(version, pack_buttons(command.player_buttons.object_to_dict()),
+                        pack_buttons(command.player2_buttons.object_to_dict()))
+
+
+def decode_command(payload):
+    """The command dict of a packed command, as Command.object_to_dict() gives it."""
+    version, p1, p2 = COMMAND.unpack(payload)
+    if version != WIRE_VERSION:
+        raise ValueError(f"Command of wire version {version}, expected {WIRE_VERSION}")
+    command_dict = Command().object_to_dict()
+    command_dict['p1'] = unpack_buttons(p1)
+    command_dict['p2'] = unpack_buttons(p2)
+    return command_dict
+
+
+def recv_exact(sock, buffer):
+    """Fill a bytearray/memoryview from the socket. Raises ConnectionError if the peer closes first."""
+    view = memoryview(buffer)
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed in the middle of a message")
+        received += count
+    return buffer
+
+
+class JsonCodec:
+    """The original protocol: one JSON document per recv and per sendall, read into one reused buffer."""
+
+    name = 'json'
+
+    def __init__(self, first_payload=None):
+        # The state already read while negotiating, handed out by the first receive
+        self._pending = first_payload
+        self._buffer = bytearray(4096)
+        self.bytes_sent = 0
+        self.bytes_received = len(first_payload) if first_payload is not None else 0
+
+    def receive(self, sock):
+        if self._pending is not None:
+            pay_load, self._pending = self._pending, None
+        else:
+            count = sock.recv_into(self._buffer)
+            if count == 0:
+                raise ConnectionError("The game closed the connection")
+            pay_load = self._buffer[:count]
+            self.bytes_received += count
+        return GameState(json.loads(pay_load))
+
+    def send(self, sock, command):
+        pay_load = json.dumps(command.object_to_dict()).encode()
+        sock.sendall(pay_load)
+        self.bytes_sent += len(pay_load)
+
+
+class BinaryCodec:
+    """Fixed-size packed states and commands; states are read into one reused buffer."""
+
+    name = 'binary'
+
+    def __init__(self, version=WIRE_VERSION):
+        self.version = version
+        self._buffer = bytearray(STATE.size)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def receive(self, sock):
+        self.bytes_received += STATE.size
+        return GameState(decode_state(recv_exact(sock, self._buffer)))
+
+    def send(self, sock, command):
+        sock.sendall(encode_command(command, self.version))
+        self.bytes_sent += COMMAND.size
+
+
+def negotiate(sock):
+    """
+    Pick the codec of a newly accepted game connection (bot side).
+
+    A game that speaks the binary protocol opens with HELLO and gets it back with the version
+    both sides support; anything else is the first JSON state of a game that does not, which
+    the returned JsonCodec hands out on its first receive.
+
+    Returns:
+        JsonCodec or BinaryCodec
+    """
+    first = sock.recv(4096)
+    if not first:
+        raise ConnectionError("The game closed the connection before the first state")
+    if first[:len(WIRE_MAGIC)] == WIRE_MAGIC and len(first) == HELLO.size:
+        _, offered = HELLO.unpack(first)
+        version = min(offered, WIRE_VERSION)
+        sock.sendall(HELLO.pack(WIRE_MAGIC, version))
+        return BinaryCodec(version)
+    return JsonCodec(first)
+
+
+class StandInGame:
+    """
+    Game side of the protocol for local tests: plays the simulator, sends its states and applies the bot's commands.
+
+    It connects to the bot's port as the emulator does, offers the binary protocol if asked
+    to, and otherwise speaks JSON like the emulator's script. The player the bot does not
+    control is played by an in-process rule Bot.
+    """
+
+    def __init__(self, port, wire='binary', player='1', seed=0, frames=None):
+        """
+        Args:
+            port: Port the bot listens on (9999 for Player 1, 10000 for Player 2)
+            wire: 'binary' to offer the packed protocol, 'json' to behave like the emulator
+            player: Player the bot controls
+            seed: Simulator and opponent seed
+            frames: End the round after this many frames (the last state is sent as round over)
+        """
+        self.port = port
+        self.wire = wire
+        self.player = player
+        self.seed = seed
+        self.frames = frames
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_played = 0
+
+    def _send_state(self, sock, input_dict, binary):
+        pay_load = encode_state(input_dict) if binary else json.dumps(input_dict).encode()
+        sock.sendall(pay_load)
+        self.bytes_sent += len(pay_load)
+
+    def _receive_command(self, sock, binary, buffer):
+        if binary:
+            self.bytes_received += len(buffer)
+            return decode_command(recv_exact(sock, buffer))
+        pay_load = sock.recv(4096)
+        self.bytes_received += len(pay_load)
+        return json.loads(pay_load.decode())
+
+    def run(self):
+        """Play one round against the bot listening on the port. Returns the seconds it took."""
+        with socket.create_connection(('127.0.0.1', self.port)) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            binary = False
+            if self.wire == 'binary':
+                sock.sendall(HELLO.pack(WIRE_MAGIC, WIRE_VERSION))
+                magic, _ = HELLO.unpack(recv_exact(sock, bytearray(HELLO.size)))
+                binary = magic == WIRE_MAGIC
+            buffer = bytearray(COMMAND.size)
+            return self.play(lambda input_dict: self._send_state(sock, input_dict, binary),
+                             lambda: self._receive_command(sock, binary, buffer))
+
+    def play(self, send_state, receive_command):
+        """
+        Play one round over an open connection, up to and including the round_over state.
+
+        Args:
+            send_state: Called with every game state dict
+            receive_command: Returns the bot's command dict for the state sent last
+
+        Returns:
+            Seconds the round took
+        """
+        from simulator import FightSimulator, make_bot
+
+        np.random.seed(self.seed)
+        simulator = FightSimulator(seed=self.seed)
+        opponent = make_bot('rule')
+        opponent_side = '2' if self.player == '1' else '1'
+        input_dict = simulator.reset()
+        start = time.perf_counter()
+        # The rule Bot prints every input it makes
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            while True:
+                if self.frames is not None and self.frames_played >= self.frames:
+                    input_dict['round_over'] = True
+                send_state(input_dict)
+                if input_dict['round_over']:
+                    break
+                command_dict = receive_command()
+                other = opponent.fight(GameState(input_dict), opponent_side)
+                other_buttons = (other.player_buttons if opponent_side == '1'
+                                 else other.player2_buttons).object_to_dict()
+                if self.player == '1':
+                    input_dict = simulator.step(command_dict['p1'], other_buttons)
+                else:
+                    input_dict = simulator.step(other_buttons, command_dict['p2'])
+                self.frames_played += 1
+        return time.perf_counter() - start
+
+
+def _serve_one(codec_wire, frames, bot, seed=0):
+    """Accept one stand-in game on a free port and play it with the bot; returns (game, codec, seconds)."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    game = StandInGame(listener.getsockname()[1], codec_wire, '1', seed, frames)
+    thread = threading.Thread(target=game.run)
+    thread.start()
+    client_socket, _ = listener.accept()
+    listener.close()
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    start = time.perf_counter()
+    codec = negotiate(client_socket)
+    game_state = codec.receive(client_socket)
+    while not game_state.is_round_over:
+        codec.send(client_socket, bot.fight(game_state, '1'))
+        game_state = codec.receive(client_socket)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    client_socket.close()
+    return game, codec, elapsed
+
+
+def benchmark(frames=DEFAULT_BENCH_FRAMES, seed=0):
+    """
+    Bytes per frame and decode microseconds per frame of both codecs on simulated frames, then
+    a loopback round trip of each through negotiate() against the stand-in game.
+    """
+    from simulator import FightSimulator, fight, make_bot
+
+    # Frames as the game would send them, with the commands the bots answered them with
+    states, commands = [], []
+
+    def record(game_state, command1, command2):
+        states.append(simulator.state())
+        commands.append(_copy_command(command1, command2))
+
+    simulator = FightSimulator(seed=seed)
+    np.random.seed(seed)
+    while len(states) < frames:
+        fight(make_bot('rule'), make_bot('rule'), simulator, on_frame=record)
+    states, commands = states[:frames], commands[:frames]
+
+    json_states = [json.dumps(state).encode() for state in states]
+    binary_states = [encode_state(state) for state in states]
+    if any(decode_state(packed) != json.loads(text) for packed, text in zip(binary_states, json_states)):
+        raise RuntimeError("Binary states do not decode to the JSON states")
+    json_commands = [json.dumps(command.object_to_dict()).encode() for command in commands]
+    binary_commands = [encode_command(command) for command in commands]
+    for packed, text in zip(binary_commands, json_commands):
+        if decode_command(packed) != json.loads(text):
+            raise RuntimeError("Binary commands do not decode to the JSON commands")
+
+    def per_frame_us(function, payloads):
+        start = time.perf_counter()
+        for pay_load in payloads:
+            function(pay_load)
+        return (time.perf_counter() - start) * 1e6 / len(payloads)
+
+    rows = {
+        'json': (json_states, json_commands, lambda p: GameState(json.loads(p.decode())),
+                 lambda c: json.dumps(c.object_to_dict()).encode()),
+        'binary': (binary_states, binary_commands, lambda p: GameState(decode_state(p)), encode_command),
+    }
+    print(f"{len(states)} simulated frames, identical after decoding with either codec\n")
+    print(f"{'codec':<8} {'state B':>8} {'command B':>9} {'decode us':>9} {'encode cmd us':>13}")
+    for name, (state_payloads, command_payloads, decode, encode) in rows.items():
+        print(f"{name:<8} {np.mean([len(p) for p in state_payloads]):>8.1f} "
+              f"{np.mean([len(p) for p in command_payloads]):>9.1f} {per_frame_us(decode, state_payloads):>9.2f} "
+              f"{per_frame_us(encode, commands):>13.2f}")
+
+    print(f"\n{'loopback':<8} {'frames':>7} {'B/frame':>8} {'frames/s':>9}")
+    for wire in ('json', 'binary'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            game, codec, elapsed = _serve_one(wire, frames, make_bot('rule'), seed)
+        per_frame = (game.bytes_sent + game.bytes_received) / max(game.frames_played, 1)
+        print(f"{codec.name:<8} {game.frames_played:>7} {per_frame:>8.1f} {game.frames_played / elapsed:>9.0f}")
+
+
+def _copy_command(command1, command2):
+    command = Command()
+    command.player_buttons = Buttons(command1.player_buttons.object_to_dict())
+    command.player2_buttons = Buttons(command2.player2_buttons.object_to_dict())
+    return command
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Binary wire codec: stand-in game and benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Stand-in game: connect to a bot and play one simulated round')
+    serve_parser.add_argument('player', choices=['1', '2'], help='Player the bot controls')
+    serve_parser.add_argument('--wire', choices=['binary', 'json'], default='binary',
+                              help='Offer the binary protocol, or speak JSON like the emulator (default: binary)')
+    serve_parser.add_argument('--frames', type=int, default=None, help='End the round after this many frames')
+    serve_parser.add_argument('--seed', type=int, default=0)
+
+    bench_parser = subparsers.add_parser('bench', help='Compare the codecs on simulated frames and over loopback')
+    bench_parser.add_argument('--frames', type=int, default=DEFAULT_BENCH_FRAMES,
+                              help=f'Frames compared (default: {DEFAULT_BENCH_FRAMES})')
+    bench_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        stand_in = StandInGame(9999 if args.player == '1' else 10000, args.wire, args.player, args.seed, args.frames)
+        seconds = stand_in.run()
+        print(f"{stand_in.frames_played} frames in {seconds:.2f}s ({args.wire}): "
+              f"{stand_in.bytes_sent / max(stand_in.frames_played, 1):.1f} state bytes and "
+              f"{stand_in.bytes_received / max(stand_in.frames_played, 1):.1f} command bytes per frame")
+    else:
+        benchmark(args.frames, args.seed)